@@ -0,0 +1,145 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+#######################################################################################
+#### C A L I B R A T I O N ############################################################
+#######################################################################################
+# The solver camera is rarely on the optical axis of the telescope, so the solved centre
+# of the frame is not where the eyepiece is looking. A Sync records that offset once: the
+# user centres an object in the eyepiece, the mount coordinates are taken as the scope's
+# centre of field and a solve gives the camera's. The offset is kept in the camera's own
+# frame (rotated by the solved CROTA2) so it still applies if the field rotates, and is
+# saved per setup (telescope + camera) in calibration.json so the next session uses it
+# straight away without a calibration solve.
+#
+# Every sync adds a revision, the last few are kept so a bad sync can be undone with
+# "python calibration.py revert <setup>".
+Offset = namedtuple("Offset", ["x", "y", "rotation", "revision", "time"])
+
+storeVersion = 1
+keepRevisions = 10
+
+# Gnomonic projection of (ra, dec) about (ra0, dec0), all degrees, returns xi/eta in degrees.
+# Scalars or NumPy arrays, starsolve.py projects whole star lists with these.
+def project(ra, dec, ra0, dec0):
+    ra, dec, ra0, dec0 = map(np.radians, (ra, dec, ra0, dec0))
+    cosC = np.sin(dec0)*np.sin(dec)+np.cos(dec0)*np.cos(dec)*np.cos(ra-ra0)
+    xi = np.cos(dec)*np.sin(ra-ra0)/cosC
+    eta = (np.cos(dec0)*np.sin(dec)-np.sin(dec0)*np.cos(dec)*np.cos(ra-ra0))/cosC
+    return np.degrees(xi), np.degrees(eta)
+
+# Inverse of project()
+def deproject(xi, eta, ra0, dec0):
+    xi, eta, ra0, dec0 = map(np.radians, (xi, eta, ra0, dec0))
+    denominator = np.cos(dec0)-eta*np.sin(dec0)
+    ra = ra0+np.arctan2(xi, denominator)
+    dec = np.arctan2(np.sin(dec0)+eta*np.cos(dec0), np.hypot(xi, denominator))
+    return np.degrees(ra) % 360, np.degrees(dec)
+
+def rotate(x, y, angle):
+    a = math.radians(angle)
+    return x*math.cos(a)-y*math.sin(a), x*math.sin(a)+y*math.cos(a)
+
+# The rotation to use from a Solution's crota, 0 when ASTAP did not report one
+def rotationOf(crota):
+    if crota is None:
+        return 0.0
+    if isinstance(crota, (tuple, list)):
+        crota = crota[-1] if crota[-1] is not None else crota[0]
+    return float(crota) if crota is not None else 0.0
+
+class CalibrationStore:
+    def __init__(self, path="calibration.json"):
+        self.path = path
+        self.setups = {}                       # Setup name -> list of Offsets, newest last
+        self.lock = threading.Lock()
+        self.load()
+
+    # Load the store, an old or damaged file is ignored rather than stopping the panel
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                stored = json.load(f)
+            if stored.get("version") != storeVersion:
+                return False
+            self.setups = {setup: [Offset(*entry) for entry in entries]
+                           for setup, entries in stored["setups"].items()}
+        except (ValueError, KeyError, TypeError) as e:
+            print("Ignoring calibration store "+self.path+" -- ", e)
+            return False
+        return True
+
+    def save(self):
+        if self.path is None:
+            return
+        stored = {"version": storeVersion,
+                  "setups": {setup: [list(entry) for entry in entries] for setup, entries in self.setups.items()}}
+        temp = self.path+".tmp"
+        with open(temp, "w") as f:
+            json.dump(stored, f, indent=1)
+        os.replace(temp, self.path)
+
+    # The current offset for a setup, None if it has never been synced
+    def offset(self, setup):
+        entries = self.setups.get(setup)
+        return entries[-1] if entries else None
+
+    # Record a sync. scopeRa/Dec is where the eyepiece is (the mount coordinates after the
+    # user centred the object), solvedRa/Dec and crota come from the solve. RA in hours.
+    def sync(self, setup, scopeRa, scopeDec, solvedRa, solvedDec, crota=None):
+        rotation = rotationOf(crota)
+        xi, eta = project(scopeRa*15, scopeDec, solvedRa*15, solvedDec)
+        x, y = rotate(xi, eta, -rotation)
+        with self.lock:
+            entries = self.setups.setdefault(setup, [])
+            revision = entries[-1].revision+1 if entries else 1
+            entries.append(Offset(x, y, rotation, revision, time.time()))
+            del entries[:-keepRevisions]
+            self.save()
+            return entries[-1]
+
+    # Drop the newest revision of a setup, returns the offset now in use
+    def revert(self, setup):
+        with self.lock:
+            entries = self.setups.get(setup)
+            if entries:
+                entries.pop()
+                if not entries:
+                    del self.setups[setup]
+                self.save()
+            return self.offset(setup)
+
+    # Where the scope is looking given a solve of the camera frame, RA in hours. Without a
+    # calibration the camera is taken to be on axis.
+    def apply(self, setup, solvedRa, solvedDec, crota=None):
+        offset = self.offset(setup)
+        if offset is None:
+            return solvedRa, solvedDec
+        xi, eta = rotate(offset.x, offset.y, rotationOf(crota))
+        ra, dec = deproject(xi, eta, solvedRa*15, solvedDec)
+        return ra/15, dec
+
+# Name a setup by its devices, so swapping the camera or scope gets its own offset
+def setupName(telescope, ccd):
+    return telescope+" / "+ccd
+
+# python calibration.py [calibration.json] lists the setups, "revert <setup>" undoes a sync
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    path = args.pop(0) if args and args[0].endswith(".json") else "calibration.json"
+    store = CalibrationStore(path)
+    if len(args) == 2 and args[0] == "revert":
+        store.revert(args[1])
+    for setup, entries in store.setups.items():
+        for entry in entries:
+            print("%-40s rev %3d  %s  offset %7.1f\" %7.1f\"  rotation %6.1f" %
+                  (setup, entry.revision, time.strftime("%Y-%m-%d %H:%M", time.localtime(entry.time)),
+                   entry.x*3600, entry.y*3600, entry.rotation))
@@ -0,0 +1,117 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+import numpy as np
+
+#######################################################################################
+#### C A T A L O G ####################################################################
+#######################################################################################
+# CatalogIndex holds the objects and tours tables in memory so a Goto is a dictionary
+# lookup instead of a MySQL round trip. Names are normalised so "Messier 31", "M31" and
+# "M 31" all find the same row. refresh() compares the versions of the store's tables
+# (table checksums for MySQL) and reloads only the table that changed, and every
+# successful load is snapshotted to disk so the panel still finds objects when the
+# database is slow or down.
+prefixes = (("MESSIER", "M"), ("CALDWELL", "C"))
+
+# Normalise an object or tour name to its lookup key, e.g. "Messier 31" -> "M31"
+def normalizeName(name):
+    key = re.sub(r"\s+", "", str(name).upper())
+    for long, short in prefixes:
+        if key.startswith(long):
+            key = short+key[len(long):]
+    return key
+
+class CatalogIndex:
+    def __init__(self, snapshotPath="catalog.json"):
+        self.snapshotPath = snapshotPath
+        self.names = []
+        self.ra = np.zeros(0)                  # Hours
+        self.dec = np.zeros(0)                 # Degrees
+        self.keys = {}                         # Normalised name -> row in the arrays
+        self.tours = {}                        # Normalised tour name -> list of object names
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    # Swap in a new set of objects, readers always see either the old or the new index
+    def setObjects(self, rows):
+        names = [str(row[0]) for row in rows]
+        ra = np.array([float(row[1]) for row in rows])
+        dec = np.array([float(row[2]) for row in rows])
+        keys = {normalizeName(name): i for i, name in enumerate(names)}
+        self.names, self.ra, self.dec, self.keys = names, ra, dec, keys
+
+    def setTours(self, rows):
+        tours = {}
+        for row in rows:
+            tours.setdefault(normalizeName(row[0]), []).append(str(row[1]))
+        self.tours = tours
+
+    # Return (name, ra, dec) for an object, None if it is not in the catalog
+    def lookup(self, name):
+        keys, names, ra, dec = self.keys, self.names, self.ra, self.dec
+        i = keys.get(normalizeName(name))
+        if i is None:
+            return None
+        return names[i], float(ra[i]), float(dec[i])
+
+    # Return the object names of a tour in table order, None if there is no such tour
+    def tour(self, name):
+        return self.tours.get(normalizeName(name))
+
+    # Load the tables from a catalog store (see catalogstore.py), only those whose version
+    # changed since the last load. Returns True if anything was reloaded.
+    def refresh(self, store):
+        with self.lock:
+            versions = store.versions()
+            changed = [table for table in ("objects", "tours")
+                       if versions.get(table) is None or versions[table] != self.versions.get(table)]
+            for table in changed:
+                if table == "objects":
+                    self.setObjects(store.objects())
+                else:
+                    self.setTours(store.tours())
+            self.versions = versions
+            if changed:
+                self.save()
+            return bool(changed)
+
+    # Snapshot the index so it can be loaded without MySQL
+    def save(self):
+        if self.snapshotPath is None:
+            return
+        snapshot = {"objects": [[n, r, d] for n, r, d in zip(self.names, self.ra.tolist(), self.dec.tolist())],
+                    "tours": self.tours}
+        temp = self.snapshotPath+".tmp"
+        with open(temp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(temp, self.snapshotPath)
+
+    # Load the last snapshot, returns False if there is none
+    def loadSnapshot(self):
+        if not os.path.exists(self.snapshotPath):
+            return False
+        with open(self.snapshotPath) as f:
+            snapshot = json.load(f)
+        self.setObjects(snapshot["objects"])
+        self.tours = snapshot["tours"]
+        return True
+
+# python catalog.py [catalog.json] times lookups against the snapshot
+if __name__ == "__main__":
+    index = CatalogIndex(sys.argv[1] if len(sys.argv) > 1 else "catalog.json")
+    if not index.loadSnapshot():
+        index.setObjects([("M %d" % i, i % 24, i % 90) for i in range(1, 111)] +
+                         [("NGC %d" % i, i % 24, i % 90) for i in range(1, 7841)])
+    queries = [index.names[i] for i in range(0, len(index), max(1, len(index)//1000))]
+    start = time.perf_counter()
+    for name in queries:
+        index.lookup(name)
+    elapsed = time.perf_counter()-start
+    print("%d objects, %.4f ms per lookup" % (len(index), elapsed*1000/len(queries)))
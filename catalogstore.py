@@ -0,0 +1,294 @@
+import csv
+import os
+import sqlite3
+import struct
+import subprocess
+import sys
+import time
+import numpy as np
+
+from catalog import normalizeName
+
+#######################################################################################
+#### C A T A L O G   S T O R E S ######################################################
+#######################################################################################
+# A catalog store is where the objects and tours live on disk. The CatalogIndex loads
+# from any of them, so the panel no longer needs a MySQL server just to resolve names:
+#
+#   MySQLStore   the original pyindicontrolpad database (read only), through database.py
+#   SQLiteStore  a single catalog.db file, like archivControlpanel.py's observations
+#   BinaryStore  a packed, sorted record file that is memory-mapped, looked up by binary
+#                search without being read into memory at all
+#
+# Every store returns objects as (name, ra hours, dec degrees) and tours as
+# (tour name, object name) rows in tour order, and versions() returns a token per table
+# that changes when the table does.
+class CatalogStore:
+    def objects(self):
+        raise NotImplementedError
+
+    def tours(self):
+        raise NotImplementedError
+
+    def versions(self):
+        raise NotImplementedError
+
+    # Direct lookup without the index, None if the object is not in the store
+    def lookup(self, name):
+        key = normalizeName(name)
+        for row in self.objects():
+            if normalizeName(row[0]) == key:
+                return row
+        return None
+
+    # Object names of a tour in order, None if there is no such tour
+    def tour(self, name):
+        key = normalizeName(name)
+        objects = [row[1] for row in self.tours() if normalizeName(row[0]) == key]
+        return objects or None
+
+    # Replace the whole catalog, stores that can be written override this
+    def write(self, objects, tours):
+        raise NotImplementedError(self.__class__.__name__+" is read only")
+
+    def close(self):
+        pass
+
+# The MySQL store goes through database.Database, pooled connections and prepared
+# statements with parameters. Tours are read in the same order as the SQLite store,
+# by tour name and then the seq column (see the README for the tables).
+class MySQLStore(CatalogStore):
+    objectsQuery = "select * from objects"
+    toursQuery = "select name, object from tours order by name, seq"
+    versionsQuery = "checksum table objects, tours"
+    objectQuery = "select * from objects where name=%s"
+    tourQuery = "select name, object from tours where name=%s order by seq"
+
+    def __init__(self, database):
+        self.database = database
+
+    def objects(self):
+        return [(row[0], float(row[1]), float(row[2])) for row in self.database.query(self.objectsQuery)]
+
+    def tours(self):
+        return [(row[0], row[1]) for row in self.database.query(self.toursQuery)]
+
+    def versions(self):
+        return {row[0].split(".")[-1]: row[1] for row in self.database.query(self.versionsQuery)}
+
+    def lookup(self, name):
+        rows = self.database.query(self.objectQuery, (name,))
+        return (rows[0][0], float(rows[0][1]), float(rows[0][2])) if rows else None
+
+    def tour(self, name):
+        return [row[1] for row in self.database.query(self.tourQuery, (name,))] or None
+
+class SQLiteStore(CatalogStore):
+    def __init__(self, path="catalog.db"):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, name TEXT, ra REAL, dec REAL);
+            CREATE TABLE IF NOT EXISTS tours (name TEXT, seq INTEGER, object TEXT, PRIMARY KEY (name, seq));
+        ''')
+
+    def objects(self):
+        return self.connection.execute("SELECT name, ra, dec FROM objects").fetchall()
+
+    def tours(self):
+        return self.connection.execute("SELECT name, object FROM tours ORDER BY name, seq").fetchall()
+
+    def versions(self):
+        c = self.connection
+        return {"objects": c.execute("SELECT count(*), total(ra), total(dec) FROM objects").fetchone(),
+                "tours": c.execute("SELECT count(*), group_concat(object) FROM tours").fetchone()}
+
+    def lookup(self, name):
+        return self.connection.execute("SELECT name, ra, dec FROM objects WHERE key = ?",
+                                       (normalizeName(name),)).fetchone()
+
+    def write(self, objects, tours):
+        with self.connection as c:
+            c.execute("DELETE FROM objects")
+            c.execute("DELETE FROM tours")
+            c.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)",
+                          [(normalizeName(n), n, float(r), float(d)) for n, r, d in objects])
+            c.executemany("INSERT INTO tours VALUES (?, ?, ?)",
+                          [(t, i, o) for i, (t, o) in enumerate(tours)])
+
+    def close(self):
+        self.connection.close()
+
+# Binary catalog file: a header, the object records sorted by normalised key, then the
+# tour records in tour order. Names are stored as fixed width ASCII.
+binaryMagic = b"PICAT001"
+binaryHeader = struct.Struct("<8sII")
+objectRecord = np.dtype([("key", "S24"), ("name", "S32"), ("ra", "<f8"), ("dec", "<f8")])
+tourRecord = np.dtype([("name", "S32"), ("object", "S32")])
+
+class BinaryStore(CatalogStore):
+    def __init__(self, path="catalog.bin"):
+        self.path = path
+        self.records = None
+        self.tourRecords = None
+        if os.path.exists(path):
+            self.open()
+
+    def open(self):
+        with open(self.path, "rb") as f:
+            magic, objectCount, tourCount = binaryHeader.unpack(f.read(binaryHeader.size))
+        if magic != binaryMagic:
+            raise ValueError(self.path+" is not a catalog file")
+        offset = binaryHeader.size
+        self.records = np.memmap(self.path, dtype=objectRecord, mode="r", offset=offset,
+                                 shape=(objectCount,)) if objectCount else np.zeros(0, objectRecord)
+        offset += objectCount*objectRecord.itemsize
+        self.tourRecords = np.memmap(self.path, dtype=tourRecord, mode="r", offset=offset,
+                                     shape=(tourCount,)) if tourCount else np.zeros(0, tourRecord)
+
+    def objects(self):
+        return [(r["name"].decode(), float(r["ra"]), float(r["dec"])) for r in self.records]
+
+    def tours(self):
+        return [(r["name"].decode(), r["object"].decode()) for r in self.tourRecords]
+
+    def versions(self):
+        stat = os.stat(self.path)
+        return {"objects": (stat.st_mtime_ns, stat.st_size), "tours": (stat.st_mtime_ns, stat.st_size)}
+
+    # Binary search on the mapped keys, only the pages touched are read from disk
+    def lookup(self, name):
+        key = normalizeName(name).encode("ascii", "replace")[:24]
+        keys = self.records["key"]
+        i = int(np.searchsorted(keys, key))
+        if i < len(keys) and keys[i] == key:
+            r = self.records[i]
+            return r["name"].decode(), float(r["ra"]), float(r["dec"])
+        return None
+
+    def write(self, objects, tours):
+        unique = {}
+        for n, r, d in objects:
+            unique[normalizeName(n).encode("ascii", "replace")[:24]] = (n, r, d)
+        records = np.zeros(len(unique), objectRecord)
+        for i, key in enumerate(sorted(unique)):
+            n, r, d = unique[key]
+            records[i] = (key, str(n).encode("ascii", "replace")[:32], float(r), float(d))
+        tourRecords = np.array([(str(t).encode("ascii", "replace")[:32], str(o).encode("ascii", "replace")[:32])
+                                for t, o in tours], dtype=tourRecord)
+        self.close()
+        temp = self.path+".tmp"
+        with open(temp, "wb") as f:
+            f.write(binaryHeader.pack(binaryMagic, len(records), len(tourRecords)))
+            f.write(records.tobytes())
+            f.write(tourRecords.tobytes())
+        os.replace(temp, self.path)
+        self.open()
+
+    def close(self):
+        self.records = None
+        self.tourRecords = None
+
+# Open a store from a spec such as "sqlite:catalog.db" or "binary:catalog.bin". MySQL
+# stores need the database, so they are created with MySQLStore(Database(...)) directly.
+def openStore(spec):
+    kind, _, path = spec.partition(":")
+    if kind == "sqlite":
+        return SQLiteStore(path or "catalog.db")
+    if kind == "binary":
+        return BinaryStore(path or "catalog.bin")
+    raise ValueError("Unknown catalog store "+spec)
+
+#######################################################################################
+#### L O A D E R ######################################################################
+#######################################################################################
+# Read objects from CSV files with name,ra,dec columns (RA in hours, Dec in degrees), e.g.
+# exports of the Messier, NGC and Caldwell catalogs, and tours from CSV files with
+# tour,object columns in the order the tour should be run. A header row is skipped.
+def readCsv(path, columns):
+    rows = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < columns or not row[0].strip() or row[0].startswith("#"):
+                continue
+            if columns == 2:
+                rows.append((row[0].strip(), row[1].strip()))
+                continue
+            try:
+                rows.append((row[0].strip(), float(row[1]), float(row[2])))
+            except ValueError:
+                continue                       # Header line
+    return rows
+
+def importCatalog(store, objectFiles=(), tourFiles=(), source=None):
+    objects = list(source.objects()) if source else []
+    tours = list(source.tours()) if source else []
+    for path in objectFiles:
+        objects += readCsv(path, 3)
+    for path in tourFiles:
+        tours += readCsv(path, 2)
+    store.write(objects, tours)
+    return len(objects), len(tours)
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+def residentKb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+# Open one store and time lookups of every step'th NGC object. Runs in a child process so
+# the resident memory reported is the store's own. "index:<spec>" measures the in-memory
+# CatalogIndex loaded from that store, which is what the panel uses by default.
+def benchStore(spec, step):
+    names = ["NGC %d" % i for i in range(1, 14000, step)]
+    before = residentKb()
+    start = time.perf_counter()
+    if spec == "mysql":
+        from database import Database
+        store = MySQLStore(Database(host='localhost', database='pyindicontrolpad',
+                                    user='pyindicontrolpad', password='secret'))
+    elif spec.startswith("index:"):
+        from catalog import CatalogIndex
+        store = CatalogIndex(snapshotPath=None)
+        store.refresh(openStore(spec[6:]))
+    else:
+        store = openStore(spec)
+    opened = time.perf_counter()-start
+    start = time.perf_counter()
+    for name in names:
+        store.lookup(name)
+    lookup = (time.perf_counter()-start)/len(names)
+    print("%-8s open %8.2f ms  lookup %8.4f ms  resident +%d kB" %
+          (spec.split(":")[0], opened*1000, lookup*1000, residentKb()-before))
+
+# python catalogstore.py import <store> [objects.csv ...] [--tours tours.csv ...]
+# python catalogstore.py bench
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "import":
+        args = sys.argv[3:]
+        split = args.index("--tours") if "--tours" in args else len(args)
+        print("Imported %d objects and %d tour entries" %
+              importCatalog(openStore(sys.argv[2]), args[:split], args[split+1:]))
+    elif len(sys.argv) > 2 and sys.argv[1] == "bench-one":
+        benchStore(sys.argv[2], int(sys.argv[3]))
+    else:
+        import tempfile
+        rng = np.random.default_rng(1)
+        objects = [("Messier %d" % i, rng.uniform(0, 24), rng.uniform(-30, 90)) for i in range(1, 111)]
+        objects += [("Caldwell %d" % i, rng.uniform(0, 24), rng.uniform(-90, 90)) for i in range(1, 110)]
+        objects += [("NGC %d" % i, rng.uniform(0, 24), rng.uniform(-90, 90)) for i in range(1, 14000)]
+        tours = [("TOUR 1", "M %d" % i) for i in range(1, 111)]
+        workdir = tempfile.mkdtemp()
+        sqlite = "sqlite:"+os.path.join(workdir, "catalog.db")
+        binary = "binary:"+os.path.join(workdir, "catalog.bin")
+        openStore(sqlite).write(objects, tours)
+        openStore(binary).write(objects, tours)
+        for spec in (sqlite, binary, "index:"+binary):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "bench-one", spec, "100"])
+        # The MySQL store benchmarks whatever is in the pyindicontrolpad database, if reachable
+        subprocess.run([sys.executable, os.path.abspath(__file__), "bench-one", "mysql", "100"],
+                       stderr=subprocess.DEVNULL)
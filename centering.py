@@ -0,0 +1,184 @@
+import math
+import sys
+from collections import namedtuple
+import numpy as np
+
+#######################################################################################
+#### C E N T E R I N G ################################################################
+#######################################################################################
+# CenteringEngine closes the loop between the plate solver and the mount. Each solve adds
+# a (mount position, solved position) pair and per axis the engine fits
+#
+#     solved = offset + gain * mount + backlash * direction of the last move
+#
+# by least squares over the pairs so far, where backlash is the (signed) half deadband of
+# the drive. The pointing offset is fitted afresh for every target, gain and backlash are
+# properties of the mount and carry over from one target to the next. The next command is
+# the mount position the model says puts the target in the centre of the field, so a
+# pointing offset is removed in one move and a mount that over or undershoots is learned
+# within the first target or two. Everything is in degrees internally, RA goes in and out
+# in hours as INDI's EQUATORIAL_EOD_COORD uses.
+CENTRED = "CENTRED"
+MOVE = "MOVE"
+FAILED = "FAILED"
+
+Step = namedtuple("Step", ["status", "ra", "dec", "error", "iteration"])
+
+# Difference a-b in degrees, wrapped to +-180 so 359 and 1 are 2 degrees apart
+def wrap(a, b):
+    return (a-b+180) % 360-180
+
+class CenteringEngine:
+    def __init__(self, tolerance=30, maxIterations=6):
+        self.tolerance = tolerance             # Arcsecs
+        self.maxIterations = maxIterations
+        self.gain = [1.0, 1.0]                 # Learned mount response per axis
+        self.backlash = [0.0, 0.0]             # Degrees
+        self.target = None
+        self.direction = (0, 0)
+        self.reset()
+
+    def reset(self):
+        self.mount = []                        # Mount positions of each solve, degrees
+        self.solved = []                       # Solved positions, degrees
+        self.directions = []                   # Direction of the move before each solve
+        self.errors = []
+
+    # Begin centring on a new target, RA in hours and Dec in degrees. fromRa/fromDec is
+    # where the mount was before the Goto, so the approach direction is known.
+    def start(self, ra, dec, fromRa=None, fromDec=None):
+        self.target = (ra*15, dec)
+        self.direction = (0, 0)
+        if fromRa is not None:
+            self.direction = (int(np.sign(wrap(ra*15, fromRa*15))), int(np.sign(dec-fromDec)))
+        self.reset()
+
+    # Pointing error in arcsecs between a solved position and the target
+    def error(self, solvedRa, solvedDec):
+        dRa = wrap(solvedRa, self.target[0])*math.cos(math.radians(self.target[1]))
+        return math.hypot(dRa, solvedDec-self.target[1])*3600
+
+    # Fit the model for one axis and return the mount position that should put the target
+    # in the centre of the field, with the direction of the move to get there
+    def predict(self, axis):
+        mount = np.array([m[axis] for m in self.mount])
+        solved = np.array([s[axis] for s in self.solved])
+        direction = np.array([d[axis] for d in self.directions], dtype=float)
+        # Work relative to the first point so RA wrapping does not upset the fit
+        origin = mount[0]
+        x = wrap(mount, origin) if axis == 0 else mount-origin
+        y = wrap(solved, origin) if axis == 0 else solved-origin
+        target = wrap(self.target[axis], origin) if axis == 0 else self.target[axis]-origin
+
+        gain, backlash = self.gain[axis], self.backlash[axis]
+        if len(x) >= 2 and np.ptp(x) > 1e-6:
+            if len(x) >= 3 and np.any(direction > 0) and np.any(direction < 0):
+                columns, fixed = [np.ones_like(x), x, direction], 0
+            else:
+                columns, fixed = [np.ones_like(x), x], backlash*direction
+            fit = np.linalg.lstsq(np.column_stack(columns), y-fixed, rcond=None)[0]
+            # A wild gain means the solves are too noisy to fit, keep what we knew
+            if 0.5 < fit[1] < 1.5:
+                gain = self.gain[axis] = fit[1]
+                if len(fit) > 2:
+                    backlash = self.backlash[axis] = fit[2]
+        offset = np.mean(y-gain*x-backlash*direction)
+
+        command = (target-offset)/gain
+        moveDirection = int(np.sign(command-x[-1]))
+        command = (target-offset-backlash*moveDirection)/gain
+        return command+origin, moveDirection
+
+    # Record a solve and decide what to do next. mountRa/Dec is where the mount said it was
+    # when the frame was taken, solvedRa/Dec where the solver found it. RA in hours.
+    def update(self, mountRa, mountDec, solvedRa, solvedDec):
+        self.mount.append((mountRa*15, mountDec))
+        self.solved.append((solvedRa*15, solvedDec))
+        self.directions.append(self.direction)
+        error = self.error(solvedRa*15, solvedDec)
+        self.errors.append(error)
+        iteration = len(self.errors)
+
+        if error <= self.tolerance:
+            return Step(CENTRED, mountRa, mountDec, error, iteration)
+        # Give up when out of moves or when two corrections in a row made things worse
+        if iteration > self.maxIterations or (iteration >= 3 and self.errors[-1] > self.errors[-2] > self.errors[-3]):
+            return Step(FAILED, mountRa, mountDec, error, iteration)
+
+        ra, raDirection = self.predict(0)
+        dec, decDirection = self.predict(1)
+        self.direction = (raDirection, decDirection)
+        return Step(MOVE, (ra % 360)/15, max(-90.0, min(90.0, dec)), error, iteration)
+
+#######################################################################################
+#### S I M U L A T I O N ##############################################################
+#######################################################################################
+# A mount with a pointing offset that changes from target to target, a drive gain error
+# and backlash, and a solver with a little noise, to count exposure/solve cycles per target
+class SimulatedMount:
+    def __init__(self, rng, offset=1.0, gainError=0.05, backlash=120, noise=2):
+        self.rng = rng
+        self.offsetRange = offset
+        self.gain = 1+rng.uniform(-gainError, gainError, 2)
+        self.backlash = rng.uniform(0, backlash, 2)/3600
+        self.noise = noise/3600
+        self.position = np.zeros(2)            # Mount coordinates, degrees
+        self.direction = np.zeros(2)
+        self.newTarget()
+
+    # Called once the Goto has arrived, the pointing offset changes over the sky and the
+    # drive gain applies to the corrections made from here
+    def newTarget(self):
+        self.offset = self.rng.uniform(-self.offsetRange, self.offsetRange, 2)
+        self.anchor = self.position.copy()
+
+    def slew(self, ra, dec):
+        command = np.array([ra*15, dec])
+        direction = np.sign(command-self.position)
+        self.direction = np.where(direction != 0, direction, self.direction)
+        self.position = command
+
+    # The optics trail the mount by half the backlash in the direction it last moved
+    def solve(self):
+        moved = np.array([wrap(self.position[0], self.anchor[0]), self.position[1]-self.anchor[1]])
+        sky = self.anchor+self.offset+self.gain*(moved-self.backlash/2*self.direction)
+        return (sky+self.rng.normal(0, self.noise, 2))*np.array([1/15, 1])
+
+# Centre on a target with the given engine, return the number of solves used
+def simulate(engine, sim, rng):
+    targetRa, targetDec = rng.uniform(0, 24), rng.uniform(-10, 70)
+    engine.start(targetRa, targetDec, sim.position[0]/15, sim.position[1])
+    sim.slew(targetRa, targetDec)
+    sim.newTarget()
+    for i in range(engine.maxIterations+1):
+        solvedRa, solvedDec = sim.solve()
+        step = engine.update(sim.position[0]/15, sim.position[1], solvedRa, solvedDec)
+        if step.status != MOVE:
+            return step.iteration, step.status == CENTRED
+        sim.slew(step.ra, step.dec)
+    return engine.maxIterations+1, False
+
+# Fixed single correction, mount = mount + (target - solved) each pass, for comparison
+class SingleCorrection(CenteringEngine):
+    def predict(self, axis):
+        last = self.mount[-1][axis]
+        error = wrap(self.target[axis], self.solved[-1][axis]) if axis == 0 else self.target[axis]-self.solved[-1][axis]
+        return last+error, 0
+
+# python centering.py [nights] [targets] compares the engine with a fixed single correction,
+# each night is one simulated mount visited by a series of targets
+if __name__ == "__main__":
+    nights = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    targets = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    for name, engineClass in (("single correction", SingleCorrection), ("centering engine", CenteringEngine)):
+        rng = np.random.default_rng(1)
+        results = []
+        for night in range(nights):
+            engine = engineClass(tolerance=30, maxIterations=10)
+            sim = SimulatedMount(rng)
+            results += [simulate(engine, sim, rng) for i in range(targets)]
+        solves = np.array([r[0] for r in results])
+        centred = np.array([r[1] for r in results])
+        print("%-18s solves to centre: mean %.2f, 95%% %.0f, worst %d, failed %d of %d" %
+              (name, solves[centred].mean(), np.percentile(solves[centred], 95), solves[centred].max(),
+               len(results)-centred.sum(), len(results)))
@@ -1,34 +1,55 @@
+import imports                          # First, it times the imports that follow
 import tkinter as tk
 import pytz
 from datetime import datetime
 import socket
 import PyIndi
 import time
-import numpy as np
-from astropy import wcs
-from astropy.wcs import WCS
-from astropy.table import Table
-from astropy.io import fits
-from astropy.coordinates import EarthLocation,SkyCoord
-from astropy.time import Time
-from astropy import units as u
-from astropy.coordinates import AltAz
-import photutils
 import sys
 import threading
 import os
 import subprocess as subp
 import math
-import mysql.connector
-from mysql.connector.errors import Error
 from datetime import datetime
 from tzlocal import get_localzone
+from indiclient import IndiClient, IndiCamera
+from startup import Startup, retry
+from render import Renderer
+from executor import Executor
+from solver import SolverRunner, SolveHints, SOLVED
+from pipeline import SolvePipeline
+from starsolve import LocalSolver, SolverChain, searchRadii
+from stars import describe
+from frames import Preprocess
+from centering import CenteringEngine, MOVE
+from calibration import CalibrationStore, setupName
+from observer import Observer, julianDate
+from catalog import CatalogIndex
+from planner import Planner
+from tours import TourEngine
+from route import RouteOptimizer, SlewModel
+from catalogstore import MySQLStore, openStore
+from database import Database
+
+imports.mark("panel imports")
 
 #######################################################################################
 #### V A R I A B L E S ################################################################
 #######################################################################################     
 debug=1
 exposure=5.0
+astap="/usr/local/bin/astap"
+solveTimeout=30                         # Seconds before a solve is killed
+solverEngine="astap"                    # "astap", "local" (in process, needs starIndex) or "local+astap"
+starIndex="stars.idx"                   # Star index for the local solver, built with starsolve.py index
+pipelined=False                         # Expose the next frame while the last one solves, nearly twice the exposures for slightly faster centring
+solveRadii=(5, 15, 50)                  # ASTAP search radius around the mount position in degrees, widened after a failed solve
+localRadius=2.0                         # Local solver search radius in degrees, tried first with "local" and "local+astap"
+fov=0                                   # Field height in degrees for ASTAP, 0 to read it from the frame header
+# Per camera binning, centre crop and bits of the frame handed to the solver, cameras not
+# listed are solved at full resolution
+preprocess={"CCD Simulator": Preprocess(binning=2, crop=1.0, bits=16)}
+testImage=""                            # Solve this file instead of the camera frame (astap won't solve ccd simulator images)
 telescope="Telescope Simulator"
 device_telescope=None
 telescope_connect=None
@@ -40,7 +61,16 @@ currLat = 49.8951
 currLong= -97.1384
 currAlt=300
 minAlt=15                            	# Minimum altitude to slew to
+catalogStore="mysql"                 	# "mysql", "sqlite:catalog.db" or "binary:catalog.bin"
+catalogRefresh=300                   	# Seconds between checks for catalog changes
+planStep=10                          	# Minutes between the altitudes in the night's visibility table
+tourOrder="listed"                   	# Tour order, "listed" as in the tours table, "setting" (setting first first) or "slew" (done soonest, least slewing)
+tourDwell=300                        	# Seconds spent at each tour object, for the "slew" order
+slewModel=SlewModel(azRate=4.0, altRate=4.0, settle=5.0)	# The mount's slew rates (deg/s) and settle time (s)
+calibrationFile="calibration.json"     	# Sync offsets between the solver camera and the scope, per setup
+compressBlobs=False                    	# Compressed BLOBs (".fits.z"), worth it when indiserver is on another Pi over Wi-Fi
 currTour=0				# Current tour we're working on
+observer=Observer(currLat, currLong, currAlt)	# Site location and AltAz frame, built once
    
 #######################################################################################
 #### F U N C T I O N S ################################################################
@@ -56,16 +86,40 @@ def mkhrs(time):
 # Object Display functions ###########################################################
 objectDisplay="Unknown"
 
-# prevObject reads a line from a tour.txt file and slews the telescope to that object
-def prevObject():
-    # to come
+# Every keypad button runs through press(), which times it, and the object line is
+# redrawn at once rather than on the next frame
+def press(action):
+    def run():
+        action()
+        renderer.set(currObjText, objectDisplay, immediate=True)
+    executor.press(run)
+
+# Prev and Next move along the tour Goto "TOUR n" loaded, skipping what is below minAlt,
+# and have the entry after the new one prefetched so its Goto slews at once
+def prevEntry():
+    tourStep(-1)
     return
-    
-# nextObject reads a line from a tour.txt file and slews the telescope to that object
-def nextObject():
-    # to come
+
+def nextEntry():
+    tourStep(1)
     return
 
+def tourStep(step):
+    global objectDisplay
+    name=tour.step(step)
+    if name is None:
+        renderer.flash(currStatusText, "NO TOUR")
+        return
+    objectDisplay=name
+    executor.submit("prefetch", prefetchJob, tour.upcoming(step))
+
+# On the worker thread, looks up, checks and warms the solve of the tour's next entries
+def prefetchJob(job, names):
+    for name in names:
+        if job.cancelled():
+            return
+        tour.prefetch(name, job.cancelled)
+
 def messierObject():
     global objectDisplay
     objectDisplay="Messier "
@@ -137,84 +191,86 @@ def solveEntry():
     os.system("touch solve.requested")
     return 
     
+# Goto answers at once and leaves the catalog lookup and altitude check, which can take a
+# store query and an astropy transform, to a job on the executor's worker thread
 def gotoEntry():
-	global objectDisplay
-	global currTour
-	
-	if objectDisplay[0:5]=="TOUR ":
-		# Load the first entry in the indicated tour
-		sql_select_Query = "select * from tours where name='"+objectDisplay+"'"
-		if debug:
-			print(sql_select_Query)
-		cursor = connection.cursor(buffered=True)
-		cursor.execute(sql_select_Query)
-		if (cursor.rowcount == 0):
-			print("No result in SQL :",sql_select_Query)
-			currStatusText.configure(text="TOUR NOT FOUND")
-			root.update()
-			time.sleep(2)
+	if not startup.ready(telescope):
+		renderer.flash(currStatusText, "TELESCOPE NOT READY")
+		return
+	renderer.flash(currStatusText, "GOTO "+objectDisplay, 1.0)
+	# A tour entry Prev/Next prefetched needs no lookup
+	stop = tour.stop(objectDisplay) if tour.active() else None
+	if stop is not None and stop.alt is not None:
+		if stop.alt > minAlt:
+			startGoto(stop.ra, stop.dec)
+		else:
+			print("Object too low to slew to!")
+			renderer.flash(currStatusText, "OBJECT TOO LOW")
+		return
+	executor.submit("goto", gotoJob, objectDisplay)
+
+# On the worker thread, hands what it finds back to the Tk thread with executor.ui()
+def gotoJob(job, name):
+	touring = name[0:5]=="TOUR "
+	if touring:
+		# Load the whole tour and start at its first entry that is up
+		if not tour.load(name, tourOrder):
+			print("No tour in catalog :",name)
+			executor.ui(job, renderer.flash, currStatusText, "TOUR NOT FOUND")
 			return
-		row = cursor.fetchone()
-		objectDisplay=row[1]
+		name=tour.first()
+		executor.ui(job, showObject, name)
 		# Carry on loading and slewing to object
-	try:
-		sql_select_Query = "select * from objects where name='"+objectDisplay+"'"
-		if debug:
-			print(sql_select_Query)
-			
-		cursor = connection.cursor(buffered=True)
-		cursor.execute(sql_select_Query)
-		if (cursor.rowcount == 0):
-			print("No result in SQL :",sql_select_Query)
-			currStatusText.configure(text="OBJECT NOT FOUND")
-			root.update()
-			time.sleep(2)
-			return
-		row = cursor.fetchone()
-	except Error as e:
-		print("Error reading data from MySQL table", e)
+	row = catalog.lookup(name)
+	if row is None and store is not None:
+		# Not in the index (yet), ask the store itself
+		try:
+			row = store.lookup(name)
+		except Exception as e:
+			print("Unable to look up",name,"in the catalog store -- ", e)
+	if row is None:
+		print("No object in catalog :",name)
+		executor.ui(job, renderer.flash, currStatusText, "OBJECT NOT FOUND")
+		return
     
 	if debug:
 		print("Retrieved ",row[0]," with RA",row[1],"and Dec",row[2])
+	if job.cancelled():
+		return
 		
 	if (checkAlt(row[1],row[2])): 
-		# Slew the telescope
-		telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-		while not(telescope_radec):
-			time.sleep(0.5)
-		telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-		telescope_radec[0].value=row[1]
-		telescope_radec[1].value=row[2]
-		indiclient.sendNewNumber(telescope_radec)
+		executor.ui(job, startGoto, row[1], row[2])
 	else:
 		print("Object too low to slew to!")
+		executor.ui(job, renderer.flash, currStatusText, "OBJECT TOO LOW")
+	if touring:
+		prefetchJob(job, tour.upcoming(1))
 	
 	return
 
+def showObject(name):
+	global objectDisplay
+	objectDisplay=name
+
+# Slew to a Goto target, on the Tk thread as it starts centring
+def startGoto(ra, dec):
+	if not startup.ready(telescope):
+		renderer.flash(currStatusText, "TELESCOPE NOT READY")
+		return
+	telescope_radec=indiclient.property(device_telescope, "EQUATORIAL_EOD_COORD", "Number")
+	# Centre on the object once there, approaching from where we are now
+	centering.start(ra,dec,telescope_radec[0].value,telescope_radec[1].value)
+	slewTo(ra,dec)
+
 def checkAlt(ra,dec):
-	# Determine if the object's altitude is within limits
-	observing_location = EarthLocation(lat=currLat*u.deg, lon=currLong*u.deg, height=currAlt*u.m) 
-	tz = get_localzone() # local timezone 
-	observing_time = datetime.now(tz) 
+	# Determine if the object's altitude is within limits, the observer caches the
+	# location and AltAz frame so this no longer rebuilds them on every Goto
+	alt, az = observer.altAz(ra, dec)
 	
 	if debug:
-		print("Location is ",observing_location)
-		print("Time is ",observing_time)
-	alt_az_frame = AltAz(location=observing_location, obstime=observing_time)
-	target = SkyCoord(ra*u.hour,dec*u.deg,frame="icrs")
-	target_alt_az = target.transform_to(alt_az_frame)
-	
-	if debug:
-      		print("AltAz is ",target_alt_az.alt, target_alt_az.az)
+		print("AltAz is ",alt, az)
 
-	if (target_alt_az.alt.degree > minAlt):
-		return(True)
-	else:
-		# Update the status
-		currStatusText.configure(text="OBJECT TOO LOW")
-		root.update()
-		time.sleep(2)
-		return(False)
+	return(alt > minAlt)
 
     	           
 def tourEntry():
@@ -223,134 +279,166 @@ def tourEntry():
     return 
 
 def stop():
-    global objectDisplay
+    global objectDisplay, solveOk, lastSlew
     objectDisplay="STOP"
+    # Drop a Goto still being looked up, kill any exposure or solve in progress and stop
+    # centring until the next slew
+    executor.cancel()
+    pipeline.finish(record=False)
+    solveOk=True
+    centering.reset()
+    centering.target=None
+    lastSlew=None
     return 
 
 #######################################################################################
 #### M Y S Q L ########################################################################
 ####################################################################################### 
-try:
-    connection = mysql.connector.connect(host='localhost',
-                                         database='pyindicontrolpad',
-                                         user='pyindicontrolpad',
-                                         password='secret')
-
-except Error as e:
-    print("Unable to connect to MYSQL -- ", e)
-    exit(0)
+# The objects and tours tables are loaded once into memory, Goto never queries the store.
+# catalogStore picks where they live, see catalogstore.py. The panel starts on the last
+# snapshot, the store is opened (importing mysql.connector) and the tables that changed
+# reloaded on a thread once the window is up, and again every catalogRefresh while the
+# store cannot be reached.
+catalog=CatalogIndex()
+database=None
+store=None
+if catalog.loadSnapshot():
+    if debug:
+        print("Catalog snapshot has",len(catalog),"objects and",len(catalog.tours),"tours")
+else:
+    print("No catalog snapshot in", catalog.snapshotPath, "-- waiting for", catalogStore)
+
+def openCatalog():
+    def connect():
+        global database, store
+        try:
+            if catalogStore=="mysql":
+                database = Database(host='localhost',
+                                    database='pyindicontrolpad',
+                                    user='pyindicontrolpad',
+                                    password='secret')
+                opened = MySQLStore(database)
+            else:
+                opened = openStore(catalogStore)
+            catalog.refresh(opened)
+            store = opened
+            if debug:
+                print("Catalog has",len(catalog),"objects and",len(catalog.tours),"tours")
+        except Exception as e:
+            print("Unable to load the catalog from "+catalogStore+" -- ", e)
+            if len(catalog):
+                print("Using the catalog snapshot in", catalog.snapshotPath)
+        refreshPlan()
+    threading.Thread(target=connect, daemon=True).start()
+
+# Tonight's altitude for every catalog object, so Prev/Next and tour listings need no
+# astropy call per object. Built off the Tk thread and cached per night, site and catalog
+# in plans/, it is None until the first build is done.
+planner=Planner(observer, step=planStep)
+plan=None
+
+def refreshPlan():
+    def build():
+        global plan
+        try:
+            plan = planner.plan(catalog)
+            if debug and planner.buildTime is not None:
+                print("Night plan for",plan.night,"built in %.0fms" % (planner.buildTime*1000))
+                planner.buildTime = None
+        except Exception as e:
+            print("Unable to build the night plan -- ", e)
+    threading.Thread(target=build, daemon=True).start()
+
+refreshPlan()
 
 
 
 #######################################################################################
 #### I N D I ##########################################################################
 #######################################################################################  
-# Connect to INDI and set up devices
-class IndiClient(PyIndi.BaseClient):
-    def __init__(self):
-        super(IndiClient, self).__init__()
-    def newDevice(self, d):
-        pass
-    def newProperty(self, p):
-        pass
-    def removeProperty(self, p):
-        pass
-    def newBLOB(self, bp):
-        global blobEvent
-        blobEvent.set()
-        pass
-    def newSwitch(self, svp):
-        pass
-    def newNumber(self, nvp):
-        pass
-    def newText(self, tvp):
-        pass
-    def newLight(self, lvp):
-        pass
-    def newMessage(self, d, m):
-        pass
-    def serverConnected(self):
-        pass
-    def serverDisconnected(self, code):
-        pass
-
+# Connect to INDI and set up devices. The server connection, the telescope and the CCD are
+# brought up by startup.py, the devices concurrently on their own threads while the window
+# is built, and the mainline leaves them alone until startup.ready() says they are up
 indiclient=IndiClient()
 indiclient.setServer("localhost",7624)
-
-if (not(indiclient.connectServer())):
-     print("No indiserver running on "+indiclient.getHost()+":"+str(indiclient.getPort())+" - Try to run")
-     print("  indiserver indi_simulator_telescope indi_simulator_ccd")
-     sys.exit(1)
- 
-# get the telescope device
-device_telescope=indiclient.getDevice(telescope)
-while not(device_telescope):
-    time.sleep(0.5)
-    device_telescope=indiclient.getDevice(telescope)
-     
-# wait CONNECTION property be defined for telescope
-telescope_connect=device_telescope.getSwitch("CONNECTION")
-while not(telescope_connect):
-    time.sleep(0.5)
-    telescope_connect=device_telescope.getSwitch("CONNECTION")
- 
-# if the telescope device is not connected, we do connect it
-if not(device_telescope.isConnected()):
-    # Property vectors are mapped to iterable Python objects
-    # Hence we can access each element of the vector using Python indexing
-    # each element of the "CONNECTION" vector is a ISwitch
-    telescope_connect[0].s=PyIndi.ISS_ON  # the "CONNECT" switch
-    telescope_connect[1].s=PyIndi.ISS_OFF # the "DISCONNECT" switch
-    indiclient.sendNewSwitch(telescope_connect) # send this new value to the device
-
-# We want to set the ON_COORD_SET switch to engage tracking after goto
-# device.getSwitch is a helper to retrieve a property vector
-telescope_on_coord_set=device_telescope.getSwitch("ON_COORD_SET")
-while not(telescope_on_coord_set):
-    time.sleep(0.5)
-    telescope_on_coord_set=device_telescope.getSwitch("ON_COORD_SET")
-
-# the order below is defined in the property vector
-telescope_on_coord_set[0].s=PyIndi.ISS_ON  # TRACK
-telescope_on_coord_set[1].s=PyIndi.ISS_OFF # SLEW
-telescope_on_coord_set[2].s=PyIndi.ISS_OFF # SYNC
-indiclient.sendNewSwitch(telescope_on_coord_set)
+camera=IndiCamera(indiclient)
+
+# Keep trying to reach indiserver, backing off up to 30s between attempts
+def startServer(step):
+    def failed(attempt, delay):
+        if attempt == 1:
+            print("No indiserver running on "+indiclient.getHost()+":"+str(indiclient.getPort())+" - Try to run")
+            print("  indiserver indi_simulator_telescope indi_simulator_ccd")
+        if debug:
+            print("Retrying indiserver in %.1fs" % delay)
+    step("connect", lambda: retry(indiclient.connectServer, onFailure=failed))
+
+def startTelescope(step):
+    global device_telescope, telescope_connect
+    # get the telescope device
+    device_telescope=step("device", lambda: indiclient.device(telescope))
+
+    # wait CONNECTION property be defined for telescope
+    telescope_connect=step("CONNECTION", lambda: indiclient.property(device_telescope, "CONNECTION", "Switch"))
+
+    # if the telescope device is not connected, we do connect it
+    if not(device_telescope.isConnected()):
+        # Property vectors are mapped to iterable Python objects
+        # Hence we can access each element of the vector using Python indexing
+        # each element of the "CONNECTION" vector is a ISwitch
+        telescope_connect[0].s=PyIndi.ISS_ON  # the "CONNECT" switch
+        telescope_connect[1].s=PyIndi.ISS_OFF # the "DISCONNECT" switch
+        indiclient.sendNewSwitch(telescope_connect) # send this new value to the device
+
+    # We want to set the ON_COORD_SET switch to engage tracking after goto
+    # indiclient.property waits until the property vector is defined and returns it
+    telescope_on_coord_set=step("ON_COORD_SET", lambda: indiclient.property(device_telescope, "ON_COORD_SET", "Switch"))
+
+    # the order below is defined in the property vector
+    telescope_on_coord_set[0].s=PyIndi.ISS_ON  # TRACK
+    telescope_on_coord_set[1].s=PyIndi.ISS_OFF # SLEW
+    telescope_on_coord_set[2].s=PyIndi.ISS_OFF # SYNC
+    indiclient.sendNewSwitch(telescope_on_coord_set)
+    step("EQUATORIAL_EOD_COORD", lambda: indiclient.property(device_telescope, "EQUATORIAL_EOD_COORD", "Number"))
 
 # Set up CCD camera 
-device_ccd=indiclient.getDevice(ccd)
-while not(device_ccd):
-    time.sleep(0.5)
-    device_ccd=indiclient.getDevice(ccd)   
- 
-ccd_connect=device_ccd.getSwitch("CONNECTION")
-while not(ccd_connect):
-    time.sleep(0.5)
-    ccd_connect=device_ccd.getSwitch("CONNECTION")
-if not(device_ccd.isConnected()):
-    ccd_connect[0].s=PyIndi.ISS_ON  # the "CONNECT" switch
-    ccd_connect[1].s=PyIndi.ISS_OFF # the "DISCONNECT" switch
-    indiclient.sendNewSwitch(ccd_connect)
- 
-ccd_exposure=device_ccd.getNumber("CCD_EXPOSURE")
-while not(ccd_exposure):
-    time.sleep(0.5)
-    ccd_exposure=device_ccd.getNumber("CCD_EXPOSURE")
- 
-# Ensure the CCD driver snoops the telescope driver
-ccd_active_devices=device_ccd.getText("ACTIVE_DEVICES")
-while not(ccd_active_devices):
-    time.sleep(0.5)
-    ccd_active_devices=device_ccd.getText("ACTIVE_DEVICES")
-ccd_active_devices[0].text=telescope
-indiclient.sendNewText(ccd_active_devices)
- 
-# we should inform the indi server that we want to receive the
-# "CCD1" blob from this device
-indiclient.setBLOBMode(PyIndi.B_ALSO, ccd, "CCD1")
-ccd_ccd1=device_ccd.getBLOB("CCD1")
-while not(ccd_ccd1):
-    time.sleep(0.5)
-    ccd_ccd1=device_ccd.getBLOB("CCD1")
+def startCcd(step):
+    global device_ccd
+    device_ccd=step("device", lambda: indiclient.device(ccd))
+
+    ccd_connect=step("CONNECTION", lambda: indiclient.property(device_ccd, "CONNECTION", "Switch"))
+    if not(device_ccd.isConnected()):
+        ccd_connect[0].s=PyIndi.ISS_ON  # the "CONNECT" switch
+        ccd_connect[1].s=PyIndi.ISS_OFF # the "DISCONNECT" switch
+        indiclient.sendNewSwitch(ccd_connect)
+
+    ccd_exposure=step("CCD_EXPOSURE", lambda: indiclient.property(device_ccd, "CCD_EXPOSURE", "Number"))
+
+    # Ensure the CCD driver snoops the telescope driver
+    ccd_active_devices=step("ACTIVE_DEVICES", lambda: indiclient.property(device_ccd, "ACTIVE_DEVICES", "Text"))
+    ccd_active_devices[0].text=telescope
+    indiclient.sendNewText(ccd_active_devices)
+
+    # we should inform the indi server that we want to receive the
+    # "CCD1" blob from this device
+    indiclient.setBLOBMode(PyIndi.B_ALSO, ccd, "CCD1")
+    ccd_ccd1=step("CCD1", lambda: indiclient.property(device_ccd, "CCD1", "BLOB"))
+    camera.attach(device_ccd, ccd_exposure, ccd_ccd1)
+    if compressBlobs and not camera.enableCompression():
+        print("CCD "+ccd+" has no CCD_COMPRESSION, BLOBs are sent uncompressed")
+
+# Print where the boot time went once every device is up (or has failed)
+# Then load what the first solve and Goto need in the background
+def startupDone():
+    if debug:
+        print(startup.report())
+    if startup.restarts == 0:
+        imports.preload(imports.deferred, printReport=debug)
+
+startup=Startup(onDone=startupDone)
+startup.run("server", startServer)
+startup.run(telescope, startTelescope, after=("server",))
+startup.run(ccd, startCcd, after=("server",))
 
 ##### Determine our IP address ##########################################################
 s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -389,52 +477,52 @@ currStatusText.grid(row=0, column=2, columnspan=3,sticky="e")
 currObjText = tk.Label(root, text="") 
 currObjText.configure(font='verdana 24', fg='red', bg='black', padx=0, highlightbackground='red', highlightthickness=2, highlightcolor="black")
 currObjText.grid(row=2, column=1, columnspan=3, sticky="nsew")
-messierButton=tk.Button(root, text="Messier", command=lambda: messierObject(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+messierButton=tk.Button(root, text="Messier", command=lambda: press(messierObject), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 messierButton.grid(row=2, column=4, sticky="nsew")
 
-oneButton=tk.Button(root, text="1", command=lambda: oneEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+oneButton=tk.Button(root, text="1", command=lambda: press(oneEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 oneButton.grid(row=3, column=1, sticky="nsew")
-twoButton=tk.Button(root, text="  2  ", command=lambda: twoEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+twoButton=tk.Button(root, text="  2  ", command=lambda: press(twoEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 twoButton.grid(row=3, column=2, sticky="nsew")
-threeButton=tk.Button(root, text="3", command=lambda: threeEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+threeButton=tk.Button(root, text="3", command=lambda: press(threeEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 threeButton.grid(row=3, column=3, sticky="nsew")
-ngcButton=tk.Button(root, text="NGC", command=lambda: ngcObject(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+ngcButton=tk.Button(root, text="NGC", command=lambda: press(ngcObject), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 ngcButton.grid(row=3, column=4, sticky="nsew")
 
-fourButton=tk.Button(root, text="4", command=lambda: fourEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+fourButton=tk.Button(root, text="4", command=lambda: press(fourEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 fourButton.grid(row=4, column=1, sticky="nsew")
-fiveButton=tk.Button(root, text="5", command=lambda: fiveEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+fiveButton=tk.Button(root, text="5", command=lambda: press(fiveEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 fiveButton.grid(row=4, column=2, sticky="nsew")
-sixButton=tk.Button(root, text="6", command=lambda: sixEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+sixButton=tk.Button(root, text="6", command=lambda: press(sixEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 sixButton.grid(row=4, column=3, sticky="nsew")
-caldwellButton=tk.Button(root, text="Caldwell", command=lambda: caldwellObject(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+caldwellButton=tk.Button(root, text="Caldwell", command=lambda: press(caldwellObject), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 caldwellButton.grid(row=4, column=4, sticky="nsew")
 
-sevenButton=tk.Button(root, text="7", command=lambda: sevenEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+sevenButton=tk.Button(root, text="7", command=lambda: press(sevenEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 sevenButton.grid(row=5, column=1, sticky="nsew")
-eightButton=tk.Button(root, text="8", command=lambda: eightEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+eightButton=tk.Button(root, text="8", command=lambda: press(eightEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 eightButton.grid(row=5, column=2, sticky="nsew")
-nineButton=tk.Button(root, text="9", command=lambda: nineEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+nineButton=tk.Button(root, text="9", command=lambda: press(nineEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 nineButton.grid(row=5, column=3, sticky="nsew")
-tourButton=tk.Button(root, text="Tour", command=lambda: tourEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+tourButton=tk.Button(root, text="Tour", command=lambda: press(tourEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 tourButton.grid(row=5, column=4, sticky="nsew")
 
-sevenButton=tk.Button(root, text="Solve", command=lambda: solveEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+sevenButton=tk.Button(root, text="Solve", command=lambda: press(solveEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 sevenButton.grid(row=6, column=1, sticky="nsew")
-eightButton=tk.Button(root, text="0", command=lambda: zeroEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+eightButton=tk.Button(root, text="0", command=lambda: press(zeroEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 eightButton.grid(row=6, column=2, sticky="nsew")
-nineButton=tk.Button(root, text="Goto", command=lambda: gotoEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+nineButton=tk.Button(root, text="Goto", command=lambda: press(gotoEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 nineButton.grid(row=6, column=3, sticky="nsew")
-tourButton=tk.Button(root, text="Clear", command=lambda: clearObject(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+tourButton=tk.Button(root, text="Clear", command=lambda: press(clearObject), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 tourButton.grid(row=6, column=4, sticky="nsew")
 
-nextButton=tk.Button(root, text="Prev", command=lambda: prevEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+nextButton=tk.Button(root, text="Prev", command=lambda: press(prevEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 nextButton.grid(row=7, column=1, columnspan=2, sticky="nsew")
-PrevButton=tk.Button(root, text="Next", command=lambda: nextEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+PrevButton=tk.Button(root, text="Next", command=lambda: press(nextEntry), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 PrevButton.grid(row=7, column=3, columnspan=2, sticky="nsew")
 
 
-tourButton=tk.Button(root, text="S T O P", command=lambda: stop(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+tourButton=tk.Button(root, text="S T O P", command=lambda: press(stop), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 tourButton.grid(row=8, column=1, columnspan=4,sticky="nsew")
 
 
@@ -449,144 +537,255 @@ currIPText.grid(row=11, column=6, sticky="nsew")
 #######################################################################################
 #### M A I N L I N E ##################################################################
 #######################################################################################  
+# The mainline is driven by the Tk event loop rather than a busy while loop. INDI property
+# changes are queued by the IndiClient callbacks and drained every tickMs, and a label is
+# only reconfigured when its text changes, so the Pi idles between events and ASTAP gets
+# the CPU while solving.
+tickMs = 100
 solveOk = True
-
-while (1):        # Loop forever
-    # Update coordinates 
-    telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-    while not(telescope_radec):
-        time.sleep(0.5)
-        telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")   
-        
-    # Update Display
+slewing = None
+lastSlew = None                        # Slew to send again if indiserver restarts
+disconnects = 0
+resync = set()                         # Devices to resync once they are back
+solver = SolverRunner(command=astap, timeout=solveTimeout)
+localSolver = None
+if solverEngine == "local":
+    solver = localSolver = LocalSolver(starIndex, maxRadius=localRadius, timeout=solveTimeout)
+elif solverEngine == "local+astap":
+    localSolver = LocalSolver(starIndex, maxRadius=localRadius, timeout=solveTimeout)
+    solver = SolverChain(localSolver, solver)
+# A test image is not where the mount is pointing, so it is always solved blind
+hints = SolveHints(radii=searchRadii(solverEngine, solveRadii, localRadius), fov=fov) if not testImage else None
+pipeline = SolvePipeline(camera, solver, exposure, pipelined=pipelined, hints=hints, analyse=True,
+                         prepare=lambda frame: testImage or frame.preprocess(*preprocess.get(ccd, Preprocess())))
+centering = CenteringEngine(tolerance=maxDeviation)
+calibration = CalibrationStore(calibrationFile)
+setup = setupName(telescope, ccd)
+renderer = Renderer(root, frameMs=tickMs)
+executor = Executor(root)
+
+# Tour entries are prefetched with the star index read around them for the local solver
+def warmSolve(ra, dec):
+    if localSolver is not None:
+        localSolver.prefetch(ra*15, dec)
+
+# The "slew" tour order starts from where the mount is pointing, if it is up
+routeOptimizer = RouteOptimizer(observer, slew=slewModel, minAlt=minAlt, dwell=tourDwell)
+def slewOrder(names, ra, dec):
+    fromAltAz = None
+    if startup.ready(telescope):
+        telescope_radec=indiclient.property(device_telescope, "EQUATORIAL_EOD_COORD", "Number")
+        alt, az = observer.fastAltAz(telescope_radec[0].value, telescope_radec[1].value)
+        fromAltAz = (float(alt), float(az))
+    names = routeOptimizer.order(names, ra, dec, julianDate(), fromAltAz)
+    if debug:
+        print("Tour ordered for slewing in %.0fms" % (routeOptimizer.lastTime*1000))
+    return names
+
+tour = TourEngine(catalog, observer.altAz, lookup=lambda name: store.lookup(name) if store is not None else None,
+                  warm=warmSolve, plan=lambda: plan, route=slewOrder, minAlt=minAlt)
+cpuWall = time.time()
+cpuUsed = time.process_time()
+
+# Print the share of one CPU core the panel used since the last report
+def cpuReport():
+    global cpuWall, cpuUsed
+    wall = time.time()
+    used = time.process_time()
+    print("CPU used %.1f%% over the last %.0fs" % (100*(used-cpuUsed)/(wall-cpuWall), wall-cpuWall))
+    cpuWall = wall
+    cpuUsed = used
+    print(renderer.report())
+    print(executor.report())
+    print(tour.report())
+    root.after(60000, cpuReport)
+
+def updateDisplay():
     dateTimeObj = datetime.now()
-    currDateText.configure(text=dateTimeObj.strftime("%d-%b-%Y\n%H:%M:%S"))
+    renderer.set(currDateText, dateTimeObj.strftime("%d-%b-%Y\n%H:%M:%S"))
     dateTimeObj = datetime.now(tz=utc)
-    currUTDateText.configure(text=dateTimeObj.strftime("%d-%b-%Y\n%H:%M:%S UT"))
-    currObjText.configure(text=objectDisplay)
-    root.update_idletasks()
-    root.update()
-    
-    # See if we are slewing or do we need a solve?
-    telescope_status = device_telescope.getSwitch("TELESCOPE_STATUS")
-    while not telescope_status:
-        time.sleep(0.5)
+    renderer.set(currUTDateText, dateTimeObj.strftime("%d-%b-%Y\n%H:%M:%S UT"))
+    renderer.set(currObjText, objectDisplay)
+
+def updateStatus():
+    global solveOk, slewing, disconnects, resync
+
+    # indiserver went away, bring everything up again and carry on where we were
+    if indiclient.disconnects != disconnects:
+        disconnects = indiclient.disconnects
+        print("Lost indiserver, reconnecting")
+        startup.restart()
+        resync = {telescope, ccd}
+
+    # Each device is used as soon as it is up, so one that is missing or failed (no camera
+    # attached, a driver crashing) leaves the others working while startup retries it.
+    # Until the telescope is up show what startup is waiting for.
+    for device in [device for device in resync if startup.ready(device)]:
+        resync.discard(device)
+        resyncState(device)
+    if not startup.ready(telescope):
+        renderer.set(currStatusText, startup.status(), immediate=True)
+        return
+
+    # See if we are slewing or do we need a solve? Only look at the switch when INDI
+    # told us it changed (or we have never seen it yet)
+    changed = indiclient.changes()
+    if slewing is None or (telescope, "TELESCOPE_STATUS") in changed:
         telescope_status = device_telescope.getSwitch("TELESCOPE_STATUS")
+        if not telescope_status:
+            return
+        slewing = telescope_status[0].s == PyIndi.ISS_ON
 
-    if telescope_status[0].s == PyIndi.ISS_ON:  # Slewing
-        currStatusText.configure(text="SLEWING")
-        root.update()
+    if slewing:
+        renderer.set(currStatusText, "SLEWING", immediate=True)
         solveOk = False  # We'll need to do a solve after the motion stops
-    else:
-        # Update the status
-        currStatusText.configure(text="TRACKING")
-        root.update()
-
-        # Otherwise if we're good, don't continue on to solve
-        if solveOk:
-            continue
- 
-        # Run the solve program 
-        # Update display
-        currStatusText.configure(text="SOLVING")
-        root.update()
-            
-        # Initiate an image on the camera
-        blobEvent=threading.Event()
-        blobEvent.clear()
-        ccd_exposure[0].value=exposure
-        indiclient.sendNewNumber(ccd_exposure)
-        blobEvent.wait()
-        blobEvent.clear()
+        if pipeline.busy():
+            # Any frame taken or being solved is stale now
+            pipeline.invalidate()
+        return
+
+    # The rest needs the camera, until it is up show what startup says about it
+    if not startup.ready(ccd):
+        renderer.set(currStatusText, startup.status(), immediate=True)
+        return
+
+    # Update the status
+    if not pipeline.busy():
+        renderer.set(currStatusText, "TRACKING", immediate=True)
+
+    # Otherwise if we're good, don't continue on to solve
+    if not solveOk:
+        solve()
+
+# A device is back after indiserver restarted. The exposure in progress went with the
+# old connection, and a slew not known to have finished is sent again. Centring and solving
+# carry on from where they were.
+def resyncState(device):
+    global slewing
+    if device == ccd:
+        pipeline.invalidate()
+        return
+    slewing = None
+    if lastSlew is not None:
         if debug:
-            print("name: ", ccd_ccd1[0].name," size: ", ccd_ccd1[0].size," format: ", ccd_ccd1[0].format)
-        ccdimage=ccd_ccd1[0].getblobdata()
-
-        # Write the image to disk - disabled because astap won't solve ccd simulator images
-#        filehandle = open('solve.fits', 'wb')
-#        filehandle.write(ccdimage)
-#        filehandle.close()
-
-        # Remove plate solve results
-        if os.path.exists('solve.ini'):
-           os.remove('solve.ini')
-        if os.path.exists('solve.wcs'):
-           os.remove('solve.wcs')
-
-        # Do a plate solve on the fits data
-        cmd="/usr/local/bin/astap -r 50 -f solve.fits >solve.err 2>&1"
-        if (debug): 
-            print("Solving...")
-            print(cmd)
-        # Create a process to call the solver and wait for completion 
-        timeout=0 
-        os.system(cmd)
-        while not os.path.exists('solve.wcs'):
-            if debug:
-                print ("Sleeping...")
-            time.sleep(0.5)
-            timeout=timeout+0.5
-            if (timeout==10):
-                print ("Error, solve not completed in 10s!")
-                continue;
-                
-
-        # Load the wcs FITS hdulist using astropy.io.fits
-        #with fits.open('solve.wcs', mode='readonly', ignore_missing_end=True) as fitsfile:
-        #    w = WCS(fitsfile[0].header) 
-        #    solveRa=w.wcs.crval[0]
-        #    solveDec=w.wcs.crval[1]
-        # Kludge because wcs file keeps bombing with corrupt file error, doh!
-        os.system("cat solve.wcs | grep CRVAL1 | cut -b12-30 > solve.kludge")
-        os.system("cat solve.wcs | grep CRVAL2 | cut -b12-30 >> solve.kludge")
-        kludgefile=open("solve.kludge","r")
-        rastr=kludgefile.read(19)
-        decstr=kludgefile.read(1) # ignore the CR 
-        decstr=kludgefile.read(19)
+            print("Resending slew to",lastSlew[0],lastSlew[1])
+        slewTo(*lastSlew)
+
+# Slew the telescope, RA in hours. The target is kept until centring is over so it can be
+# sent again if indiserver restarts on the way.
+def slewTo(ra, dec):
+    global lastSlew
+    lastSlew = (ra, dec)
+    telescope_radec=indiclient.property(device_telescope, "EQUATORIAL_EOD_COORD", "Number")
+    telescope_radec[0].value=ra
+    telescope_radec[1].value=dec
+    indiclient.sendNewNumber(telescope_radec)
+
+# solve() is called every tick while a solve is needed. The pipeline steps through the
+# exposures and ASTAP runs without ever blocking the Tk event loop, and with pipelined set
+# the next frame is already exposing while the last one solves.
+def solve():
+    result = pipeline.tick()
+    if pipeline.busy():
+        renderer.set(currStatusText, "SOLVING", immediate=True)
+
+    # Pass on the solver output
+    while not solver.output.empty():
+        line = solver.output.get()
         if debug:
-            print("Kludge coords: ",rastr," ",decstr)
-        kludgefile.close()
-        solveRa=float(rastr)
-        solveDec=float(decstr)
-        
-        if (debug): 
-            print("Solved RA= ",solveRa," Dec=",solveDec)
-
-        # Load the ccd image FITS hdulist using astropy.io.fits
-        with fits.open('solve.fits', mode='readonly', ignore_missing_end=True) as fitsfile:
-            w = WCS(fitsfile[0].header) 
-            ccdRa=w.wcs.crval[0]
-            ccdDec=w.wcs.crval[1]
-        if (debug): 
-           print("CCD RA= ",solveRa," Dec=",solveDec)
-            
-        # Compare the plate solve to the current RA/DEC, convert to arcsecs
-        deltaRa = (solveRa - ccdRa)*60*60 
-        deltaDec = (solveDec - ccdDec)*60*60
-        if (debug): 
-           print("Delta RA= ",deltaRa," Delta Dec=",deltaDec)
+            print(line)
+    if result is None:
+        return
+    result, frame = result
+    if debug:
+        print(describe(frame.stars()))
+    if result.status != SOLVED:
+        print ("Error, solve "+result.status+" after %.1fs" % result.elapsed)
+        if result.error is not None:
+            # The solver could not be run at all, say so rather than retry silently
+            print("Solver error -- ", result.error)
+            renderer.flash(currStatusText, "SOLVER ERROR")
+        frame.close()
+        return
+    if debug:
+        print("Solved in %.1fs" % result.elapsed)
+    finishSolve(result.solution, frame)
+    frame.close()
+
+# Compare the solved position with the mount and correct the pointing if needed
+def finishSolve(solution, frame):
+    global solveOk, lastSlew
+
+    solveRa, solveDec = solution.crval
+    
+    if (debug): 
+        print("Solved RA= ",solveRa," Dec=",solveDec)
+
+    # The coordinates the camera stamped on the frame, read from the header in memory
+    ccdRa, ccdDec = frame.crval()
+    if (debug): 
+       print("CCD RA= ",ccdRa," Dec=",ccdDec)
+
+    # Move the solved camera centre to the scope's centre of field, as synced in mini.py
+    solveRa, solveDec = calibration.apply(setup, solveRa/15, solveDec, solution.crota)
+    solveRa = solveRa*15
         
-        # If within the threshold arcsecs move the scope set solveOk and continue
-        if ((deltaRa < 5) or (deltaDec < 5)):
-            if debug:
-                print("Deviation < 25 arcsecs, ignoring")
-            solveOk=True
-            continue;
-        if debug:
-            print("Deviation ",math.sqrt(deltaRa**2+deltaDec**2),"arcsecs compared to max ",maxDeviation," arcsecs")
-        if math.sqrt(deltaRa**2+deltaDec**2) > maxDeviation:
-           if debug:
-               print("Moving scope to computed coordinates ",ccdRa+deltaRa," ",ccdDec+deltaDec)
-           # Otherwise set the desired coordinate and slew
-           telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-           while not(telescope_radec):
-               time.sleep(0.5)
-           telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-           telescope_radec[0].value=ccdRa+deltaRa
-           telescope_radec[1].value=ccdDec+deltaDec
-           indiclient.sendNewNumber(telescope_radec)
-        else:
-           solveOk=True
+    # Centre on the last Goto target, or on where the mount thinks it is if there was none
+    if centering.target is None:
+        centering.start(ccdRa/15, ccdDec)
+
+    # Let the centering engine compare the solve with the target (RA in hours) and
+    # decide on the next correction from the mount's response so far
+    step=centering.update(ccdRa/15, ccdDec, solveRa/15, solveDec)
+    if (debug): 
+       print("Centring pass",step.iteration,"error %.0f arcsecs," % step.error,step.status)
+    
+    if step.status == MOVE:
+       if debug:
+           print("Moving scope to computed coordinates ",step.ra," ",step.dec)
+       slewTo(step.ra, step.dec)
+       pipeline.invalidate()
+    else:
+       # Centred, or not converging - stop solving either way until the scope moves again
+       solveOk=True
+       centering.reset()
+       lastSlew = None
+       pipeline.finish()
+       if debug:
+           print(pipeline.report())
+           print(camera.report())
+       centering.target=None
+
+# Reload the catalog tables that changed in the store, off the Tk thread, or try to open
+# it again, and the night plan, which is only rebuilt for a new night or a changed catalog
+def refreshCatalog():
+    def refresh():
+        try:
+            if catalog.refresh(store) and debug:
+                print("Catalog reloaded,",len(catalog),"objects")
+            if database is not None and debug:
+                print(database.report())
+        except Exception as e:
+            print("Unable to refresh the catalog -- ", e)
+        refreshPlan()
+    if store is not None:
+        threading.Thread(target=refresh, daemon=True).start()
+    else:
+        openCatalog()
+    root.after(catalogRefresh*1000, refreshCatalog)
+
+# The labels set here are drawn once per frame by the renderer, the status line at once
+def mainline():
+    updateDisplay()
+    updateStatus()
+
+renderer.run(mainline)
+root.after_idle(lambda: startup.mark("window shown"))
+root.after_idle(openCatalog)
+root.after(catalogRefresh*1000, refreshCatalog)
+if debug:
+    root.after(60000, cpuReport)
+root.mainloop()
 
 
 
@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+from imports import lazy
+
+connector = lazy("mysql.connector")
+
+#######################################################################################
+#### D A T A B A S E ##################################################################
+#######################################################################################
+# Database replaces the single module level MySQL connection. Connections come from a
+# small pool and go back after every query, and all queries are prepared statements with
+# %s parameters, never concatenated SQL. Each pooled connection keeps one prepared cursor
+# per statement, so a statement is prepared once per connection and then only executed.
+# Connections are not pinged before use: a query on a connection the server has dropped
+# (e.g. wait_timeout over a long night) fails, the connection is reconnected and the
+# query run again. Query latency and reconnects are counted so they can be reported with
+# stats().
+class Database:
+    def __init__(self, poolSize=2, retries=3, retryDelay=0.5, **config):
+        self.config = dict(config)
+        self.config.setdefault("connection_timeout", 5)
+        self.poolSize = poolSize
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.idle = queue.LifoQueue()      # Connections not in use, most recent first
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.queries = {}                  # sql -> [count, total seconds, worst seconds]
+        self.reconnects = 0
+        self.failures = 0
+
+    # A connection from the pool, opened on first use so a server that is down at startup
+    # is retried later. When poolSize are in use wait for one to come back.
+    def getConnection(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            full = self.opened >= self.poolSize
+            if not full:
+                self.opened += 1
+        if full:
+            try:
+                return self.idle.get(timeout=self.config["connection_timeout"])
+            except queue.Empty:
+                raise connector.errors.PoolError("No free connection in the pool") from None
+        try:
+            return PooledConnection(connector.connect(**self.config))
+        except BaseException:
+            with self.lock:
+                self.opened -= 1
+            raise
+
+    def putConnection(self, connection):
+        self.idle.put(connection)
+
+    def dropConnection(self, connection):
+        connection.close()
+        with self.lock:
+            self.opened -= 1
+
+    # Run a prepared statement and return all rows, reconnecting a dropped connection
+    def query(self, sql, params=()):
+        lost = (connector.errors.InterfaceError, connector.errors.OperationalError)
+        for attempt in range(self.retries):
+            start = time.perf_counter()
+            try:
+                connection = self.getConnection()
+                try:
+                    try:
+                        rows = connection.execute(sql, params)
+                    except lost:
+                        connection.reconnect()
+                        with self.lock:
+                            self.reconnects += 1
+                        rows = connection.execute(sql, params)
+                except lost:
+                    self.dropConnection(connection)
+                    raise
+                except BaseException:
+                    self.putConnection(connection)
+                    raise
+                self.putConnection(connection)
+            except lost + (connector.errors.PoolError,):
+                if attempt == self.retries-1:
+                    with self.lock:
+                        self.failures += 1
+                    raise
+                time.sleep(self.retryDelay*(attempt+1))
+                continue
+            self.record(sql, time.perf_counter()-start)
+            return rows
+
+    def record(self, sql, elapsed):
+        with self.lock:
+            stats = self.queries.setdefault(sql, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    # Query counts and latencies in ms, plus reconnect and failure counts
+    def stats(self):
+        with self.lock:
+            return {"queries": {sql: {"count": n, "meanMs": total*1000/n, "worstMs": worst*1000}
+                                for sql, (n, total, worst) in self.queries.items()},
+                    "reconnects": self.reconnects,
+                    "failures": self.failures}
+
+    def report(self):
+        stats = self.stats()
+        lines = ["MySQL reconnects %d, failed queries %d" % (stats["reconnects"], stats["failures"])]
+        for sql, q in stats["queries"].items():
+            lines.append("  %5d x %-40s mean %7.2f ms worst %7.2f ms" % (q["count"], sql[:40], q["meanMs"], q["worstMs"]))
+        return "\n".join(lines)
+
+    def close(self):
+        while True:
+            try:
+                self.dropConnection(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+# A pooled connection and its prepared cursors. The connector only prepares again when a
+# cursor is given a different statement, so keeping a cursor per statement means each
+# is prepared once on this connection. Prepared statements die with the session, so a
+# reconnect forgets them.
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursors = {}                  # sql -> prepared cursor
+
+    def execute(self, sql, params=()):
+        cursor = self.cursors.get(sql)
+        if cursor is None:
+            cursor = self.connection.cursor(prepared=True)
+            self.cursors[sql] = cursor
+        cursor.execute(sql, tuple(params))
+        return cursor.fetchall()
+
+    def reconnect(self):
+        self.cursors = {}
+        self.connection.reconnect(attempts=1)
+
+    def close(self):
+        self.cursors = {}
+        try:
+            self.connection.close()
+        except Exception:
+            pass
@@ -0,0 +1,190 @@
+import heapq
+import queue
+import sys
+import threading
+import time
+
+#######################################################################################
+#### E X E C U T O R ##################################################################
+#######################################################################################
+# Executor keeps slow work off the Tk thread so a button press is never stuck behind a
+# catalog query, an astropy transform or an INDI wait. Every keypad button goes through
+# press(), which runs the button's action straight away on the Tk thread (editing the
+# object line, showing "GOTO ...") and times it, the press to feedback latency. Anything
+# slow the action needs is submit()ted as a job to the one worker thread that owns it.
+#
+# A job is function(job, *args). It must not touch Tk or the mainline's state (centring,
+# the solve pipeline), instead it hands its results back with ui(job, function, *args),
+# which queues the call for the Tk thread to run at the next drain, every pollMs. Jobs
+# are cancelled with cancel() (STOP) or replaced by a newer job of the same name (a second
+# Goto); a cancelled job is skipped if it has not started, should check job.cancelled()
+# between slow steps if it has, and anything it queued for the UI is dropped.
+class Job:
+    def __init__(self, name, function, args, submitted):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.submitted = submitted
+        self.cancelEvent = threading.Event()
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def cancelled(self):
+        return self.cancelEvent.is_set()
+
+class Executor:
+    def __init__(self, root, pollMs=20, clock=time.monotonic):
+        self.root = root
+        self.pollMs = pollMs
+        self.clock = clock
+        self.jobs = queue.Queue()
+        self.calls = queue.Queue()             # (job, function, args) for the Tk thread
+        self.lock = threading.Lock()
+        self.active = []                       # Jobs queued or running
+        self.pressTimes = []                   # Seconds from press to feedback
+        self.jobTimes = []                     # Seconds from submit to the job's first UI call
+        self.cancels = 0
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+        root.after(pollMs, self.poll)
+
+    # Run a button's action now and time it
+    def press(self, action):
+        start = self.clock()
+        try:
+            action()
+        finally:
+            self.pressTimes.append(self.clock()-start)
+
+    def submit(self, name, function, *args, replace=True):
+        job = Job(name, function, args, self.clock())
+        with self.lock:
+            if replace:
+                for other in self.active:
+                    if other.name == name:
+                        other.cancel()
+                        self.cancels += 1
+            self.active.append(job)
+        self.jobs.put(job)
+        return job
+
+    # Cancel every job, or those with the given name
+    def cancel(self, name=None):
+        with self.lock:
+            for job in self.active:
+                if name is None or job.name == name:
+                    job.cancel()
+                    self.cancels += 1
+
+    # Called by a job to have function(*args) run on the Tk thread
+    def ui(self, job, function, *args):
+        self.calls.put((job, function, args))
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if not job.cancelled():
+                    job.function(job, *job.args)
+            except Exception as e:
+                print("Job "+job.name+" failed -- ", e)
+            finally:
+                with self.lock:
+                    self.active.remove(job)
+
+    # Run the UI calls the jobs have queued, on the Tk thread
+    def drain(self):
+        while True:
+            try:
+                job, function, args = self.calls.get_nowait()
+            except queue.Empty:
+                return
+            if job.cancelled():
+                continue
+            if job.submitted is not None:
+                self.jobTimes.append(self.clock()-job.submitted)
+                job.submitted = None
+            function(*args)
+
+    def poll(self):
+        try:
+            self.drain()
+        finally:
+            self.root.after(self.pollMs, self.poll)
+
+    def report(self):
+        def summary(times):
+            if not times:
+                return "none"
+            ordered = sorted(times)
+            return "%d, median %.1fms, worst %.1fms" % (len(ordered), ordered[len(ordered)//2]*1000, ordered[-1]*1000)
+        return ("Keypad press to feedback %s\n" % summary(self.pressTimes)+
+                "Jobs submit to result %s, %d cancelled" % (summary(self.jobTimes), self.cancels))
+
+#######################################################################################
+#### L A T E N C Y   T E S T ##########################################################
+#######################################################################################
+# A stand-in for Tk's after() and mainloop, in real time, so the test runs without a display
+class LoopRoot:
+    def __init__(self):
+        self.timers = []
+        self.count = 0
+
+    def after(self, ms, function):
+        self.count += 1
+        heapq.heappush(self.timers, (time.monotonic()+ms/1000, self.count, function))
+
+    def run(self, seconds):
+        end = time.monotonic()+seconds
+        while self.timers and self.timers[0][0] < end:
+            due, count, function = heapq.heappop(self.timers)
+            time.sleep(max(0.0, due-time.monotonic()))
+            function()
+
+# Press a digit every 30ms while Gotos that take gotoSeconds (a store query and an
+# altitude check on a Pi) run, with the Goto on the Tk thread as gotoEntry used to
+# (blocking) or through the executor. Returns the seconds from each digit press being due
+# to its feedback, sorted, the number of Gotos that finished and the Executor.
+def latencyTest(gotoSeconds=0.3, blocking=False, digits=100, gotos=10):
+    root = LoopRoot()
+    executor = Executor(root)
+    shown = []
+    latencies = []
+
+    def goto(job):
+        time.sleep(gotoSeconds)
+        if not job.cancelled():
+            executor.ui(job, shown.append, "SLEWING")
+
+    def pressGoto():
+        if blocking:
+            goto(Job("goto", goto, (), None))
+        else:
+            executor.submit("goto", goto)
+
+    # Each digit press is due at a set time, latency runs from then to the feedback
+    def pressDigit(due):
+        executor.press(lambda: shown.append("digit"))
+        latencies.append(time.monotonic()-due)
+
+    start = time.monotonic()
+    for i in range(0, digits):
+        due = start+0.03*(i+1)
+        root.after(30*(i+1), lambda due=due: pressDigit(due))
+    for i in range(0, gotos):
+        root.after(300*i+5, pressGoto)
+    root.run(max(0.03*digits, 0.3*gotos)+0.5)
+    return sorted(latencies), shown.count("SLEWING"), executor
+
+# python executor.py [gotoSeconds] runs latencyTest once blocking and once through the
+# executor and prints press to feedback latency for the digits
+if __name__ == "__main__":
+    gotoSeconds = float(sys.argv[1]) if len(sys.argv) > 1 else 0.3
+    for blocking in (True, False):
+        latencies, done, executor = latencyTest(gotoSeconds, blocking)
+        print("%-9s digit press to feedback median %5.1fms, 95%% %5.1fms, worst %5.1fms, %d gotos done" %
+              ("blocking" if blocking else "executor", latencies[len(latencies)//2]*1000,
+               latencies[int(len(latencies)*0.95)]*1000, latencies[-1]*1000, done))
+        if not blocking:
+            print(executor.report())
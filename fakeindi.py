@@ -0,0 +1,281 @@
+import base64
+import io
+import socket
+import sys
+import threading
+import time
+import zlib
+import xml.etree.ElementTree as ET
+import numpy as np
+from astropy.io import fits
+
+from frames import Frame
+
+#######################################################################################
+#### F A K E   I N D I ################################################################
+#######################################################################################
+# A minimal INDI server with one camera, enough to test the BLOB path without indiserver:
+# it defines CONNECTION, CCD_EXPOSURE, CCD_COMPRESSION and the CCD1 BLOB, and answers an
+# exposure with a large FITS frame, zlib compressed (".fits.z") when CCD_COMPRESSION is
+# on. linkSpeed limits how fast the BLOB is sent, in bytes per second, to stand in for
+# indiserver running on another Pi, and defineDelay holds the properties back for a while,
+# as a driver that is still starting does. stop() kills it, closing every connection the way
+# indiserver going down does, and everything a client sends is kept in received.
+# "python fakeindi.py serve" runs it on port 7624 for the panels, "python fakeindi.py"
+# measures raw and compressed transfers and "python fakeindi.py reconnect" kills and
+# restarts it under indiclient.IndiClient to time the reconnect.
+class FakeIndiServer:
+    def __init__(self, device="CCD Simulator", image=None, port=7624, linkSpeed=None, defineDelay=0.0):
+        self.device = device
+        self.image = image if image is not None else np.zeros((480, 640), np.uint16)
+        self.port = port
+        self.linkSpeed = linkSpeed
+        self.defineDelay = defineDelay         # Seconds from getProperties to the definitions
+        self.compress = False
+        self.connections = []
+        self.received = []                     # (tag, property name) of everything clients sent
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("localhost", port))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        out = io.BytesIO()
+        fits.PrimaryHDU(self.image).writeto(out)
+        self.fits = out.getvalue()
+
+    def start(self):
+        threading.Thread(target=self.serve, daemon=True).start()
+        return self
+
+    def serve(self):
+        while True:
+            try:
+                connection, address = self.server.accept()
+            except OSError:
+                return
+            self.connections.append(connection)
+            threading.Thread(target=self.client, args=(connection,), daemon=True).start()
+
+    def stop(self):
+        # shutdown() wakes the accept() in serve(), close() alone leaves the port bound
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    # Send to a client, quietly giving up if it or the server has gone
+    def send(self, connection, text):
+        data = text.encode()
+        try:
+            if not self.linkSpeed:
+                connection.sendall(data)
+                return
+            chunk = max(1, int(self.linkSpeed/100))
+            for start in range(0, len(data), chunk):
+                began = time.perf_counter()
+                connection.sendall(data[start:start+chunk])
+                time.sleep(max(0.0, chunk/self.linkSpeed-(time.perf_counter()-began)))
+        except OSError:
+            pass
+
+    def definitions(self):
+        d = self.device
+        switch = lambda on: "On" if on else "Off"
+        return (
+            "<defSwitchVector device='%s' name='CONNECTION' state='Ok' perm='rw' rule='OneOfMany'>"
+            "<defSwitch name='CONNECT'>On</defSwitch><defSwitch name='DISCONNECT'>Off</defSwitch>"
+            "</defSwitchVector>\n" % d +
+            "<defNumberVector device='%s' name='CCD_EXPOSURE' state='Idle' perm='rw'>"
+            "<defNumber name='CCD_EXPOSURE_VALUE' format='%%5.2f' min='0' max='3600' step='1'>0</defNumber>"
+            "</defNumberVector>\n" % d +
+            "<defSwitchVector device='%s' name='CCD_COMPRESSION' state='Idle' perm='rw' rule='OneOfMany'>"
+            "<defSwitch name='INDI_ENABLED'>%s</defSwitch><defSwitch name='INDI_DISABLED'>%s</defSwitch>"
+            "</defSwitchVector>\n" % (d, switch(self.compress), switch(not self.compress)) +
+            "<defBLOBVector device='%s' name='CCD1' state='Idle' perm='ro'>"
+            "<defBLOB name='CCD1'/></defBLOBVector>\n" % d)
+
+    def blob(self):
+        data, format = self.fits, ".fits"
+        if self.compress:
+            data, format = zlib.compress(data), ".fits.z"
+        return ("<setBLOBVector device='%s' name='CCD1' state='Ok'>"
+                "<oneBLOB name='CCD1' size='%d' format='%s'>%s</oneBLOB></setBLOBVector>\n" %
+                (self.device, len(self.fits), format, base64.b64encode(data).decode()))
+
+    def client(self, connection):
+        parser = ET.XMLPullParser(events=("end",))
+        parser.feed("<stream>")
+        with connection:
+            while True:
+                try:
+                    data = connection.recv(65536)
+                except OSError:
+                    return
+                if not data:
+                    return
+                parser.feed(data)
+                for event, element in parser.read_events():
+                    self.received.append((element.tag, element.get("name")))
+                    if element.tag == "getProperties":
+                        time.sleep(self.defineDelay)
+                        self.send(connection, self.definitions())
+                    elif element.tag == "newSwitchVector" and element.get("name") == "CCD_COMPRESSION":
+                        for one in element:
+                            if one.get("name") == "INDI_ENABLED":
+                                self.compress = one.text.strip() == "On"
+                            elif one.get("name") == "INDI_DISABLED" and one.text.strip() == "On":
+                                self.compress = False
+                        self.send(connection, "<setSwitchVector device='%s' name='CCD_COMPRESSION' state='Ok'>"
+                                  "<oneSwitch name='INDI_ENABLED'>%s</oneSwitch></setSwitchVector>\n" %
+                                  (self.device, "On" if self.compress else "Off"))
+                    elif element.tag == "newNumberVector" and element.get("name") == "CCD_EXPOSURE":
+                        seconds = float(element[0].text)
+                        threading.Timer(seconds, lambda: self.send(connection, self.blob())).start()
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# A bare INDI client on a socket: ask for the properties, switch compression, take one
+# exposure and time the BLOB from the end of the exposure until it is a Frame
+def fetchFrame(port, compress, exposure=0.1):
+    connection = socket.create_connection(("localhost", port))
+    parser = ET.XMLPullParser(events=("end",))
+    parser.feed("<stream>")
+    connection.sendall(b"<getProperties version='1.7'/>\n<enableBLOB device='CCD Simulator'>Also</enableBLOB>\n")
+    connection.sendall(("<newSwitchVector device='CCD Simulator' name='CCD_COMPRESSION'>"
+                        "<oneSwitch name='INDI_ENABLED'>%s</oneSwitch></newSwitchVector>\n" %
+                        ("On" if compress else "Off")).encode())
+    time.sleep(0.2)
+    connection.sendall(("<newNumberVector device='CCD Simulator' name='CCD_EXPOSURE'>"
+                        "<oneNumber name='CCD_EXPOSURE_VALUE'>%g</oneNumber></newNumberVector>\n" % exposure).encode())
+    exposed = time.perf_counter()+exposure
+    received = 0
+    with connection:
+        while True:
+            data = connection.recv(1 << 20)
+            received += len(data)
+            parser.feed(data)
+            for event, element in parser.read_events():
+                if element.tag == "setBLOBVector":
+                    arrived = time.perf_counter()
+                    one = element[0]
+                    blob = base64.b64decode(one.text)
+                    frame = Frame.fromBlob(blob, one.get("format"), int(one.get("size")))
+                    done = time.perf_counter()
+                    return frame, received, arrived-exposed, done-arrived
+
+# Kill the server part way through an exposure, or while the camera is still starting up
+# (its properties held back for startupDelay seconds), restart it after downtime seconds
+# and time how long IndiClient takes to reconnect, set the camera up again and get a frame,
+# with the panels' startup sequences and resync. Returns when the server was killed, the
+# times things happened after, the failed connects, what the new server was sent, the
+# Startup and the IndiClient. Needs PyIndi, like the panels.
+def reconnectTest(image, downtime, during="exposure", exposure=1.0, startupDelay=1.0):
+    import PyIndi
+    from indiclient import IndiClient, IndiCamera
+    from startup import Startup, retry
+
+    defineDelay = startupDelay if during == "startup" else 0.0
+    server = FakeIndiServer(image=image, port=0, defineDelay=defineDelay).start()
+    port = server.port
+    client = IndiClient()
+    client.setServer("localhost", port)
+    camera = IndiCamera(client)
+    attempts = []
+
+    def startServer(step):
+        step("connect", lambda: attempts.append(retry(client.connectServer, first=0.25)))
+
+    # startCcd from the panels, less ACTIVE_DEVICES, which the fake camera does not have
+    def startCcd(step):
+        device = step("device", lambda: client.device("CCD Simulator"))
+        ccdExposure = step("CCD_EXPOSURE", lambda: client.property(device, "CCD_EXPOSURE", "Number"))
+        client.setBLOBMode(PyIndi.B_ALSO, "CCD Simulator", "CCD1")
+        ccd1 = step("CCD1", lambda: client.property(device, "CCD1", "BLOB"))
+        camera.attach(device, ccdExposure, ccd1)
+        camera.enableCompression()
+
+    disconnects = 0
+    resync = False
+    events = {}
+    startup = Startup()
+    startup.run("server", startServer)
+    startup.run("CCD Simulator", startCcd, after=("server",))
+    if during == "startup":
+        time.sleep(startupDelay/2)              # The CCD sequence is waiting for the camera
+    else:
+        startup.join()
+        camera.expose(exposure)
+        time.sleep(exposure/3)
+
+    # Kill indiserver and bring it back on the same port after downtime
+    servers = [server]
+    def restart():
+        servers.append(FakeIndiServer(image=image, port=port, defineDelay=defineDelay).start())
+        events["restarted"] = time.monotonic()
+    server.stop()
+    killed = time.monotonic()
+    threading.Timer(downtime, restart).start()
+
+    # The panels' mainline, one tick every 100ms
+    deadline = killed+downtime+30
+    while True:
+        if client.disconnects != disconnects:
+            disconnects = client.disconnects
+            events.setdefault("disconnect seen", time.monotonic())
+            startup.restart()
+            resync = True
+        elif resync and startup.done():
+            resync = False
+            events["ready"] = time.monotonic()
+            camera.expose(exposure)             # Any exposure went with the old connection
+        elif not resync and camera.ready():
+            break
+        if time.monotonic() > deadline:
+            servers[-1].stop()
+            raise RuntimeError("No frame 30s after the restart, startup shows "+startup.status())
+        time.sleep(0.1)
+    events["frame"] = time.monotonic()
+    camera.fetch().close()
+    client.disconnectServer()
+    servers[-1].stop()
+    resent = [name for tag, name in servers[-1].received if tag in ("enableBLOB", "newSwitchVector", "newNumberVector")]
+    return killed, events, attempts[-1], resent, startup, client
+
+# python fakeindi.py [Mbit/s] times raw and compressed BLOBs of a full PiCam v2 frame
+# python fakeindi.py serve [port] runs the fake camera for the panels
+# python fakeindi.py reconnect [downtime ...] kills and restarts it under IndiClient, once
+# mid exposure and once mid startup
+if __name__ == "__main__":
+    from stars import syntheticFrame
+
+    image = syntheticFrame(3280, 2464, 300, np.random.default_rng(1))[0]
+    if len(sys.argv) > 1 and sys.argv[1] == "reconnect":
+        for during in ("exposure", "startup"):
+            for downtime in [float(a) for a in sys.argv[2:]] or [0.5, 2.0, 5.0]:
+                killed, events, attempts, resent, startup, client = reconnectTest(image[:480, :640], downtime, during)
+                restarted = events["restarted"]
+                print("mid %-8s down %4.1fs: disconnect seen %4.2fs after the kill, %d failed connects, "
+                      "%d failed sequences, ready %4.2fs and frame %4.2fs after the restart, resent %s" %
+                      (during, downtime, events["disconnect seen"]-killed, attempts, startup.failures,
+                       events["ready"]-restarted, events["frame"]-restarted,
+                       ", ".join(name or "enableBLOB" for name in resent)))
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        server = FakeIndiServer(image=image, port=int(sys.argv[2]) if len(sys.argv) > 2 else 7624)
+        print("Fake INDI camera on port", server.port)
+        server.serve()
+    for speed in [float(a) for a in sys.argv[1:]] or [100.0, 1000.0]:
+        server = FakeIndiServer(image=image, port=0, linkSpeed=speed*1e6/8).start()
+        for compress in (False, True):
+            frame, received, transfer, decode = fetchFrame(server.port, compress)
+            print("%6.0f Mbit/s %-10s %5.1f MB on the wire, exposure end to BLOB %5.2fs (%5.1f MB/s), decode %4.0f ms" %
+                  (speed, "compressed" if compress else "raw", received/1e6, transfer, received/1e6/transfer,
+                   decode*1000))
+            frame.close()
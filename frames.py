@@ -0,0 +1,247 @@
+import io
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+import numpy as np
+from imports import lazy
+
+fits = lazy("astropy.io.fits")
+wcs = lazy("astropy.wcs")
+
+#######################################################################################
+#### F R A M E S ######################################################################
+#######################################################################################
+# A Frame wraps the CCD1 BLOB exactly as INDI handed it over. The FITS header is parsed
+# straight from memory, and the bytes only ever reach a file when an external solver
+# needs one, and then on tmpfs (/dev/shm) so nothing is written to the Pi's SD card.
+shmDir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# How a camera's frames are reduced before solving: binning factor, the fraction of the
+# width and height kept around the centre, and 16 or 8 bits per pixel
+Preprocess = namedtuple("Preprocess", ["binning", "crop", "bits"], defaults=(1, 1.0, 16))
+
+class Frame:
+    def __init__(self, data):
+        self.data = data                   # bytes from getblobdata(), never copied
+        self.view = memoryview(data)
+        self.hdul = None
+        self.path = None
+        self.starList = None
+        self.source = None                 # (frame, x0, y0, binning, width, height) preprocessed from
+        self.lock = threading.RLock()      # The stars may be found on another thread
+
+    # A Frame from a CCD1 BLOB. PyIndi only hands a BLOB over once all of it has arrived,
+    # so nothing here overlaps the transfer. With CCD_COMPRESSION on the driver sends
+    # ".fits.z", which is inflated into a buffer of the uncompressed size the driver
+    # announced, at most chunk bytes per decompress() call, each slice copied straight into
+    # place: no result string grows and nothing is joined at the end, though zlib cannot
+    # write into the buffer itself. A wrong announced size only costs growing or trimming the
+    # buffer, a stream that ends early raises zlib.error.
+    @classmethod
+    def fromBlob(cls, data, format=".fits", size=0, chunk=1 << 20):
+        if not format.endswith(".z"):
+            return cls(data)
+        inflater = zlib.decompressobj()
+        source = memoryview(data)
+        buffer = bytearray(size)
+        position = 0
+        start = 0
+        tail = b""
+        while not inflater.eof:
+            if tail:
+                piece = inflater.decompress(tail, chunk)
+            elif start < len(source):
+                piece = inflater.decompress(source[start:start+chunk], chunk)
+                start += chunk
+            else:
+                # All the input is in, whatever the inflater still holds
+                piece = inflater.flush()
+                if not inflater.eof:
+                    raise zlib.error("Compressed BLOB ends early, %d bytes inflated" % (position+len(piece)))
+            tail = inflater.unconsumed_tail
+            end = position+len(piece)
+            if end > len(buffer):
+                buffer.extend(bytes(end-len(buffer)))  # Only if the announced size was short
+            buffer[position:end] = piece
+            position = end
+        del buffer[position:]
+        return cls(buffer)
+
+    # Open the FITS data in memory, BytesIO shares the bytes object rather than copying it
+    def fits(self):
+        with self.lock:
+            if self.hdul is None:
+                self.hdul = fits.open(io.BytesIO(self.data), mode='readonly', ignore_missing_end=True)
+            return self.hdul
+
+    def header(self):
+        return self.fits()[0].header
+
+    # RA/Dec the camera driver stamped on the frame from the snooped telescope, in degrees
+    def crval(self):
+        w = wcs.WCS(self.header())
+        return w.wcs.crval[0], w.wcs.crval[1]
+
+    # The stars in the frame (a stars.Stars), found once and kept. A preprocessed frame
+    # takes the stars of the frame it came from, those in its crop with positions, HFR and
+    # area in its binned pixels, so the stars of an exposure are only found once, on the
+    # full frame as it arrives. Flux, peak and noise stay as measured there.
+    def stars(self):
+        with self.lock:
+            if self.starList is None:
+                if self.source is not None:
+                    frame, x0, y0, binning, width, height = self.source
+                    stars = frame.stars()
+                    x, y = stars.x-x0, stars.y-y0
+                    keep = (x > 0.5) & (x < width+0.5) & (y > 0.5) & (y < height+0.5)
+                    self.starList = stars._replace(x=(x[keep]-0.5)/binning+0.5, y=(y[keep]-0.5)/binning+0.5,
+                                                   flux=stars.flux[keep], peak=stars.peak[keep],
+                                                   hfr=stars.hfr[keep]/binning, area=stars.area[keep]/binning**2)
+                else:
+                    from stars import findStars
+                    self.starList = findStars(self.fits()[0].data)
+            return self.starList
+
+    # Height of the field in degrees from the optics the driver wrote into the header, None
+    # when the header does not say
+    def fov(self):
+        h = self.header()
+        try:
+            pixel = h["PIXSIZE2"]*h.get("YBINNING", 1)             # Microns
+            return math.degrees(h["NAXIS2"]*pixel/(h["FOCALLEN"]*1000))
+        except (KeyError, TypeError, ZeroDivisionError):
+            return None
+
+    # A smaller Frame for the solver: the centre crop of the first plane, binned (averaged)
+    # binning x binning and stored as 16 or 8 bit integers. The header keeps the position
+    # and has its binning, binned pixel sizes and WCS adjusted, PIXSIZE1/2 stay the sensor's
+    # unbinned pixels as INDI writes them, so fov() is the cropped field.
+    def preprocess(self, binning=1, crop=1.0, bits=16):
+        if binning == 1 and crop >= 1.0 and bits == 16:
+            return self
+        with self.lock:
+            hdu = self.fits()[0]
+            data = hdu.data
+            header = hdu.header.copy()
+        while data.ndim > 2:
+            data = data[0]
+        height, width = data.shape
+        cropHeight = int(height*min(crop, 1.0))//binning*binning
+        cropWidth = int(width*min(crop, 1.0))//binning*binning
+        # Keep the crop centred on the frame's centre
+        while (height-cropHeight) % 2:
+            cropHeight -= binning
+        while (width-cropWidth) % 2:
+            cropWidth -= binning
+        y0, x0 = (height-cropHeight)//2, (width-cropWidth)//2
+        data = data[y0:y0+cropHeight, x0:x0+cropWidth]
+        if binning > 1:
+            data = data.reshape(cropHeight//binning, binning, cropWidth//binning, binning).mean(axis=(1, 3), dtype=np.float32)
+
+        if bits == 8:
+            # Stretch from just under the sky to well above it, star cores clip at 255
+            sample = np.asarray(data[::4, ::4], dtype=np.float32)
+            sky = float(np.median(sample))
+            noise = 1.4826*float(np.median(np.abs(sample-sky))) or 1.0
+            low, high = sky-3*noise, min(float(sample.max()), sky+200*noise)
+            data = np.clip((np.asarray(data, dtype=np.float32)-low)*(255/max(high-low, 1)), 0, 255).astype(np.uint8)
+        else:
+            data = np.clip(np.rint(data), 0, 65535).astype(np.uint16)
+
+        for key in ("BITPIX", "BZERO", "BSCALE", "NAXIS3"):
+            header.remove(key, ignore_missing=True)
+        if binning > 1:
+            for key in ("XBINNING", "YBINNING"):
+                header[key] = header.get(key, 1)*binning
+        for key in ("XPIXSZ", "YPIXSZ", "CDELT1", "CDELT2", "CD1_1", "CD1_2", "CD2_1", "CD2_2"):
+            if key in header:
+                header[key] = header[key]*binning
+        for key, offset in (("CRPIX1", x0), ("CRPIX2", y0)):
+            if key in header:
+                header[key] = (header[key]-offset-0.5)/binning+0.5
+        out = io.BytesIO()
+        fits.PrimaryHDU(data, header).writeto(out)
+        prepared = Frame(out.getvalue())
+        prepared.source = (self, x0, y0, binning, cropWidth, cropHeight)
+        return prepared
+
+    # Write the frame to tmpfs for a solver that insists on a file and return the path
+    def toFile(self, name="solve.fits"):
+        if self.path is None:
+            path = os.path.join(shmDir, "pyindicontrolpad-"+name)
+            with open(path, "wb") as f:
+                f.write(self.view)
+            self.path = path
+        return self.path
+
+    def close(self):
+        with self.lock:
+            if self.hdul is not None:
+                self.hdul.close()
+                self.hdul = None
+            self.view.release()
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# python frames.py [fields] [astap] renders full resolution PiCam frames from a synthetic
+# star index and solves them at each binning factor, crop and bit depth with the local solver, and with ASTAP
+# too if its path is given
+if __name__ == "__main__":
+    from starsolve import StarIndex, render, syntheticIndex, LocalSolver
+    from solver import SolverRunner, SolveHints, SOLVED
+
+    fields = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    astap = sys.argv[2] if len(sys.argv) > 2 else None
+    rng = np.random.default_rng(1)
+    indexPath = os.path.join(tempfile.mkdtemp(), "stars.idx")
+    syntheticIndex(indexPath, rng)
+    index = StarIndex(indexPath)
+    width, height, fov = 3280, 2464, 1.5
+    frames = []
+    for i in range(fields):
+        ra, dec = rng.uniform(20, 70), rng.uniform(10, 50)
+        image = render(index, ra, dec, fov, width, height, rng.uniform(0, 360), False, rng)
+        header = fits.Header({"CTYPE1": "RA---TAN", "CTYPE2": "DEC--TAN",
+                              "CRVAL1": ra+rng.uniform(-0.3, 0.3), "CRVAL2": dec+rng.uniform(-0.3, 0.3),
+                              "CRPIX1": (width+1)/2, "CRPIX2": (height+1)/2, "FOCALLEN": 400.0,
+                              "PIXSIZE1": 1.12, "PIXSIZE2": 400.0*1000*math.radians(fov)/height})
+        out = io.BytesIO()
+        fits.PrimaryHDU(image, header).writeto(out)
+        frames.append((Frame(out.getvalue()), ra, dec))
+
+    engines = [("local", LocalSolver(indexPath))]
+    if astap:
+        engines.append(("astap", SolverRunner(astap, errPath=os.devnull)))
+    # The field preprocess reports must be the cropped field, whatever the binning
+    frame = frames[0][0]
+    for binning, crop in ((1, 1.0), (2, 1.0), (3, 1.0), (2, 0.5), (4, 0.5)):
+        small = frame.preprocess(binning, crop)
+        expected = fov*small.header()["NAXIS2"]*binning/height
+        print("bin %d crop %.1f field %.3f deg, expected %.3f" % (binning, crop, small.fov(), expected))
+        assert abs(small.fov()-expected) < 1e-6
+
+    # The pipeline finds each frame's stars as it arrives, before it is prepared
+    for frame, ra, dec in frames:
+        frame.stars()
+    hints = SolveHints(radii=(1,))
+    for binning, crop, bits in ((1, 1.0, 16), (2, 1.0, 16), (3, 1.0, 16), (4, 1.0, 16), (2, 1.0, 8), (2, 0.5, 16)):
+        for name, engine in engines:
+            times, solved, errors = [], 0, []
+            for frame, ra, dec in frames:
+                start = time.perf_counter()
+                small = frame.preprocess(binning, crop, bits)
+                engine.start(small, hints.args(small))
+                result = engine.wait()
+                times.append(time.perf_counter()-start)
+                if result.status == SOLVED:
+                    solved += 1
+                    dRa = ((result.solution.crval[0]-ra+180) % 360-180)*math.cos(math.radians(dec))
+                    errors.append(math.hypot(dRa, result.solution.crval[1]-dec)*3600)
+            print("bin %d crop %.1f %2d bit %-5s solved %d/%d, mean %.3fs (preprocess and solve), error %.1f\"" %
+                  (binning, crop, bits, name, solved, len(frames), np.mean(times), np.mean(errors) if errors else float("nan")))
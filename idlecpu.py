@@ -0,0 +1,73 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+#######################################################################################
+#### I D L E   C P U ##################################################################
+#######################################################################################
+# python idlecpu.py [seconds] [panel.py ...] measures how much of a core each panel takes
+# at rest, Tk and all. It starts indiserver with indi_simulator_telescope and
+# indi_simulator_ccd (unless something already listens on port 7624), starts the panel
+# (controlpad.py by default) against it, waits settle seconds for startup to finish and
+# then reads the panel's and indiserver's CPU time from /proc over seconds. The panel
+# needs a display. To compare with the old while(1) mainline, check the baseline out to
+# a file next to this one and pass it too, e.g.
+#   git show 020a29a:controlpad.py > controlpad_old.py
+#   python idlecpu.py 60 controlpad_old.py controlpad.py
+drivers = ["indi_simulator_telescope", "indi_simulator_ccd"]
+settle = 20.0
+ticks = os.sysconf("SC_CLK_TCK")
+
+# Seconds of CPU a process (and its threads) has used, user plus system
+def cpuSeconds(pid):
+    with open("/proc/%d/stat" % pid) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11])+int(fields[12]))/ticks
+
+def serverRunning(port=7624):
+    try:
+        socket.create_connection(("localhost", port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+def measure(panel, seconds, server):
+    process = subprocess.Popen([sys.executable, panel], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(settle)
+        if process.poll() is not None:
+            print("%s exited with %d, is there a display?" % (panel, process.returncode))
+            return
+        pids = [process.pid]+([server.pid] if server is not None else [])
+        start = [cpuSeconds(pid) for pid in pids]
+        wall = time.monotonic()
+        time.sleep(seconds)
+        used = [cpuSeconds(pid)-begin for pid, begin in zip(pids, start)]
+        wall = time.monotonic()-wall
+        print("%-20s %5.1f%% of a core over %.0fs" % (panel, 100*used[0]/wall, wall) +
+              (", indiserver %.1f%%" % (100*used[1]/wall) if server is not None else ""))
+    finally:
+        process.terminate()
+        process.wait()
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    panels = sys.argv[2:] or ["controlpad.py"]
+    server = None
+    if not serverRunning():
+        if shutil.which("indiserver") is None:
+            print("No indiserver on localhost:7624 and none installed to start, install indi-full")
+            sys.exit(1)
+        server = subprocess.Popen(["indiserver"]+drivers, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(3)
+    try:
+        for panel in panels:
+            measure(panel, seconds, server)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
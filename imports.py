@@ -0,0 +1,84 @@
+import importlib
+import sys
+import threading
+import time
+
+#######################################################################################
+#### I M P O R T S ####################################################################
+#######################################################################################
+# astropy, scipy and mysql.connector take seconds to import on a Pi, so the modules that
+# need them import them with lazy() and the panel is on screen before they are loaded.
+# lazy("astropy.io.fits") stands in for the module and imports it the first time one of
+# its attributes is used. preload() imports a list of modules on a background thread once
+# the panel and INDI are up, so the first solve or Goto finds them already loaded. Every
+# import made through here is timed, and report() is the import profile: how long the
+# panel's own imports took and what each deferred module cost and when it was loaded.
+# Import this module first so started is close to the start of the process.
+started = time.monotonic()
+lock = threading.Lock()
+timings = []                               # (module, seconds, how, seconds from started)
+
+def load(name, how="lazy"):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.monotonic()
+    module = importlib.import_module(name)
+    with lock:
+        timings.append((name, time.monotonic()-start, how, start-started))
+    return module
+
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__["name"] = name
+        self.__dict__["module"] = None
+
+    def __getattr__(self, attribute):
+        module = self.__dict__["module"]
+        if module is None:
+            module = self.__dict__["module"] = load(self.__dict__["name"])
+        return getattr(module, attribute)
+
+def lazy(name):
+    return LazyModule(name)
+
+# Time a block of imports made the ordinary way, e.g. the panel's import section
+def mark(name):
+    with lock:
+        timings.append((name, time.monotonic()-started, "startup", 0.0))
+
+# Import the named modules on a background thread, printing the profile after if asked
+def preload(names, printReport=False):
+    def run():
+        for name in names:
+            try:
+                load(name, "background")
+            except ImportError as e:
+                print("Unable to preload", name, "-- ", e)
+        if printReport:
+            print(report())
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def report():
+    with lock:
+        lines = ["%7.0f ms  %-10s at %6.2fs  %s" % (seconds*1000, how, at, name)
+                 for name, seconds, how, at in timings]
+    return "\n".join(["Import profile"]+lines)
+
+# What the solve and Goto paths load lazily, for the panels to preload. mysql.connector is
+# not here, it is loaded by the catalog only when the store is MySQL.
+deferred = ["astropy.io.fits", "astropy.wcs", "astropy.coordinates", "scipy.ndimage", "scipy.spatial"]
+
+# python imports.py [module ...] times importing each module in a fresh interpreter, by
+# default numpy and the deferred ones
+if __name__ == "__main__":
+    import subprocess
+    for name in sys.argv[1:] or ["numpy"]+deferred+["mysql.connector"]:
+        start = time.monotonic()
+        subprocess.run([sys.executable, "-c", "import "+name], check=True)
+        print("%7.0f ms  %s" % ((time.monotonic()-start)*1000, name))
+    start = time.monotonic()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    print("%7.0f ms  (interpreter start)" % ((time.monotonic()-start)*1000))
@@ -0,0 +1,234 @@
+import PyIndi
+import threading
+import time
+import queue
+from concurrent.futures import Future
+
+from frames import Frame
+
+#######################################################################################
+#### I N D I ##########################################################################
+#######################################################################################
+# IndiClient shared by controlpad.py and mini.py. The callbacks run on the INDI listener
+# thread, so instead of the mainline polling getNumber/getSwitch in a tight loop every
+# property change is pushed onto a queue which the Tk mainline drains with after()
+#
+# Devices and properties are also recorded as the server defines them, and device() and
+# property() wait on a Future that newDevice/newProperty resolve the moment the one asked
+# for turns up, rather than polling getDevice/getNumber every half second. The property
+# vectors are kept, so once defined property() is a dictionary lookup. When the server goes
+# away all of it is forgotten and disconnects is counted, for the panels to reconnect.
+class IndiClient(PyIndi.BaseClient):
+    def __init__(self):
+        super(IndiClient, self).__init__()
+        self.events = queue.Queue()
+        self.blobEvent = threading.Event()
+        self.blobTime = None               # When the last BLOB arrived, for the transfer rate
+        self.lock = threading.Lock()
+        self.defined = set()               # (device, property) pairs defined, property None for a device
+        self.waiting = {}                  # (device, property) -> Futures to resolve when it is defined
+        self.vectors = {}                  # (device, property) -> property vector
+        self.disconnects = 0               # Times the server went away, the mainline resyncs when it changes
+    def newDevice(self, d):
+        self.define((d.getDeviceName(), None))
+    def newProperty(self, p):
+        self.define((p.getDeviceName(), p.getName()))
+    def removeProperty(self, p):
+        key = (p.getDeviceName(), p.getName())
+        with self.lock:
+            self.defined.discard(key)
+            self.vectors.pop(key, None)
+    def newBLOB(self, bp):
+        self.blobTime = time.monotonic()
+        self.blobEvent.set()
+    def newSwitch(self, svp):
+        self.events.put((svp.device, svp.name))
+    def newNumber(self, nvp):
+        self.events.put((nvp.device, nvp.name))
+    def newText(self, tvp):
+        self.events.put((tvp.device, tvp.name))
+    def newLight(self, lvp):
+        pass
+    def newMessage(self, d, m):
+        pass
+    def serverConnected(self):
+        pass
+    # Everything the server defined went with it. Waits in progress are cancelled, which
+    # Startup takes as the sequence being abandoned rather than failed, and the mainline
+    # runs every sequence again when it sees disconnects change.
+    def serverDisconnected(self, code):
+        with self.lock:
+            self.defined.clear()
+            self.vectors.clear()
+            waiting = self.waiting
+            self.waiting = {}
+            self.disconnects += 1
+        for futures in waiting.values():
+            for future in futures:
+                future.cancel()
+
+    def define(self, key):
+        with self.lock:
+            self.defined.add(key)
+            futures = self.waiting.pop(key, [])
+        for future in futures:
+            future.set_result(key)
+
+    # A Future resolved when the device, or one of its properties, has been defined
+    def future(self, device, name=None):
+        future = Future()
+        with self.lock:
+            if (device, name) in self.defined:
+                future.set_result((device, name))
+            else:
+                self.waiting.setdefault((device, name), []).append(future)
+        return future
+
+    # The device, waiting until the server has defined it. A timeout raises
+    # concurrent.futures.TimeoutError, None waits for ever, and the server going away
+    # concurrent.futures.CancelledError.
+    def device(self, name, timeout=None):
+        self.future(name).result(timeout)
+        return self.getDevice(name)
+
+    # A property vector of a device, kind is "Number", "Switch", "Text", "BLOB" or "Light"
+    def property(self, device, name, kind, timeout=None):
+        key = (device.getDeviceName(), name)
+        vector = self.vectors.get(key)
+        if vector is None:
+            self.future(*key).result(timeout)
+            vector = getattr(device, "get"+kind)(name)
+            with self.lock:
+                if key in self.defined:
+                    self.vectors[key] = vector
+        return vector
+
+    # Drain the event queue and return the set of (device, property) pairs that changed
+    # since the last call, so several updates to the same property cost one redraw
+    def changes(self):
+        changed = set()
+        while True:
+            try:
+                changed.add(self.events.get_nowait())
+            except queue.Empty:
+                return changed
+
+# IndiCamera is the CCD as the solve pipeline (pipeline.py) sees it: start an exposure,
+# abort it, see whether the CCD1 BLOB has arrived and fetch it as a Frame. With
+# enableCompression() the driver zlib compresses the FITS (".fits.z"), halving what goes
+# over the network at the cost of compressing on the camera's Pi, which pays when
+# indiserver is on another machine over Wi-Fi. Each BLOB's transfer rate, compression
+# and decode time are kept for report(). The camera can be made before the CCD is up and
+# attach()ed to it once startup has found its properties.
+class IndiCamera:
+    def __init__(self, indiclient, device=None, exposure=None, blob=None):
+        self.indiclient = indiclient
+        self.attach(device, exposure, blob)
+        self.exposeEnd = None
+        self.transfers = []                # (seconds, bytes received, bytes of FITS, seconds to decode)
+
+    def attach(self, device, exposure, blob):
+        self.device = device
+        self.exposure = exposure           # The CCD_EXPOSURE number vector
+        self.blob = blob                   # The CCD1 BLOB vector
+
+    # Ask the driver for compressed BLOBs, False if it has no CCD_COMPRESSION switch
+    def enableCompression(self, enable=True):
+        compression = self.device.getSwitch("CCD_COMPRESSION")
+        if not compression:
+            return False
+        for switch in compression:
+            if switch.name in ("INDI_ENABLED", "CCD_COMPRESS"):
+                switch.s = PyIndi.ISS_ON if enable else PyIndi.ISS_OFF
+            else:
+                switch.s = PyIndi.ISS_OFF if enable else PyIndi.ISS_ON
+        self.indiclient.sendNewSwitch(compression)
+        return True
+
+    def expose(self, seconds):
+        self.indiclient.blobEvent.clear()
+        self.exposeEnd = time.monotonic()+seconds
+        self.exposure[0].value = seconds
+        self.indiclient.sendNewNumber(self.exposure)
+
+    def abort(self):
+        abort = self.device.getSwitch("CCD_ABORT_EXPOSURE")
+        if abort:
+            abort[0].s = PyIndi.ISS_ON
+            self.indiclient.sendNewSwitch(abort)
+
+    def ready(self):
+        if self.indiclient.blobEvent.is_set():
+            self.indiclient.blobEvent.clear()
+            return True
+        return False
+
+    def fetch(self):
+        blob = self.blob[0]
+        start = time.monotonic()
+        frame = Frame.fromBlob(blob.getblobdata(), blob.format, blob.size)
+        decoded = time.monotonic()
+        if self.exposeEnd is not None and self.indiclient.blobTime is not None:
+            self.transfers.append((max(0.0, self.indiclient.blobTime-self.exposeEnd), blob.bloblen,
+                                   len(frame.data), decoded-start))
+        return frame
+
+    def report(self):
+        if not self.transfers:
+            return "BLOBs none"
+        seconds, received, size, decode = (sum(column) for column in zip(*self.transfers))
+        count = len(self.transfers)
+        return "BLOBs %d, %.1f MB/s, %.1fs transfer, compression %.1fx, decode %.0f ms" % (
+            count, received/1e6/max(seconds, 1e-6), seconds/count, size/max(received, 1), decode/count*1000)
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# The properties the panels wait for at startup
+startupProperties = [("CONNECTION", "Switch"), ("ON_COORD_SET", "Switch"), ("EQUATORIAL_EOD_COORD", "Number"),
+                     ("CONNECTION", "Switch"), ("CCD_EXPOSURE", "Number"), ("ACTIVE_DEVICES", "Text"),
+                     ("CCD1", "BLOB")]
+
+def startup(telescope, ccd, polled):
+    client = IndiClient()
+    client.setServer("localhost", 7624)
+    start = time.monotonic()
+    if not client.connectServer():
+        return None
+    for i, (name, kind) in enumerate(startupProperties):
+        deviceName = telescope if i < 3 else ccd
+        if polled:
+            # The way the panels used to wait
+            device = client.getDevice(deviceName)
+            while not device:
+                time.sleep(0.5)
+                device = client.getDevice(deviceName)
+            vector = getattr(device, "get"+kind)(name)
+            while not vector:
+                time.sleep(0.5)
+                vector = getattr(device, "get"+kind)(name)
+        else:
+            vector = client.property(client.device(deviceName, 30), name, kind, 30)
+        if name == "CONNECTION" and not client.getDevice(deviceName).isConnected():
+            vector[0].s = PyIndi.ISS_ON
+            vector[1].s = PyIndi.ISS_OFF
+            client.sendNewSwitch(vector)
+    elapsed = time.monotonic()-start
+    client.disconnectServer()
+    return elapsed
+
+# python indiclient.py [telescope] [ccd] [repeats] times connecting and waiting for the
+# startup properties, polling every 0.5s against the Futures. Run it against
+# "indiserver indi_simulator_telescope indi_simulator_ccd".
+if __name__ == "__main__":
+    import sys
+    telescope = sys.argv[1] if len(sys.argv) > 1 else "Telescope Simulator"
+    ccd = sys.argv[2] if len(sys.argv) > 2 else "CCD Simulator"
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    # The first run connects the devices, after that they are already connected
+    if startup(telescope, ccd, False) is None:
+        print("No indiserver on localhost:7624")
+        sys.exit(1)
+    for polled in (True, False):
+        times = [startup(telescope, ccd, polled) for i in range(repeats)]
+        print("%-8s startup mean %.2fs, worst %.2fs" % ("polled" if polled else "futures", sum(times)/len(times), max(times)))
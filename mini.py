@@ -1,18 +1,10 @@
+import imports                          # First, it times the imports that follow
 import tkinter as tk
 import pytz
 from datetime import datetime
 import socket
 import PyIndi
 import time
-import numpy as np
-from astropy import wcs
-from astropy.wcs import WCS
-from astropy.table import Table
-from astropy.io import fits
-from astropy.coordinates import EarthLocation,SkyCoord
-from astropy.time import Time
-from astropy import units as u
-from astropy.coordinates import AltAz
 import sys
 import threading
 import os
@@ -20,12 +12,36 @@ import subprocess as subp
 import math
 from datetime import datetime
 from tzlocal import get_localzone
+from indiclient import IndiClient, IndiCamera
+from startup import Startup, retry
+from render import Renderer
+from solver import SolverRunner, SolveHints, SOLVED
+from pipeline import SolvePipeline
+from starsolve import LocalSolver, SolverChain, searchRadii
+from stars import describe
+from frames import Preprocess
+from centering import CenteringEngine, MOVE
+from calibration import CalibrationStore, setupName
+
+imports.mark("panel imports")
 
 #######################################################################################
 #### V A R I A B L E S ################################################################
 #######################################################################################     
 debug=1
 exposure=5.0
+astap="/usr/local/bin/astap"
+solveTimeout=30                         # Seconds before a solve is killed
+solverEngine="astap"                    # "astap", "local" (in process, needs starIndex) or "local+astap"
+starIndex="stars.idx"                   # Star index for the local solver, built with starsolve.py index
+pipelined=False                         # Expose the next frame while the last one solves, nearly twice the exposures for slightly faster centring
+solveRadii=(5, 15, 50)                  # ASTAP search radius around the mount position in degrees, widened after a failed solve
+localRadius=2.0                         # Local solver search radius in degrees, tried first with "local" and "local+astap"
+fov=0                                   # Field height in degrees for ASTAP, 0 to read it from the frame header
+# Per camera binning, centre crop and bits of the frame handed to the solver, cameras not
+# listed are solved at full resolution
+preprocess={"CCD Simulator": Preprocess(binning=2, crop=1.0, bits=16)}
+testImage=""                            # Solve this file instead of the camera frame (astap won't solve ccd simulator images)
 telescope="Telescope Simulator"
 device_telescope=None
 telescope_connect=None
@@ -39,6 +55,9 @@ currLong= -97.1384
 currAlt=300
 minAlt=15                            	# Minimum altitude to slew to
 currTour=0				# Current tour we're working on
+calibrationFile="calibration.json"     # Sync offsets between the solver camera and the scope, per setup
+compressBlobs=False                    # Compressed BLOBs (".fits.z"), worth it when indiserver is on another Pi over Wi-Fi
+syncing=False
    
 #######################################################################################
 #### F U N C T I O N S ################################################################
@@ -64,119 +83,100 @@ def solveOnEntry():
     solveOk=True
     return 
 
+# The user has centred the current object in the eyepiece, solve to find where the camera
+# is pointing and keep the difference as this setup's calibration
 def syncEntry():
-    
+    global solveOk, syncing
+    syncing=True
+    solveOk=False
     return   
     
 #######################################################################################
 #### I N D I ##########################################################################
 #######################################################################################  
-# Connect to INDI and set up devices
-class IndiClient(PyIndi.BaseClient):
-    def __init__(self):
-        super(IndiClient, self).__init__()
-    def newDevice(self, d):
-        pass
-    def newProperty(self, p):
-        pass
-    def removeProperty(self, p):
-        pass
-    def newBLOB(self, bp):
-        global blobEvent
-        blobEvent.set()
-        pass
-    def newSwitch(self, svp):
-        pass
-    def newNumber(self, nvp):
-        pass
-    def newText(self, tvp):
-        pass
-    def newLight(self, lvp):
-        pass
-    def newMessage(self, d, m):
-        pass
-    def serverConnected(self):
-        pass
-    def serverDisconnected(self, code):
-        pass
-
+# Connect to INDI and set up devices. The server connection, the telescope and the CCD are
+# brought up by startup.py, the devices concurrently on their own threads while the window
+# is built, and the mainline leaves them alone until startup.ready() says they are up
 indiclient=IndiClient()
 indiclient.setServer("localhost",7624)
+camera=IndiCamera(indiclient)
+
+# Keep trying to reach indiserver, backing off up to 30s between attempts
+def startServer(step):
+    def failed(attempt, delay):
+        if attempt == 1:
+            print("No indiserver running on "+indiclient.getHost()+":"+str(indiclient.getPort())+" - Try to run")
+            print("  indiserver indi_simulator_telescope indi_simulator_ccd")
+        if debug:
+            print("Retrying indiserver in %.1fs" % delay)
+    step("connect", lambda: retry(indiclient.connectServer, onFailure=failed))
 
-if (not(indiclient.connectServer())):
-     print("No indiserver running on "+indiclient.getHost()+":"+str(indiclient.getPort())+" - Try to run")
-     print("  indiserver indi_simulator_telescope indi_simulator_ccd")
-     sys.exit(1)
- 
-# get the telescope device
-device_telescope=indiclient.getDevice(telescope)
-while not(device_telescope):
-    time.sleep(0.5)
-    device_telescope=indiclient.getDevice(telescope)
-     
-# wait CONNECTION property be defined for telescope
-telescope_connect=device_telescope.getSwitch("CONNECTION")
-while not(telescope_connect):
-    time.sleep(0.5)
-    telescope_connect=device_telescope.getSwitch("CONNECTION")
- 
-# if the telescope device is not connected, we do connect it
-if not(device_telescope.isConnected()):
-    # Property vectors are mapped to iterable Python objects
-    # Hence we can access each element of the vector using Python indexing
-    # each element of the "CONNECTION" vector is a ISwitch
-    telescope_connect[0].s=PyIndi.ISS_ON  # the "CONNECT" switch
-    telescope_connect[1].s=PyIndi.ISS_OFF # the "DISCONNECT" switch
-    indiclient.sendNewSwitch(telescope_connect) # send this new value to the device
-
-# We want to set the ON_COORD_SET switch to engage tracking after goto
-# device.getSwitch is a helper to retrieve a property vector
-telescope_on_coord_set=device_telescope.getSwitch("ON_COORD_SET")
-while not(telescope_on_coord_set):
-    time.sleep(0.5)
-    telescope_on_coord_set=device_telescope.getSwitch("ON_COORD_SET")
-
-# the order below is defined in the property vector
-telescope_on_coord_set[0].s=PyIndi.ISS_ON  # TRACK
-telescope_on_coord_set[1].s=PyIndi.ISS_OFF # SLEW
-telescope_on_coord_set[2].s=PyIndi.ISS_OFF # SYNC
-indiclient.sendNewSwitch(telescope_on_coord_set)
+def startTelescope(step):
+    global device_telescope, telescope_connect
+    # get the telescope device
+    device_telescope=step("device", lambda: indiclient.device(telescope))
+
+    # wait CONNECTION property be defined for telescope
+    telescope_connect=step("CONNECTION", lambda: indiclient.property(device_telescope, "CONNECTION", "Switch"))
+
+    # if the telescope device is not connected, we do connect it
+    if not(device_telescope.isConnected()):
+        # Property vectors are mapped to iterable Python objects
+        # Hence we can access each element of the vector using Python indexing
+        # each element of the "CONNECTION" vector is a ISwitch
+        telescope_connect[0].s=PyIndi.ISS_ON  # the "CONNECT" switch
+        telescope_connect[1].s=PyIndi.ISS_OFF # the "DISCONNECT" switch
+        indiclient.sendNewSwitch(telescope_connect) # send this new value to the device
+
+    # We want to set the ON_COORD_SET switch to engage tracking after goto
+    # indiclient.property waits until the property vector is defined and returns it
+    telescope_on_coord_set=step("ON_COORD_SET", lambda: indiclient.property(device_telescope, "ON_COORD_SET", "Switch"))
+
+    # the order below is defined in the property vector
+    telescope_on_coord_set[0].s=PyIndi.ISS_ON  # TRACK
+    telescope_on_coord_set[1].s=PyIndi.ISS_OFF # SLEW
+    telescope_on_coord_set[2].s=PyIndi.ISS_OFF # SYNC
+    indiclient.sendNewSwitch(telescope_on_coord_set)
+    step("EQUATORIAL_EOD_COORD", lambda: indiclient.property(device_telescope, "EQUATORIAL_EOD_COORD", "Number"))
 
 # Set up CCD camera 
-device_ccd=indiclient.getDevice(ccd)
-while not(device_ccd):
-    time.sleep(0.5)
-    device_ccd=indiclient.getDevice(ccd)   
- 
-ccd_connect=device_ccd.getSwitch("CONNECTION")
-while not(ccd_connect):
-    time.sleep(0.5)
-    ccd_connect=device_ccd.getSwitch("CONNECTION")
-if not(device_ccd.isConnected()):
-    ccd_connect[0].s=PyIndi.ISS_ON  # the "CONNECT" switch
-    ccd_connect[1].s=PyIndi.ISS_OFF # the "DISCONNECT" switch
-    indiclient.sendNewSwitch(ccd_connect)
- 
-ccd_exposure=device_ccd.getNumber("CCD_EXPOSURE")
-while not(ccd_exposure):
-    time.sleep(0.5)
-    ccd_exposure=device_ccd.getNumber("CCD_EXPOSURE")
- 
-# Ensure the CCD driver snoops the telescope driver
-ccd_active_devices=device_ccd.getText("ACTIVE_DEVICES")
-while not(ccd_active_devices):
-    time.sleep(0.5)
-    ccd_active_devices=device_ccd.getText("ACTIVE_DEVICES")
-ccd_active_devices[0].text=telescope
-indiclient.sendNewText(ccd_active_devices)
- 
-# we should inform the indi server that we want to receive the
-# "CCD1" blob from this device
-indiclient.setBLOBMode(PyIndi.B_ALSO, ccd, "CCD1")
-ccd_ccd1=device_ccd.getBLOB("CCD1")
-while not(ccd_ccd1):
-    time.sleep(0.5)
-    ccd_ccd1=device_ccd.getBLOB("CCD1")
+def startCcd(step):
+    global device_ccd
+    device_ccd=step("device", lambda: indiclient.device(ccd))
+
+    ccd_connect=step("CONNECTION", lambda: indiclient.property(device_ccd, "CONNECTION", "Switch"))
+    if not(device_ccd.isConnected()):
+        ccd_connect[0].s=PyIndi.ISS_ON  # the "CONNECT" switch
+        ccd_connect[1].s=PyIndi.ISS_OFF # the "DISCONNECT" switch
+        indiclient.sendNewSwitch(ccd_connect)
+
+    ccd_exposure=step("CCD_EXPOSURE", lambda: indiclient.property(device_ccd, "CCD_EXPOSURE", "Number"))
+
+    # Ensure the CCD driver snoops the telescope driver
+    ccd_active_devices=step("ACTIVE_DEVICES", lambda: indiclient.property(device_ccd, "ACTIVE_DEVICES", "Text"))
+    ccd_active_devices[0].text=telescope
+    indiclient.sendNewText(ccd_active_devices)
+
+    # we should inform the indi server that we want to receive the
+    # "CCD1" blob from this device
+    indiclient.setBLOBMode(PyIndi.B_ALSO, ccd, "CCD1")
+    ccd_ccd1=step("CCD1", lambda: indiclient.property(device_ccd, "CCD1", "BLOB"))
+    camera.attach(device_ccd, ccd_exposure, ccd_ccd1)
+    if compressBlobs and not camera.enableCompression():
+        print("CCD "+ccd+" has no CCD_COMPRESSION, BLOBs are sent uncompressed")
+
+# Print where the boot time went once every device is up (or has failed)
+# Then load what the first solve and Goto need in the background
+def startupDone():
+    if debug:
+        print(startup.report())
+    if startup.restarts == 0:
+        imports.preload(imports.deferred, printReport=debug)
+
+startup=Startup(onDone=startupDone)
+startup.run("server", startServer)
+startup.run(telescope, startTelescope, after=("server",))
+startup.run(ccd, startCcd, after=("server",))
 
 ##### Determine our IP address ##########################################################
 s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -215,7 +215,7 @@ solveOnButton=tk.Button(root, text="Solve On", command=lambda: solveOnEntry(), f
 solveOnButton.grid(row=1, column=1, sticky="nsew")
 solveOffButton=tk.Button(root, text="Solve Off", command=lambda: solveOffEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 solveOffButton.grid(row=2, column=1, sticky="nsew")
-syncButton=tk.Button(root, text="Solve Off", command=lambda: syncEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
+syncButton=tk.Button(root, text="Sync", command=lambda: syncEntry(), fg='red', bg='black', padx=2, highlightbackground='red', highlightthickness=2, highlightcolor="black", font='verdana 24')
 syncButton.grid(row=3, column=1, sticky="nsew")
 
 # Bottom Rows
@@ -229,144 +229,222 @@ currIPText.grid(row=4, column=2, sticky="nsew")
 #######################################################################################
 #### M A I N L I N E ##################################################################
 #######################################################################################  
+# The mainline is driven by the Tk event loop rather than a busy while loop. INDI property
+# changes are queued by the IndiClient callbacks and drained every tickMs, and a label is
+# only reconfigured when its text changes, so the Pi idles between events and ASTAP gets
+# the CPU while solving.
+tickMs = 100
 solveOk = True
+slewing = None
+lastSlew = None                        # Slew to send again if indiserver restarts
+disconnects = 0
+resync = set()                         # Devices to resync once they are back
+solver = SolverRunner(command=astap, timeout=solveTimeout)
+if solverEngine == "local":
+    solver = LocalSolver(starIndex, maxRadius=localRadius, timeout=solveTimeout)
+elif solverEngine == "local+astap":
+    solver = SolverChain(LocalSolver(starIndex, maxRadius=localRadius, timeout=solveTimeout), solver)
+# A test image is not where the mount is pointing, so it is always solved blind
+hints = SolveHints(radii=searchRadii(solverEngine, solveRadii, localRadius), fov=fov) if not testImage else None
+pipeline = SolvePipeline(camera, solver, exposure, pipelined=pipelined, hints=hints, analyse=True,
+                         prepare=lambda frame: testImage or frame.preprocess(*preprocess.get(ccd, Preprocess())))
+centering = CenteringEngine(tolerance=maxDeviation)
+calibration = CalibrationStore(calibrationFile)
+setup = setupName(telescope, ccd)
+renderer = Renderer(root, frameMs=tickMs)
+cpuWall = time.time()
+cpuUsed = time.process_time()
 
-while (1):        # Loop forever
-    # Update coordinates 
-    telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-    while not(telescope_radec):
-        time.sleep(0.5)
-        telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")   
-        
-    # Update Display
+# Print the share of one CPU core the panel used since the last report
+def cpuReport():
+    global cpuWall, cpuUsed
+    wall = time.time()
+    used = time.process_time()
+    print("CPU used %.1f%% over the last %.0fs" % (100*(used-cpuUsed)/(wall-cpuWall), wall-cpuWall))
+    cpuWall = wall
+    cpuUsed = used
+    print(renderer.report())
+    root.after(60000, cpuReport)
+
+def updateDisplay():
     dateTimeObj = datetime.now()
-    currDateText.configure(text=dateTimeObj.strftime("%d-%b-%Y\n%H:%M:%S"))
+    renderer.set(currDateText, dateTimeObj.strftime("%d-%b-%Y\n%H:%M:%S"))
     dateTimeObj = datetime.now(tz=utc)
-    currUTDateText.configure(text=dateTimeObj.strftime("%d-%b-%Y\n%H:%M:%S UT"))
-    currObjText.configure(text=objectDisplay)
-    root.update_idletasks()
-    root.update()
+    renderer.set(currUTDateText, dateTimeObj.strftime("%d-%b-%Y\n%H:%M:%S UT"))
+
+def updateStatus():
+    global solveOk, slewing, disconnects, resync
+
+    # indiserver went away, bring everything up again and carry on where we were
+    if indiclient.disconnects != disconnects:
+        disconnects = indiclient.disconnects
+        print("Lost indiserver, reconnecting")
+        startup.restart()
+        resync = {telescope, ccd}
+
+    # Each device is used as soon as it is up, so one that is missing or failed (no camera
+    # attached, a driver crashing) leaves the others working while startup retries it.
+    # Until the telescope is up show what startup is waiting for.
+    for device in [device for device in resync if startup.ready(device)]:
+        resync.discard(device)
+        resyncState(device)
+    if not startup.ready(telescope):
+        renderer.set(currStatusText, startup.status(), immediate=True)
+        return
+
+    # See if we are slewing or do we need a solve? Only look at the coordinates when INDI
+    # told us they changed (or we have never seen them yet)
+    changed = indiclient.changes()
+    if slewing is None or (telescope, "EQUATORIAL_EOD_COORD") in changed:
+        telescope_radec = device_telescope.getNumber("EQUATORIAL_EOD_COORD")
+        if not telescope_radec:
+            return
+        slewing = telescope_radec.s == PyIndi.IPS_BUSY
+
+    if slewing:
+        renderer.set(currStatusText, "SLEWING", immediate=True)
+        solveOk = False  # We'll need to do a solve after the motion stops
+        if pipeline.busy():
+            # Any frame taken or being solved is stale now
+            pipeline.invalidate()
+        return
+
+    # The rest needs the camera, until it is up show what startup says about it
+    if not startup.ready(ccd):
+        renderer.set(currStatusText, startup.status(), immediate=True)
+        return
+
+    # Update the status
+    if not pipeline.busy():
+        renderer.set(currStatusText, "TRACKING", immediate=True)
     
-    # See if we are slewing or do we need a solve?
-    if (telescope_radec.s==PyIndi.IPS_BUSY):
-        currStatusText.configure(text="SLEWING")
-        root.update()
-        solveOk=False  # We'll need to do a solve after the motion stops
-    else:
-        # Update the status
-        currStatusText.configure(text="TRACKING")
-        root.update()
-        
-        # See if User wants a solve by creating a solve.requested file
-        if os.path.exists('solve.requested'):
-            os.remove('solve.requested')
-            solveOk = False
-
-        # Otherwise if we're good, don't continue on to solve
-        if solveOk:
-            continue
- 
-        # Run the solve program 
-        # Update display
-        currStatusText.configure(text="SOLVING")
-        root.update()
-            
-        # Initiate an image on the camera
-        blobEvent=threading.Event()
-        blobEvent.clear()
-        ccd_exposure[0].value=exposure
-        indiclient.sendNewNumber(ccd_exposure)
-        blobEvent.wait()
-        blobEvent.clear()
+    # See if User wants a solve by creating a solve.requested file
+    if os.path.exists('solve.requested'):
+        os.remove('solve.requested')
+        solveOk = False
+
+    # Otherwise if we're good, don't continue on to solve
+    if not solveOk:
+        solve()
+
+# A device is back after indiserver restarted. The exposure in progress went with the
+# old connection, and a slew not known to have finished is sent again. Centring and solving
+# carry on from where they were.
+def resyncState(device):
+    global slewing
+    if device == ccd:
+        pipeline.invalidate()
+        return
+    slewing = None
+    if lastSlew is not None:
         if debug:
-            print("name: ", ccd_ccd1[0].name," size: ", ccd_ccd1[0].size," format: ", ccd_ccd1[0].format)
-        ccdimage=ccd_ccd1[0].getblobdata()
-
-        # Write the image to disk - disabled because astap won't solve ccd simulator images
-#        filehandle = open('solve.fits', 'wb')
-#        filehandle.write(ccdimage)
-#        filehandle.close()
-
-        # Remove plate solve results
-        if os.path.exists('solve.ini'):
-           os.remove('solve.ini')
-        if os.path.exists('solve.wcs'):
-           os.remove('solve.wcs')
-
-        # Do a plate solve on the fits data
-        cmd="/usr/local/bin/astap -r 50 -f solve.fits >solve.err 2>&1"
-        if (debug): 
-            print("Solving...")
-            print(cmd)
-        # Create a process to call the solver and wait for completion 
-        timeout=0 
-        os.system(cmd)
-        while not os.path.exists('solve.wcs'):
-            if debug:
-                print ("Sleeping...")
-            time.sleep(0.5)
-            timeout=timeout+0.5
-            if (timeout==10):
-                print ("Error, solve not completed in 10s!")
-                continue;
-                
-
-        # Load the wcs FITS hdulist using astropy.io.fits
-        #with fits.open('solve.wcs', mode='readonly', ignore_missing_end=True) as fitsfile:
-        #    w = WCS(fitsfile[0].header) 
-        #    solveRa=w.wcs.crval[0]
-        #    solveDec=w.wcs.crval[1]
-        # Kludge because wcs file keeps bombing with corrupt file error, doh!
-        os.system("cat solve.wcs | grep CRVAL1 | cut -b12-30 > solve.kludge")
-        os.system("cat solve.wcs | grep CRVAL2 | cut -b12-30 >> solve.kludge")
-        kludgefile=open("solve.kludge","r")
-        rastr=kludgefile.read(19)
-        decstr=kludgefile.read(1) # ignore the CR 
-        decstr=kludgefile.read(19)
+            print("Resending slew to",lastSlew[0],lastSlew[1])
+        slewTo(*lastSlew)
+
+# Slew the telescope, RA in hours. The target is kept until centring is over so it can be
+# sent again if indiserver restarts on the way.
+def slewTo(ra, dec):
+    global lastSlew
+    lastSlew = (ra, dec)
+    telescope_radec=indiclient.property(device_telescope, "EQUATORIAL_EOD_COORD", "Number")
+    telescope_radec[0].value=ra
+    telescope_radec[1].value=dec
+    indiclient.sendNewNumber(telescope_radec)
+
+# solve() is called every tick while a solve is needed. The pipeline steps through the
+# exposures and ASTAP runs without ever blocking the Tk event loop, and with pipelined set
+# the next frame is already exposing while the last one solves.
+def solve():
+    result = pipeline.tick()
+    if pipeline.busy():
+        renderer.set(currStatusText, "SOLVING", immediate=True)
+
+    # Pass on the solver output
+    while not solver.output.empty():
+        line = solver.output.get()
         if debug:
-            print("Kludge coords: ",rastr," ",decstr)
-        kludgefile.close()
-        solveRa=float(rastr)
-        solveDec=float(decstr)
-        
-        if (debug): 
-            print("Solved RA= ",solveRa," Dec=",solveDec)
-
-        # Load the ccd image FITS hdulist using astropy.io.fits
-        with fits.open('solve.fits', mode='readonly', ignore_missing_end=True) as fitsfile:
-            w = WCS(fitsfile[0].header) 
-            ccdRa=w.wcs.crval[0]
-            ccdDec=w.wcs.crval[1]
-        if (debug): 
-           print("CCD RA= ",solveRa," Dec=",solveDec)
-            
-        # Compare the plate solve to the current RA/DEC, convert to arcsecs
-        deltaRa = (solveRa - ccdRa)*60*60 
-        deltaDec = (solveDec - ccdDec)*60*60
-        if (debug): 
-           print("Delta RA= ",deltaRa," Delta Dec=",deltaDec)
+            print(line)
+    if result is None:
+        return
+    result, frame = result
+    if debug:
+        print(describe(frame.stars()))
+    if result.status != SOLVED:
+        print ("Error, solve "+result.status+" after %.1fs" % result.elapsed)
+        if result.error is not None:
+            # The solver could not be run at all, say so rather than retry silently
+            print("Solver error -- ", result.error)
+            renderer.flash(currStatusText, "SOLVER ERROR")
+        frame.close()
+        return
+    if debug:
+        print("Solved in %.1fs" % result.elapsed)
+    finishSolve(result.solution, frame)
+    frame.close()
+
+# Compare the solved position with the mount and correct the pointing if needed
+def finishSolve(solution, frame):
+    global solveOk, syncing, lastSlew
+
+    solveRa, solveDec = solution.crval
+    
+    if (debug): 
+        print("Solved RA= ",solveRa," Dec=",solveDec)
+
+    # The coordinates the camera stamped on the frame, read from the header in memory
+    ccdRa, ccdDec = frame.crval()
+    if (debug): 
+       print("CCD RA= ",ccdRa," Dec=",ccdDec)
+
+    # A Sync: the mount coordinates are where the eyepiece is, remember the offset to the camera
+    if syncing:
+        syncing=False
+        solveOk=True
+        pipeline.finish(record=False)
+        offset=calibration.sync(setup, ccdRa/15, ccdDec, solveRa/15, solveDec, solution.crota)
+        if (debug):
+            print("Synced ",setup," revision",offset.revision," offset %.0f\" %.0f\"" % (offset.x*3600, offset.y*3600))
+        return
+
+    # Move the solved camera centre to the scope's centre of field
+    solveRa, solveDec = calibration.apply(setup, solveRa/15, solveDec, solution.crota)
+    solveRa = solveRa*15
         
-        # If within the threshold arcsecs move the scope set solveOk and continue
-        if ((deltaRa < 5) or (deltaDec < 5)):
-            if debug:
-                print("Deviation < 25 arcsecs, ignoring")
-            solveOk=True
-            continue;
-        if debug:
-            print("Deviation ",math.sqrt(deltaRa**2+deltaDec**2),"arcsecs compared to max ",maxDeviation," arcsecs")
-        if math.sqrt(deltaRa**2+deltaDec**2) > maxDeviation:
-           if debug:
-               print("Moving scope to computed coordinates ",ccdRa+deltaRa," ",ccdDec+deltaDec)
-           # Otherwise set the desired coordinate and slew
-           telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-           while not(telescope_radec):
-               time.sleep(0.5)
-           telescope_radec=device_telescope.getNumber("EQUATORIAL_EOD_COORD")
-           telescope_radec[0].value=ccdRa+deltaRa
-           telescope_radec[1].value=ccdDec+deltaDec
-           indiclient.sendNewNumber(telescope_radec)
-        else:
-           solveOk=True
+    # Centre on where the mount thinks it is when this centring run began
+    if not centering.mount:
+        centering.start(ccdRa/15, ccdDec)
+
+    # Let the centering engine compare the solve with the target (RA in hours) and
+    # decide on the next correction from the mount's response so far
+    step=centering.update(ccdRa/15, ccdDec, solveRa/15, solveDec)
+    if (debug): 
+       print("Centring pass",step.iteration,"error %.0f arcsecs," % step.error,step.status)
+    
+    if step.status == MOVE:
+       if debug:
+           print("Moving scope to computed coordinates ",step.ra," ",step.dec)
+       slewTo(step.ra, step.dec)
+       pipeline.invalidate()
+    else:
+       # Centred, or not converging - stop solving either way until the scope moves again
+       solveOk=True
+       centering.reset()
+       lastSlew = None
+       pipeline.finish()
+       if debug:
+           print(pipeline.report())
+           print(camera.report())
+
+# The labels set here are drawn once per frame by the renderer, the status line at once
+def mainline():
+    updateDisplay()
+    updateStatus()
+
+renderer.run(mainline)
+root.after_idle(lambda: startup.mark("window shown"))
+if debug:
+    root.after(60000, cpuReport)
+root.mainloop()
 
 
 
@@ -0,0 +1,130 @@
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+from imports import lazy
+
+# astropy is only loaded for the full precision altAz(), the fast path is plain NumPy
+coordinates = lazy("astropy.coordinates")
+astropyTime = lazy("astropy.time")
+u = lazy("astropy.units")
+
+#######################################################################################
+#### O B S E R V E R ##################################################################
+#######################################################################################
+# Observer builds the EarthLocation once and reuses the AltAz frame for frameSeconds, so a
+# Goto no longer pays for a fresh location, timezone lookup and frame every time. Both
+# altAz() and fastAltAz() take scalars or arrays of RA (hours) and Dec (degrees), so a
+# whole catalog or tour is checked in one call. fastAltAz() is plain NumPy (sidereal time
+# plus a first order precession from J2000) and agrees with astropy to well under 0.1
+# degree, it is the one to use when thousands of positions or times are needed.
+class Observer:
+    def __init__(self, lat, lon, height, frameSeconds=10):
+        self.lat = lat
+        self.lon = lon
+        self.height = height
+        self.location = None
+        self.frameSeconds = frameSeconds
+        self.frameTime = None
+        self.altAzFrame = None
+        self.sinLat = np.sin(np.radians(lat))
+        self.cosLat = np.cos(np.radians(lat))
+
+    # The AltAz frame for now, rebuilt only when the cached one is frameSeconds old
+    def frame(self, when=None):
+        if self.location is None:
+            self.location = coordinates.EarthLocation(lat=self.lat*u.deg, lon=self.lon*u.deg, height=self.height*u.m)
+        if when is not None:
+            return coordinates.AltAz(location=self.location, obstime=astropyTime.Time(when))
+        now = time.time()
+        if self.altAzFrame is None or now-self.frameTime > self.frameSeconds:
+            self.frameTime = now
+            self.altAzFrame = coordinates.AltAz(location=self.location, obstime=astropyTime.Time(now, format='unix'))
+        return self.altAzFrame
+
+    # Full precision altitude and azimuth in degrees for RA (hours) and Dec (degrees)
+    def altAz(self, ra, dec, when=None):
+        target = coordinates.SkyCoord(np.asarray(ra, dtype=float)*u.hour, np.asarray(dec, dtype=float)*u.deg, frame="icrs")
+        altaz = target.transform_to(self.frame(when))
+        return altaz.alt.degree, altaz.az.degree
+
+    # Low precision altitude and azimuth in degrees. when may be a datetime, an astropy
+    # Time, None for now, or (an array of) Julian dates which broadcast against ra/dec
+    def fastAltAz(self, ra, dec, when=None):
+        jd = julianDate(when)
+        ra, dec = precess(np.radians(np.asarray(ra, dtype=float)*15),
+                          np.radians(np.asarray(dec, dtype=float)), jd)
+        ha = np.radians(siderealTime(jd)+self.lon)-ra
+        sinDec = np.sin(dec)
+        cosDec = np.cos(dec)
+        sinAlt = self.sinLat*sinDec+self.cosLat*cosDec*np.cos(ha)
+        alt = np.arcsin(np.clip(sinAlt, -1, 1))
+        az = np.arctan2(-cosDec*np.sin(ha), sinDec*self.cosLat-cosDec*np.cos(ha)*self.sinLat)
+        return np.degrees(alt), np.degrees(az) % 360
+
+    # True where the target is above minAlt, checked with the fast path
+    def above(self, ra, dec, minAlt, when=None):
+        return self.fastAltAz(ra, dec, when)[0] > minAlt
+
+# Julian date (UTC, near enough to UT1 here) for the supported kinds of time
+def julianDate(when=None):
+    if when is None:
+        return time.time()/86400.0+2440587.5
+    if isinstance(when, datetime):
+        if when.tzinfo is None:
+            when = when.astimezone()
+        return when.astimezone(timezone.utc).timestamp()/86400.0+2440587.5
+    # An astropy Time, told apart without importing astropy
+    if hasattr(when, "utc") and hasattr(when, "jd"):
+        return when.utc.jd
+    return np.asarray(when, dtype=float)
+
+# Greenwich mean sidereal time in degrees
+def siderealTime(jd):
+    d = jd-2451545.0
+    return (280.46061837+360.98564736629*d) % 360
+
+# First order precession of J2000 RA/Dec (radians) to the equinox of date
+def precess(ra, dec, jd):
+    years = (jd-2451545.0)/365.25
+    m = np.radians(3.07496*15/3600)*years
+    n = np.radians(1.33621*15/3600)*years
+    return ra+m+n*np.sin(ra)*np.tan(dec), dec+n*np.cos(ra)
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# python observer.py [count] times the old per-call checkAlt against the vectorized paths
+if __name__ == "__main__":
+    from tzlocal import get_localzone
+    from astropy.coordinates import EarthLocation, SkyCoord, AltAz
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = np.random.default_rng(1)
+    ra = rng.uniform(0, 24, count)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    observer = Observer(49.8951, -97.1384, 300)
+
+    start = time.perf_counter()
+    for i in range(20):
+        location = EarthLocation(lat=49.8951*u.deg, lon=-97.1384*u.deg, height=300*u.m)
+        frame = AltAz(location=location, obstime=datetime.now(get_localzone()))
+        SkyCoord(ra[i]*u.hour, dec[i]*u.deg, frame="icrs").transform_to(frame)
+    perCall = (time.perf_counter()-start)/20
+
+    observer.altAz(ra[0], dec[0])
+    start = time.perf_counter()
+    alt, az = observer.altAz(ra, dec)
+    full = time.perf_counter()-start
+
+    start = time.perf_counter()
+    fastAlt, fastAz = observer.fastAltAz(ra, dec)
+    fast = time.perf_counter()-start
+
+    visible = alt > -5
+    azDiff = np.abs((fastAz-az+180) % 360-180)[visible & (alt < 85)]
+    print("old checkAlt   %8.2f ms per object" % (perCall*1000))
+    print("altAz()        %8.2f ms for %d objects" % (full*1000, count))
+    print("fastAltAz()    %8.2f ms for %d objects" % (fast*1000, count))
+    print("fast path error: alt max %.3f deg, az max %.3f deg (alt < 85)" %
+          (np.max(np.abs(fastAlt-alt)[visible]), np.max(azDiff)))
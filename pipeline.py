@@ -0,0 +1,249 @@
+import sys
+import threading
+import time
+from solver import SolveResult, SOLVED, FAILED
+
+#######################################################################################
+#### P I P E L I N E ##################################################################
+#######################################################################################
+# SolvePipeline keeps the camera and the solver busy at the same time: while frame N is
+# being solved frame N+1 is already exposing, so a failed solve (clouds, a satellite, too
+# few stars) is retried with a frame that is mostly or completely taken instead of a fresh
+# exposure. Every exposure and solve is tagged with the generation it started in, and
+# invalidate() moves to a new generation whenever the mount moves, so anything taken
+# before the slew is thrown away rather than acted on. With pipelined=False it behaves
+# like the old serial expose, download, solve loop, for comparison.
+#
+# The camera is anything with expose(seconds), abort(), ready() and fetch(), for the
+# panels that is indiclient.IndiCamera. tick() is called from the Tk mainline and returns
+# (SolveResult, frame) when a solve of the current generation finishes. With hints (a
+# solver.SolveHints) each solve is seeded with the frame's position, and with analyse set
+# the stars of each frame (frames.Frame.stars) are found on a worker thread as it arrives.
+# The frame prepare() makes from it reuses those stars, so the local solver does not find
+# them again on the binned frame.
+class SolvePipeline:
+    def __init__(self, camera, solver, exposure, pipelined=True, prepare=None, hints=None,
+                 analyse=False, clock=time.monotonic):
+        self.camera = camera
+        self.solver = solver
+        self.exposure = exposure
+        self.pipelined = pipelined
+        self.prepare = prepare or (lambda frame: frame.toFile())
+        self.hints = hints
+        self.analyse = analyse
+        self.clock = clock
+        self.generation = 0
+        self.exposing = None                   # (generation, start) of the exposure in progress
+        self.pending = None                    # (generation, frame) waiting for the solver
+        self.solving = None                    # (generation, frame, start, args) being solved
+        self.runStart = None
+        self.runs = []                         # Seconds from first exposure to centred
+        self.exposures = 0
+        self.stale = 0
+        self.exposeTimes = []
+        self.solveTimes = []
+
+    # True while there is work for the current generation, a cancelled solve that is still
+    # being cleaned up does not count
+    def busy(self):
+        return (self.exposing is not None or self.pending is not None or
+                (self.solving is not None and self.solving[0] == self.generation))
+
+    def tick(self):
+        now = self.clock()
+        if self.runStart is None:
+            self.runStart = now
+
+        # Collect a finished exposure. A BLOB turning up before the exposure can have
+        # finished belongs to one that was aborted and is ignored.
+        if self.exposing is not None and self.camera.ready():
+            generation, started = self.exposing
+            if now-started >= self.exposure:
+                self.exposing = None
+                if generation != self.generation:
+                    self.stale += 1
+                else:
+                    self.exposeTimes.append(now-started)
+                    if self.pending is not None:
+                        self.close(self.pending[1])
+                        self.stale += 1
+                    frame = self.camera.fetch()
+                    if self.analyse:
+                        threading.Thread(target=frame.stars, daemon=True).start()
+                    self.pending = (generation, frame)
+
+        # Hand the newest frame to the solver as soon as it is free
+        if self.pending is not None and self.solving is None:
+            generation, frame = self.pending
+            self.pending = None
+            # Hints come from the prepared frame, its field is smaller if it was cropped
+            prepared = self.prepare(frame)
+            args = self.hints.args(prepared) if self.hints is not None else ("-r", "50")
+            self.solver.start(prepared, args)
+            self.solving = (generation, frame, now, args)
+
+        # Keep the camera busy, pipelined the next frame exposes while this one solves
+        if self.exposing is None and self.pending is None and (self.pipelined or self.solving is None):
+            self.camera.expose(self.exposure)
+            self.exposing = (self.generation, now)
+            self.exposures += 1
+
+        # Collect a finished solve
+        if self.solving is None:
+            return None
+        result = self.solver.poll()
+        if result is None:
+            return None
+        generation, frame, started, args = self.solving
+        self.solving = None
+        self.solveTimes.append(now-started)
+        if self.hints is not None:
+            self.hints.record(args, result)
+        if generation != self.generation:
+            self.close(frame)
+            self.stale += 1
+            return None
+        return result, frame
+
+    # The mount is moving, nothing exposed or solved up to now can be used. The exposure
+    # is aborted so the camera is free when the slew ends, a running solve is killed and
+    # its result dropped when it has gone.
+    def invalidate(self):
+        self.generation += 1
+        if self.exposing is not None:
+            self.camera.abort()
+            self.exposing = None
+            self.stale += 1
+        if self.pending is not None:
+            self.close(self.pending[1])
+            self.pending = None
+            self.stale += 1
+        if self.solving is not None:
+            self.solver.cancel()
+
+    # Centring is over (centred, given up or STOP), record how long it took
+    def finish(self, record=True):
+        if record and self.runStart is not None:
+            self.runs.append(self.clock()-self.runStart)
+        self.runStart = None
+        self.invalidate()
+
+    def close(self, frame):
+        if hasattr(frame, "close"):
+            frame.close()
+
+    def report(self):
+        def summary(times):
+            if not times:
+                return "none"
+            ordered = sorted(times)
+            return "%d, mean %.1fs, worst %.1fs" % (len(times), sum(times)/len(times), ordered[-1])
+        return "\n".join(["Centring runs %s" % summary(self.runs),
+                          "Exposures %d (%d stale), exposure+download %s" % (self.exposures, self.stale, summary(self.exposeTimes)),
+                          "Solves %s" % summary(self.solveTimes)]+
+                         ([self.hints.report()] if self.hints is not None else []))
+
+#######################################################################################
+#### S I M U L A T I O N ##############################################################
+#######################################################################################
+# A clock, camera and solver that run on simulated time so the serial and pipelined modes
+# can be compared over thousands of centring runs with the real pipeline and centering code
+class SimClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class SimCamera:
+    def __init__(self, clock, capture, download):
+        self.clock = clock
+        self.capture = capture
+        self.download = download
+        self.doneAt = None
+
+    def expose(self, seconds):
+        self.doneAt = self.clock()+seconds+self.download
+        self.frame = self.capture()
+
+    def abort(self):
+        self.doneAt = None
+
+    def ready(self):
+        return self.doneAt is not None and self.clock() >= self.doneAt
+
+    def fetch(self):
+        self.doneAt = None
+        return self.frame
+
+class SimSolver:
+    def __init__(self, clock, rng, solveTime, failRate):
+        self.clock = clock
+        self.rng = rng
+        self.solveTime = solveTime
+        self.failRate = failRate
+        self.doneAt = None
+
+    def start(self, frame, args=()):
+        elapsed = self.rng.uniform(*self.solveTime)
+        status = FAILED if self.rng.random() < self.failRate else SOLVED
+        self.doneAt = self.clock()+elapsed
+        self.result = SolveResult(status, frame, elapsed, 0)
+
+    def running(self):
+        return self.doneAt is not None and self.clock() < self.doneAt
+
+    def poll(self):
+        return None if self.running() else self.result
+
+    def cancel(self):
+        self.doneAt = self.clock()
+
+# Centre on one target the way the panels do, one tick every 100ms and a short slew
+# after each correction, and return True if it was centred
+def simulate(pipeline, engine, sim, clock, rng, slewTime=3.0, tick=0.1):
+    from centering import MOVE, CENTRED
+    targetRa, targetDec = rng.uniform(0, 24), rng.uniform(-10, 70)
+    engine.start(targetRa, targetDec, sim.position[0]/15, sim.position[1])
+    sim.slew(targetRa, targetDec)
+    sim.newTarget()
+    slewUntil = 0.0
+    while True:
+        clock.now += tick
+        if clock.now < slewUntil:
+            continue
+        out = pipeline.tick()
+        if out is None or out[0].status != SOLVED:
+            continue
+        mountRa, mountDec, solvedRa, solvedDec = out[0].solution
+        step = engine.update(mountRa, mountDec, solvedRa, solvedDec)
+        if step.status != MOVE:
+            pipeline.finish()
+            return step.status == CENTRED
+        sim.slew(step.ra, step.dec)
+        pipeline.invalidate()
+        slewUntil = clock.now+slewTime
+
+# python pipeline.py [targets] [exposure] [failRate] compares serial and pipelined centring
+if __name__ == "__main__":
+    import numpy as np
+    from centering import CenteringEngine, SimulatedMount
+
+    targets = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    exposure = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    failRate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    for pipelined in (False, True):
+        rng = np.random.default_rng(1)
+        clock = SimClock()
+        sim = SimulatedMount(rng)
+        capture = lambda: (sim.position[0]/15, sim.position[1])+tuple(sim.solve())
+        pipeline = SolvePipeline(SimCamera(clock, capture, download=1.0),
+                                 SimSolver(clock, rng, solveTime=(2.0, 8.0), failRate=failRate),
+                                 exposure, pipelined=pipelined, prepare=lambda frame: frame, clock=clock)
+        engine = CenteringEngine(tolerance=30, maxIterations=10)
+        for i in range(targets):
+            simulate(pipeline, engine, sim, clock, rng)
+        runs = np.array(pipeline.runs)
+        print("%-9s centring mean %5.1fs, 95%% %5.1fs, worst %5.1fs, %d exposures (%d stale)" %
+              ("pipelined" if pipelined else "serial", runs.mean(), np.percentile(runs, 95), runs.max(),
+               pipeline.exposures, pipeline.stale))
@@ -0,0 +1,232 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+from observer import julianDate, siderealTime, precess
+
+#######################################################################################
+#### P L A N N E R ####################################################################
+#######################################################################################
+# NightPlan is the altitude of every catalog object over one night, noon to noon in local
+# solar time, every step minutes, worked out in one NumPy pass with the observer's fast
+# ephemeris (sidereal time plus first order precession). With it "is this object up?"
+# is an array lookup, so Prev/Next can skip everything below minAlt without an astropy
+# call per object, and a tour can be listed with the rise, transit and set of each entry.
+#
+# Planner builds the plan for the night in question and caches it per night, site and
+# catalog, in memory and in planDir, so the panel builds it once a night (off the Tk
+# thread) and a restart the same night just loads it.
+planVersion = 1
+daySeconds = 86400.0
+
+class NightPlan:
+    def __init__(self, night, start, step, names, alt, ra, dec, lat, lon):
+        self.night = night                     # "YYYY-MM-DD" of the evening
+        self.start = start                     # Julian date of local noon
+        self.step = step                       # Minutes between columns
+        self.names = names
+        self.rows = {name: i for i, name in enumerate(names)}
+        self.alt = alt                         # Objects x times, degrees (float16)
+        self.ra = ra                           # Hours, J2000
+        self.dec = dec
+        self.lat = lat
+        self.lon = lon
+
+    # Julian date of each column
+    def times(self):
+        return self.start+np.arange(self.alt.shape[1])*self.step/1440.0
+
+    # Column for a time, clipped to the night
+    def column(self, when=None):
+        jd = julianDate(when)
+        return int(np.clip(np.rint((jd-self.start)*1440.0/self.step), 0, self.alt.shape[1]-1))
+
+    # Rows of the named objects, -1 for names not in the plan
+    def rowsOf(self, names):
+        return np.array([self.rows.get(name, -1) for name in names], dtype=int)
+
+    # Altitude of the named objects now (or when), NaN for names not in the plan
+    def altitude(self, names, when=None):
+        rows = self.rowsOf(names)
+        alt = self.alt[np.maximum(rows, 0), self.column(when)].astype(float)
+        alt[rows < 0] = np.nan
+        return alt
+
+    def visible(self, names, minAlt, when=None):
+        return self.altitude(names, when) > minAlt
+
+    # From position index in names, the next entry step (+1 or -1) away that is above
+    # minAlt, wrapping round the list. None if nothing in the list is up.
+    def nextVisible(self, names, index, step, minAlt, when=None):
+        up = self.visible(names, minAlt, when)
+        count = len(names)
+        for offset in range(1, count+1):
+            i = (index+step*offset) % count
+            if up[i]:
+                return i
+        return None
+
+    # Rise, transit and set (Julian dates) through altitude h for the named objects, and
+    # the altitude at transit. Rise and set are NaN for objects that never set or never
+    # rise over h, worked out analytically rather than from the table. Everything is NaN
+    # for names not in the plan.
+    def riseTransitSet(self, names, h=0.0):
+        rows = self.rowsOf(names)
+        mid = self.start+0.5
+        known = np.maximum(rows, 0)
+        ra, dec = precess(np.radians(self.ra[known]*15), np.radians(self.dec[known]), mid)
+        lat = np.radians(self.lat)
+        # Transit is when local sidereal time equals RA, the one nearest midnight
+        lst = np.radians(siderealTime(mid)+self.lon)
+        transit = mid+(((ra-lst+np.pi) % (2*np.pi))-np.pi)/(2*np.pi)/1.0027379
+        cosH = (np.sin(np.radians(h))-np.sin(lat)*np.sin(dec))/(np.cos(lat)*np.cos(dec))
+        H = np.arccos(np.clip(cosH, -1, 1))/(2*np.pi)/1.0027379
+        rise = np.where(np.abs(cosH) < 1, transit-H, np.nan)
+        setting = np.where(np.abs(cosH) < 1, transit+H, np.nan)
+        peak = np.degrees(np.arcsin(np.clip(np.sin(lat)*np.sin(dec)+np.cos(lat)*np.cos(dec), -1, 1)))
+        unknown = rows < 0
+        return tuple(np.where(unknown, np.nan, value) for value in (rise, transit, setting, peak))
+
+# Night of a time, the local solar date of the evening, and the Julian date of its noon
+def nightOf(lon, when=None):
+    jd = float(julianDate(when))
+    local = jd+lon/360.0                       # Local solar time as a Julian date
+    noon = np.floor(local)                     # Julian days start at noon
+    start = noon-lon/360.0
+    night = time.strftime("%Y-%m-%d", time.gmtime((noon-2440587.5)*daySeconds))
+    return night, start
+
+class Planner:
+    def __init__(self, observer, step=10, planDir="plans"):
+        self.observer = observer
+        self.step = step
+        self.planDir = planDir
+        self.plans = {}                        # Cache key -> NightPlan
+        self.lock = threading.Lock()
+        self.buildTime = None
+
+    def key(self, night, names, ra, dec):
+        catalog = hashlib.sha1()
+        catalog.update("\n".join(names).encode())
+        catalog.update(np.asarray(ra, dtype=np.float64).tobytes())
+        catalog.update(np.asarray(dec, dtype=np.float64).tobytes())
+        return "%s_%.4f_%.4f_%.0f_%d_%s" % (night, self.observer.lat, self.observer.lon, self.observer.height,
+                                            self.step, catalog.hexdigest()[:12])
+
+    # The plan for the night containing when, for a CatalogIndex (or names/ra/dec)
+    def plan(self, catalog, when=None):
+        names, ra, dec = list(catalog.names), catalog.ra, catalog.dec
+        night, start = nightOf(self.observer.lon, when)
+        key = self.key(night, names, ra, dec)
+        with self.lock:
+            plan = self.plans.get(key)
+            if plan is None:
+                plan = self.load(key, night, start, names, ra, dec)
+            if plan is None:
+                begin = time.perf_counter()
+                plan = self.build(night, start, names, ra, dec)
+                self.buildTime = time.perf_counter()-begin
+                self.save(key, plan)
+            # Only tonight's plan is kept in memory
+            self.plans = {key: plan}
+            return plan
+
+    def build(self, night, start, names, ra, dec):
+        jd = start+np.arange(int(1440/self.step)+1)*self.step/1440.0
+        alt, az = self.observer.fastAltAz(np.asarray(ra)[:, None], np.asarray(dec)[:, None], jd[None, :])
+        return NightPlan(night, start, self.step, names, alt.astype(np.float16), np.asarray(ra, dtype=float),
+                         np.asarray(dec, dtype=float), self.observer.lat, self.observer.lon)
+
+    def path(self, key):
+        return os.path.join(self.planDir, "plan_"+key+".npz")
+
+    def load(self, key, night, start, names, ra, dec):
+        if self.planDir is None or not os.path.exists(self.path(key)):
+            return None
+        try:
+            with np.load(self.path(key)) as stored:
+                if int(stored["version"]) != planVersion:
+                    return None
+                return NightPlan(night, start, self.step, names, stored["alt"], np.asarray(ra, dtype=float),
+                                 np.asarray(dec, dtype=float), self.observer.lat, self.observer.lon)
+        except (OSError, KeyError, ValueError) as e:
+            print("Ignoring night plan "+self.path(key)+" -- ", e)
+            return None
+
+    # Save the plan and remove those of other nights or catalogs
+    def save(self, key, plan):
+        if self.planDir is None:
+            return
+        os.makedirs(self.planDir, exist_ok=True)
+        temp = self.path(key)+".tmp.npz"
+        np.savez(temp, version=planVersion, alt=plan.alt)
+        os.replace(temp, self.path(key))
+        for name in os.listdir(self.planDir):
+            if name.startswith("plan_") and name != os.path.basename(self.path(key)):
+                os.remove(os.path.join(self.planDir, name))
+
+# Format a Julian date as local solar time (hh:mm), "--:--" for NaN
+def clockTime(jd, lon):
+    if np.isnan(jd):
+        return "--:--"
+    minutes = int(round(((jd+lon/360.0+0.5) % 1.0)*1440)) % 1440
+    return "%02d:%02d" % (minutes//60, minutes % 60)
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# python planner.py [catalog.json] [step minutes] builds tonight's plan for the catalog
+# snapshot (or a synthetic Messier + NGC sized catalog), times it against per-object
+# altitude checks, times Next through a tour skipping what is below minAlt, and checks
+# the fast table against astropy
+if __name__ == "__main__":
+    from datetime import datetime, timezone
+    from catalog import CatalogIndex
+    from observer import Observer
+
+    step = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    catalog = CatalogIndex(sys.argv[1] if len(sys.argv) > 1 else "catalog.json")
+    if not catalog.loadSnapshot():
+        rng = np.random.default_rng(1)
+        catalog.setObjects([("M %d" % i, rng.uniform(0, 24), np.degrees(np.arcsin(rng.uniform(-0.6, 1))))
+                            for i in range(1, 111)] +
+                           [("NGC %d" % i, rng.uniform(0, 24), np.degrees(np.arcsin(rng.uniform(-0.6, 1))))
+                            for i in range(1, 7841)])
+    observer = Observer(49.8951, -97.1384, 300)
+    planner = Planner(observer, step=step, planDir=None)
+    plan = planner.plan(catalog)
+    print("%d objects x %d times, built in %.0f ms (%.1f MB)" %
+          (len(catalog), plan.alt.shape[1], planner.buildTime*1000, plan.alt.nbytes/1e6))
+
+    # Per object with the cached astropy frame, as checkAlt does for a Goto
+    observer.altAz(catalog.ra[0], catalog.dec[0])
+    start = time.perf_counter()
+    for i in range(20):
+        observer.altAz(catalog.ra[i], catalog.dec[i])
+    perObject = (time.perf_counter()-start)/20
+    print("astropy altAz %.2f ms per object, %.0f ms to check a 110 object tour" % (perObject*1000, perObject*110000))
+
+    # Next through a 110 object tour, skipping what is below 15 degrees
+    tour = catalog.names[:110]
+    start = time.perf_counter()
+    index, steps = 0, 0
+    for i in range(1000):
+        index = plan.nextVisible(tour, index, 1, 15.0)
+        steps += 1
+    print("Next, skipping objects under 15 deg: %.3f ms per press" % ((time.perf_counter()-start)/steps*1000))
+
+    # The table against astropy at the column for now
+    sample = np.arange(0, len(catalog), max(1, len(catalog)//200))
+    when = datetime.fromtimestamp((plan.times()[plan.column()]-2440587.5)*daySeconds, timezone.utc)
+    exact, az = observer.altAz(catalog.ra[sample], catalog.dec[sample], when)
+    fast = plan.alt[sample, plan.column()].astype(float)
+    print("table vs astropy at %s: max error %.2f deg" %
+          (clockTime(plan.times()[plan.column()], observer.lon), np.max(np.abs(fast-exact))))
+
+    rise, transit, setting, peak = plan.riseTransitSet(tour[:8], 15.0)
+    for name, r, t, s, p in zip(tour[:8], rise, transit, setting, peak):
+        print("%-8s rises %s transits %s (%4.1f deg) sets %s over 15 deg" %
+              (name, clockTime(r, observer.lon), clockTime(t, observer.lon), p, clockTime(s, observer.lon)))
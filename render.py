@@ -0,0 +1,131 @@
+import sys
+import time
+
+#######################################################################################
+#### R E N D E R ######################################################################
+#######################################################################################
+# Renderer is the only thing that reconfigures the panel's labels. set() records the text
+# a widget should show and marks it dirty, and the dirty widgets are redrawn together
+# once per frame, so the clocks and object line cost one configure per change at most
+# 10 times a second however often the mainline sets them. set(..., immediate=True) is
+# for the status line, it is drawn straight away. flash() shows a message for a few
+# seconds and then puts back whatever the widget should be showing, without the old
+# root.update() and time.sleep(2) that froze the panel.
+#
+# run() drives the mainline: every frame it calls the tick function, draws what is dirty
+# and times the whole pass into a histogram, and the next frame is scheduled on a fixed
+# cadence so a slow pass does not push every later one back. report() prints the
+# histogram, a pass over the frame budget is a pass the user could feel.
+histogramEdges = [1, 2, 5, 10, 20, 50, 100, 200, 500]     # Milliseconds
+
+class Renderer:
+    def __init__(self, root, frameMs=100, clock=time.monotonic):
+        self.root = root
+        self.frameMs = frameMs
+        self.clock = clock
+        self.wanted = {}                       # Widget -> text it should show
+        self.shown = {}                        # Widget -> text it is showing
+        self.dirty = set()
+        self.flashes = {}                      # Widget -> time its flashed message ends
+        self.counts = [0]*(len(histogramEdges)+1)
+        self.frames = 0
+        self.worst = 0.0
+        self.configures = 0
+        self.next = None
+
+    def set(self, widget, text, immediate=False):
+        self.wanted[widget] = text
+        if widget in self.flashes:
+            return
+        if immediate:
+            self.draw(widget, text)
+            self.dirty.discard(widget)
+        elif self.shown.get(widget) != text:
+            self.dirty.add(widget)
+
+    # Show text on the widget for seconds, then go back to what set() last asked for
+    def flash(self, widget, text, seconds=2.0):
+        self.flashes[widget] = self.clock()+seconds
+        self.dirty.discard(widget)
+        self.draw(widget, text)
+
+    def draw(self, widget, text):
+        if self.shown.get(widget) != text:
+            self.shown[widget] = text
+            widget.configure(text=text)
+            self.configures += 1
+
+    # Draw everything that changed since the last frame and end expired flashes
+    def flush(self):
+        now = self.clock()
+        for widget, until in list(self.flashes.items()):
+            if now >= until:
+                del self.flashes[widget]
+                if widget in self.wanted:
+                    self.dirty.add(widget)
+        for widget in self.dirty:
+            self.draw(widget, self.wanted[widget])
+        self.dirty.clear()
+
+    # Call tick every frameMs from the Tk event loop
+    def run(self, tick):
+        def frame():
+            start = self.clock()
+            try:
+                tick()
+                self.flush()
+            finally:
+                self.record(self.clock()-start)
+                # Keep to the cadence, unless the pass overran a whole frame
+                self.next = max(self.next+self.frameMs/1000, self.clock())
+                self.root.after(max(1, int((self.next-self.clock())*1000)), frame)
+        self.next = self.clock()
+        self.root.after(self.frameMs, frame)
+
+    def record(self, seconds):
+        ms = seconds*1000
+        bucket = 0
+        while bucket < len(histogramEdges) and ms >= histogramEdges[bucket]:
+            bucket += 1
+        self.counts[bucket] += 1
+        self.frames += 1
+        self.worst = max(self.worst, ms)
+
+    def report(self):
+        labels = ["<%dms" % edge for edge in histogramEdges]+[">=%dms" % histogramEdges[-1]]
+        over = sum(count for edge, count in zip([0]+histogramEdges, self.counts) if edge >= self.frameMs)
+        return ("Frames %d, worst %.1fms, %d over the %dms budget, %d label redraws\n" %
+                (self.frames, self.worst, over, self.frameMs, self.configures)+
+                "  ".join("%s %d" % (label, count) for label, count in zip(labels, self.counts) if count))
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# python render.py [seconds] runs a window with the panel's clock, object and status
+# labels, setting every label on every tick the way the old mainline did, and prints how
+# many redraws the Renderer actually made and the frame time histogram
+if __name__ == "__main__":
+    import tkinter as tk
+    from datetime import datetime
+
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    root = tk.Tk()
+    labels = [tk.Label(root, text="") for i in range(4)]
+    for label in labels:
+        label.pack()
+    renderer = Renderer(root)
+    ticks = [0]
+    def tick():
+        ticks[0] += 1
+        now = datetime.now()
+        renderer.set(labels[0], now.strftime("%d-%b-%Y\n%H:%M:%S"))
+        renderer.set(labels[1], now.strftime("%d-%b-%Y\n%H:%M:%S UT"))
+        renderer.set(labels[2], "Messier 31")
+        renderer.set(labels[3], "TRACKING", immediate=True)
+        if ticks[0] == 10:
+            renderer.flash(labels[3], "OBJECT TOO LOW")
+    renderer.run(tick)
+    root.after(int(seconds*1000), root.destroy)
+    root.mainloop()
+    print("%d ticks set %d labels, %d redraws" % (ticks[0], ticks[0]*4, renderer.configures))
+    print(renderer.report())
@@ -0,0 +1,246 @@
+import sys
+import time
+import numpy as np
+
+#######################################################################################
+#### R O U T E ########################################################################
+#######################################################################################
+# RouteOptimizer puts a tour in the order that wastes least time on an Alt-Az mount, for
+# the time it is run. Positions move through the night, so every object's altitude and
+# azimuth is worked out once on a grid of times (Sky, the observer's fast ephemeris in one
+# NumPy pass) and a route is scored by schedule(): from start, slew to each object where
+# it is when the slew starts, wait for it if it has not risen over minAlt yet, spend dwell
+# seconds there (solve, centre, look), and so on. The cost of a route is how long after
+# start it is done, plus a penalty hour for each object that has set by the time it is
+# reached. Between routes done at the same time the one with less slewing is better, the
+# time saved is spent waiting for the last objects to rise instead.
+#
+# The route starts greedy, nearest neighbour by slew and wait from the mount (or from the
+# object that sets first), so what is up now is seen now. 2-opt then reverses stretches
+# of it: every reversal is scored at once from a matrix of slew times as the current route
+# leaves each object, and the best few are checked with schedule(), which has the final
+# say, so a reversal that finishes later is never taken. SlewModel is the mount: each axis
+# runs at its own rate, the slower axis sets the time, plus a settle time.
+penalty = 3600.0                               # Seconds, for an object that has set
+never = 1 << 30                                # Column for objects that do not rise again
+
+class SlewModel:
+    def __init__(self, azRate=4.0, altRate=4.0, settle=5.0):
+        self.azRate = azRate                   # Degrees per second
+        self.altRate = altRate
+        self.settle = settle                   # Seconds
+
+    # Seconds to slew between Alt-Az positions (degrees), broadcasting
+    def time(self, alt0, az0, alt1, az1):
+        dAz = np.abs((np.asarray(az1)-az0+180) % 360-180)
+        return np.maximum(dAz/self.azRate, np.abs(np.asarray(alt1)-alt0)/self.altRate)+self.settle
+
+# Altitude and azimuth of a tour's objects every gridSeconds from start (a Julian date),
+# and for each object and column the first column from then on it is over minAlt
+class Sky:
+    def __init__(self, observer, ra, dec, start, hours, gridSeconds, minAlt):
+        self.start = start
+        self.gridSeconds = gridSeconds
+        times = start+np.arange(int(hours*3600/gridSeconds)+1)*gridSeconds/86400.0
+        self.alt, self.az = observer.fastAltAz(np.asarray(ra)[:, None], np.asarray(dec)[:, None], times[None, :])
+        columns = np.arange(len(times))
+        up = np.where(self.alt > minAlt, columns, never)
+        self.nextUp = np.minimum.accumulate(up[:, ::-1], axis=1)[:, ::-1]
+
+    def column(self, jd):
+        return min(int((jd-self.start)*86400.0/self.gridSeconds+0.5), self.alt.shape[1]-1)
+
+    def time(self, column):
+        return self.start+column*self.gridSeconds/86400.0
+
+class Schedule:
+    def __init__(self, order, arrive, alt, slewing, waiting, cost, low, overrun):
+        self.order = order                     # Indices into the tour, in visiting order
+        self.arrive = arrive                   # Julian date each object is observed from
+        self.alt = alt                         # Altitude then
+        self.slewing = slewing                 # Seconds spent slewing
+        self.waiting = waiting                 # Seconds spent waiting for objects to rise
+        self.cost = cost                       # Seconds until done plus penalties
+        self.low = low                         # Objects that had set when reached
+        self.overrun = overrun                 # Done after the end of the grid, positions clamped
+
+class RouteOptimizer:
+    def __init__(self, observer, slew=None, minAlt=15, dwell=300, gridSeconds=60, hours=16, candidates=8):
+        self.observer = observer
+        self.slew = slew or SlewModel()
+        self.minAlt = minAlt
+        self.dwell = dwell                     # Seconds spent at each object
+        self.gridSeconds = gridSeconds
+        self.hours = hours                     # Longest route the grid covers
+        self.candidates = candidates           # 2-opt moves checked with schedule() per pass
+        self.lastTime = None
+
+    def sky(self, ra, dec, start):
+        return Sky(self.observer, ra, dec, start, self.hours, self.gridSeconds, self.minAlt)
+
+    # Walk a route from sky.start, from the Alt-Az position fromAltAz (None to begin at the
+    # first object)
+    def schedule(self, order, sky, fromAltAz=None):
+        now = sky.start
+        slewing = waiting = 0.0
+        low = 0
+        arrive = []
+        alts = []
+        position = fromAltAz
+        for i in order:
+            column = sky.column(now)
+            if position is not None:
+                seconds = float(self.slew.time(position[0], position[1], sky.alt[i, column], sky.az[i, column]))
+                slewing += seconds
+                now += seconds/86400.0
+                column = sky.column(now)
+            up = sky.nextUp[i, column]
+            if up == never:
+                low += 1
+            elif up > column:
+                waiting += (sky.time(up)-now)*86400.0
+                now = sky.time(up)
+                column = up
+            arrive.append(now)
+            alts.append(sky.alt[i, column])
+            position = (sky.alt[i, column], sky.az[i, column])
+            now += self.dwell/86400.0
+        cost = (now-sky.start)*86400.0+penalty*low
+        overrun = now > sky.time(sky.alt.shape[1]-1)
+        return Schedule(list(order), np.array(arrive), np.array(alts), slewing, waiting, cost, low, overrun)
+
+    # Seconds from a position at column to each of objects: the slew, the penalty for those
+    # that have set and, with wait, the wait for those still to rise. With sets which of
+    # them had set when reached is returned too.
+    def cost(self, sky, alt, az, column, objects, wait=True, sets=False):
+        seconds = self.slew.time(alt, az, sky.alt[objects, column], sky.az[objects, column])
+        arrival = np.minimum(column+np.rint(seconds/self.gridSeconds).astype(int), sky.alt.shape[1]-1)
+        up = sky.nextUp[objects, arrival]
+        gone = up == never
+        extra = np.where(gone, penalty, (np.minimum(up, sky.alt.shape[1])-arrival)*self.gridSeconds*wait)
+        return (seconds+extra, gone) if sets else seconds+extra
+
+    # Nearest neighbour by slew and wait time
+    def greedy(self, sky, fromAltAz=None):
+        left = list(range(sky.alt.shape[0]))
+        order = []
+        now = sky.start
+        position = fromAltAz
+        if position is None:
+            # Begin with the object up now that sets first
+            up = sky.alt > self.minAlt
+            setting = np.where(np.all(up, axis=1), never, np.argmin(up, axis=1))
+            first = int(np.argmin(np.where(up[:, 0], setting, never+1)))
+            position = (sky.alt[first, 0], sky.az[first, 0])
+        while left:
+            column = sky.column(now)
+            candidates = np.array(left)
+            seconds, gone = self.cost(sky, position[0], position[1], column, candidates, sets=True)
+            best = int(np.argmin(seconds))
+            i = int(candidates[best])
+            order.append(i)
+            left.remove(i)
+            # The penalty for a set object is not time spent
+            now += (seconds[best]-penalty*gone[best]+self.dwell)/86400.0
+            column = sky.column(now)
+            position = (sky.alt[i, column], sky.az[i, column])
+        return order
+
+    # Reverse stretches of the route while it gets done sooner, or as soon with less slewing
+    def twoOpt(self, order, sky, fromAltAz=None, passes=200):
+        best = self.schedule(order, sky, fromAltAz)
+        n = len(order)
+        if n < 4:
+            return best
+        i, j = np.triu_indices(n, 1)
+        keep = i > 0
+        i, j = i[keep], j[keep]
+        last = j == n-1
+        following = np.minimum(j+1, n-1)
+        for p in range(passes):
+            route = np.array(best.order)
+            # Seconds from stop k, as it is left, to stop l
+            leave = np.array([sky.column(jd+self.dwell/86400.0) for jd in best.arrive])
+            m = np.array([self.cost(sky, sky.alt[route[k], leave[k]], sky.az[route[k], leave[k]], leave[k], route, False)
+                          for k in range(n)])
+            # Reversing route[i..j]: route[i-1] goes on to route[j] and route[i] to route[j+1]
+            before = m[i-1, i]+np.where(last, 0.0, m[j, following])
+            after = m[i-1, j]+np.where(last, 0.0, m[i, following])
+            delta = after-before
+            improved = False
+            for t in np.argsort(delta)[:self.candidates]:
+                if delta[t] >= 0:
+                    break
+                candidate = list(route[:i[t]])+list(route[i[t]:j[t]+1][::-1])+list(route[j[t]+1:])
+                scored = self.schedule(candidate, sky, fromAltAz)
+                if scored.cost < best.cost-1e-6 or (scored.cost < best.cost+1e-6 and scored.slewing < best.slewing-1e-6):
+                    best = scored
+                    improved = True
+                    break
+            if not improved:
+                break
+        return best
+
+    # The best route found for a tour from start (a Julian date), as a Schedule
+    def optimize(self, ra, dec, start, fromAltAz=None):
+        begin = time.perf_counter()
+        sky = self.sky(ra, dec, start)
+        best = self.twoOpt(self.greedy(sky, fromAltAz), sky, fromAltAz)
+        self.lastTime = time.perf_counter()-begin
+        return best
+
+    # Names in slew order for a tour, from start, from where the mount is (alt, az) if known
+    def order(self, names, ra, dec, start, fromAltAz=None):
+        return [names[i] for i in self.optimize(ra, dec, start, fromAltAz).order]
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# python route.py [tours] [count] [date] orders random count object tours (110, a
+# Messier marathon's worth) of objects that get over minAlt during the night, from 19:30
+# local solar time on date (the March new moon by default): as listed, nearest neighbour
+# and nearest neighbour plus 2-opt. It prints the slewing, waiting, when the tour is done
+# and the objects that had set when reached for each, and how long ordering took. Tours
+# done after the end of the grid are counted: past it positions are those at the end, so
+# their times are not comparable.
+if __name__ == "__main__":
+    from datetime import datetime, timezone
+    from observer import Observer
+    from planner import nightOf
+
+    tours = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 110
+    date = sys.argv[3] if len(sys.argv) > 3 else "2027-03-08"
+    observer = Observer(49.8951, -97.1384, 300)
+    night, noon = nightOf(observer.lon, datetime.strptime(date+" 23:59", "%Y-%m-%d %H:%M").replace(tzinfo=timezone.utc))
+    start = noon+7.5/24
+    optimizer = RouteOptimizer(observer, minAlt=15, dwell=120)
+    rng = np.random.default_rng(4)
+    totals = {}
+    for t in range(tours):
+        ra = rng.uniform(0, 24, count*3)
+        dec = np.degrees(np.arcsin(rng.uniform(np.sin(np.radians(-30)), 1, count*3)))
+        sky = optimizer.sky(ra, dec, start)
+        dark = int(10*3600/optimizer.gridSeconds)
+        up = np.where(np.any(sky.alt[:, :dark] > 25, axis=1))[0][:count]
+        ra, dec = ra[up], dec[up]
+        sky = optimizer.sky(ra, dec, start)
+        listed = optimizer.schedule(list(range(len(ra))), sky)
+        begin = time.perf_counter()
+        greedy = optimizer.schedule(optimizer.greedy(sky), sky)
+        greedyTime = time.perf_counter()-begin
+        best = optimizer.optimize(ra, dec, start)
+        for name, schedule, seconds in (("listed", listed, 0.0), ("nearest", greedy, greedyTime),
+                                        ("2-opt", best, optimizer.lastTime)):
+            total = totals.setdefault(name, [0.0, 0.0, 0.0, 0, 0.0, 0])
+            total[0] += schedule.slewing
+            total[1] += schedule.waiting
+            total[2] += (schedule.arrive[-1]-start)*24+optimizer.dwell/3600
+            total[3] += schedule.low
+            total[4] += seconds
+            total[5] += schedule.overrun
+    print("%d tours of %d objects, %ds at each object, %d h grid" % (tours, count, optimizer.dwell, optimizer.hours))
+    for name, (slewing, waiting, hours, low, seconds, overrun) in totals.items():
+        print("%-8s slewing %5.1f min, waiting %5.1f min, done after %5.2f h, %4.1f set when reached, ordered in %4.0f ms%s" %
+              (name, slewing/60/tours, waiting/60/tours, hours/tours, low/tours, seconds/tours*1000,
+               ", %d past the end of the grid" % overrun if overrun else ""))
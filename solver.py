@@ -0,0 +1,216 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import queue
+from collections import namedtuple
+
+from wcsparse import readWcs
+
+#######################################################################################
+#### S O L V E R ######################################################################
+#######################################################################################
+# SolverRunner runs ASTAP on a worker thread so the Tk mainline stays responsive. The
+# mainline starts a solve, keeps ticking, and picks up the result with poll(). ASTAP's
+# output is streamed line by line onto a queue (and into solve.err as before), the solve
+# is killed after a hard timeout, and cancel() kills it straight away for the STOP button.
+SOLVED = "SOLVED"
+FAILED = "FAILED"
+TIMEOUT = "TIMEOUT"
+CANCELLED = "CANCELLED"
+
+# error is why a solve could not be run at all (ASTAP missing, solve.err unwritable...)
+SolveResult = namedtuple("SolveResult", ["status", "solution", "elapsed", "returncode", "error"], defaults=(None,))
+
+class SolverRunner:
+    def __init__(self, command="/usr/local/bin/astap", timeout=30, errPath="solve.err"):
+        self.command = command
+        self.timeout = timeout
+        self.errPath = errPath
+        self.output = queue.Queue()
+        self.process = None
+        self.thread = None
+        self.result = None
+        self.cancelled = False
+        self.timedOut = False
+        self.lock = threading.Lock()
+
+    # Start solving fitsPath (a file or a frames.Frame), extra arguments are passed to the
+    # solver before -f
+    def start(self, fitsPath, args=("-r", "50")):
+        if self.running():
+            raise RuntimeError("A solve is already running")
+        if hasattr(fitsPath, "toFile"):
+            fitsPath = fitsPath.toFile()
+        self.result = None
+        self.cancelled = False
+        self.timedOut = False
+        self.thread = threading.Thread(target=self.run, args=(fitsPath, list(args)), daemon=True)
+        self.thread.start()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    # Return the SolveResult once the solve has finished, None while it is still running
+    def poll(self):
+        if self.running():
+            return None
+        return self.result
+
+    # Wait for the solve to finish and return its SolveResult
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+        return self.result
+
+    def cancel(self):
+        self.cancelled = True
+        self.kill()
+
+    def kill(self):
+        with self.lock:
+            if self.process is not None and self.process.poll() is None:
+                # The solver runs in its own process group so any children die with it
+                try:
+                    os.killpg(self.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def expire(self):
+        self.timedOut = True
+        self.kill()
+
+    # Whatever goes wrong the solve ends with a result, so the pipeline never waits forever
+    def run(self, fitsPath, args):
+        start = time.time()
+        try:
+            self.result = self.solve(fitsPath, args, start)
+        except Exception as e:
+            self.kill()
+            self.output.put("Solver failed -- "+str(e))
+            status = CANCELLED if self.cancelled else FAILED
+            self.result = SolveResult(status, None, time.time()-start, None, str(e) or type(e).__name__)
+
+    def solve(self, fitsPath, args, start):
+        base = os.path.splitext(fitsPath)[0]
+        wcsPath = base+".wcs"
+        iniPath = base+".ini"
+
+        # Remove plate solve results of the previous run
+        for path in (wcsPath, iniPath):
+            if os.path.exists(path):
+                os.remove(path)
+
+        with self.lock:
+            if self.cancelled:
+                return SolveResult(CANCELLED, None, 0.0, None)
+            self.process = subprocess.Popen([self.command]+args+["-f", fitsPath],
+                                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                            stdin=subprocess.DEVNULL, start_new_session=True)
+        timer = threading.Timer(self.timeout, self.expire)
+        timer.start()
+        try:
+            with open(self.errPath, "wb") as err:
+                for line in self.process.stdout:
+                    err.write(line)
+                    self.output.put(line.decode("utf-8", "replace").rstrip())
+            returncode = self.process.wait()
+        finally:
+            timer.cancel()
+            self.process.stdout.close()
+        elapsed = time.time()-start
+
+        if self.cancelled:
+            status, solution = CANCELLED, None
+        elif self.timedOut:
+            status, solution = TIMEOUT, None
+        else:
+            solution = readWcs(wcsPath) if os.path.exists(wcsPath) else None
+            status = SOLVED if solution and solution.solved else FAILED
+        return SolveResult(status, solution, elapsed, returncode)
+
+#######################################################################################
+#### H I N T S ########################################################################
+#######################################################################################
+# SolveHints seeds ASTAP with where the mount says it is pointing (the RA/Dec the camera
+# driver stamped on the frame) and the field height, so it searches a few degrees around
+# the mount position instead of 50 degrees blind. A failed solve widens the search to the
+# next radius, a solve brings it back to the narrowest. Every solve is counted per radius
+# so report() shows how often the narrow search works and what it saves.
+class SolveHints:
+    def __init__(self, radii=(5, 15, 50), fov=0):
+        self.radii = radii
+        self.fov = fov                         # Field height in degrees, 0 to read it from the frame
+        self.level = 0
+        self.solves = {}                       # radius -> [attempts, solved, seconds spent solving]
+
+    # ASTAP arguments for a frame (a frames.Frame)
+    def args(self, frame):
+        radius = self.radii[min(self.level, len(self.radii)-1)]
+        args = ["-r", "%g" % radius]
+        try:
+            ra, dec = frame.crval()
+            args += ["-ra", "%.5f" % (ra/15), "-spd", "%.5f" % (dec+90)]
+        except Exception:
+            pass                               # No position in the header, search blind
+        fov = self.fov or frame.fov()
+        if fov:
+            args += ["-fov", "%.3f" % fov]
+        return args
+
+    # Count a finished solve made with args and widen or narrow the next search
+    def record(self, args, result):
+        if result.status == CANCELLED:
+            return
+        radius = float(args[args.index("-r")+1])
+        counts = self.solves.setdefault(radius, [0, 0, 0.0])
+        counts[0] += 1
+        if result.status == SOLVED:
+            counts[1] += 1
+            counts[2] += result.elapsed
+            self.level = 0
+        else:
+            self.level += 1
+
+    def report(self):
+        lines = []
+        for radius in sorted(self.solves):
+            attempts, solved, seconds = self.solves[radius]
+            lines.append("  radius %4g: %d solves, %d solved (%.0f%%), mean %.1fs when solved" %
+                         (radius, attempts, solved, 100.0*solved/attempts, seconds/solved if solved else 0))
+        # Time saved against solving everything at the widest radius, once there is a
+        # measurement of that
+        widest = self.solves.get(float(self.radii[-1]))
+        if widest and widest[1]:
+            blind = widest[2]/widest[1]
+            saved = sum(solved*blind-seconds for radius, (attempts, solved, seconds) in self.solves.items()
+                        if radius != float(self.radii[-1]))
+            lines.append("  about %.0fs saved against a %gs blind solve" % (saved, blind))
+        return "Solve hints\n"+"\n".join(lines)
+
+# python solver.py <solver> <fits> [timeout] runs one solve and streams the output, handy
+# with a fake astap script that sleeps or copies a canned solve.wcs into place
+# python solver.py <solver> <fits> compare times a blind -r 50 solve against a hinted one
+if __name__ == "__main__":
+    if len(sys.argv) > 3 and sys.argv[3] == "compare":
+        from frames import Frame
+        with open(sys.argv[2], "rb") as f:
+            frame = Frame(f.read())
+        runner = SolverRunner(command=sys.argv[1], errPath=os.devnull)
+        for name, args in (("blind", ("-r", "50")), ("hinted", SolveHints().args(frame))):
+            runner.start(sys.argv[2], args)
+            result = runner.wait()
+            print("%-6s %-8s %6.2fs  %s" % (name, result.status, result.elapsed, " ".join(args)))
+        sys.exit()
+    runner = SolverRunner(command=sys.argv[1], timeout=float(sys.argv[3]) if len(sys.argv) > 3 else 30)
+    runner.start(sys.argv[2])
+    while runner.poll() is None:
+        try:
+            print(runner.output.get(timeout=0.1))
+        except queue.Empty:
+            pass
+    while not runner.output.empty():
+        print(runner.output.get())
+    print(runner.result)
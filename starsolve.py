@@ -0,0 +1,514 @@
+import itertools
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import numpy as np
+
+from calibration import project, deproject
+from imports import lazy
+from stars import findStars
+from solver import SolveResult, SOLVED, FAILED, CANCELLED, TIMEOUT
+from wcsparse import Solution
+
+fits = lazy("astropy.io.fits")
+spatial = lazy("scipy.spatial")
+
+#######################################################################################
+#### S T A R   S O L V E ##############################################################
+#######################################################################################
+# A small plate solver that runs inside the panel, for the re-solves while centring when
+# the mount position is already known to within a degree or so. It needs the position and
+# the field height as hints (the same -ra/-spd/-fov/-r arguments SolveHints gives ASTAP),
+# and a star index: a file of stars sorted by Dec that is memory-mapped, so a solve only
+# reads the strip of sky around the hint.
+#
+# Stars are found with stars.findStars. The brightest are joined to their nearest
+# neighbours to make triangles, in the image and in the index stars projected around the
+# hint at the expected pixel scale. Triangles are matched on side length and shape, each
+# match votes for a rotation and shift, the best votes are checked by counting the stars
+# that line up, and the WCS is fitted by least squares to all the matched stars.
+#
+# LocalSolver has the same interface as solver.SolverRunner, and SolverChain tries one
+# solver and then another, so the pipeline can use either or both.
+indexMagic = b"PISTAR01"
+indexHeader = struct.Struct("<8sI")
+starRecord = np.dtype([("ra", "<f8"), ("dec", "<f8"), ("mag", "<f4")])
+
+# The catalog side of a solve: a region's stars brightest first, projected to pixels
+# around a tangent point, and the triangles of the brightest of them
+class Pattern:
+    def __init__(self, ra, dec, u, v, triangles, patternStars, area, center):
+        self.ra = ra
+        self.dec = dec
+        self.u = u
+        self.v = v
+        self.triangles = triangles
+        self.patternStars = patternStars
+        self.area = area                       # Square degrees of the region
+        self.center = center                   # Tangent point (ra, dec) of u, v
+
+class StarIndex:
+    def __init__(self, path="stars.idx", patternGrid=0.5, patternCache=8):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, count = indexHeader.unpack(f.read(indexHeader.size))
+        if magic != indexMagic:
+            raise ValueError(path+" is not a star index")
+        self.stars = np.memmap(path, dtype=starRecord, mode="r", offset=indexHeader.size, shape=(count,))
+        self.patternGrid = patternGrid         # Degrees between tangent points
+        self.patternCache = patternCache
+        self.patterns = {}                     # (tangent point, (reach, scale, depth)) -> Pattern
+        self.lock = threading.Lock()
+        self.builds = 0
+
+    def __len__(self):
+        return len(self.stars)
+
+    # Stars within radius degrees of (ra, dec), as arrays of ra, dec (degrees) and mag
+    def region(self, ra, dec, radius):
+        decs = self.stars["dec"]
+        lo, hi = np.searchsorted(decs, [dec-radius, dec+radius])
+        strip = np.array(self.stars[lo:hi])
+        cosDec = np.cos(np.radians(min(89.0, abs(dec)+radius)))
+        if radius/cosDec < 180:
+            strip = strip[np.abs((strip["ra"]-ra+180) % 360-180) < radius/cosDec]
+        return strip["ra"], strip["dec"], strip["mag"]
+
+    # The Pattern for a solve near (ra, dec): stars within reach degrees, at scale degrees
+    # per pixel, with triangles among the stars down to depth per square degree. Patterns
+    # reach patternGrid degrees further than asked, and one is reused for any hint within
+    # patternGrid of its tangent point, so the re-solves while centring on a target, and
+    # the prefetch before it, build it once and then find it here.
+    def pattern(self, ra, dec, reach, scale, depth):
+        grid = self.patternGrid
+        key = (round(reach, 2), round(scale, 8), round(depth, 3))
+        with self.lock:
+            for (center, other), pattern in self.patterns.items():
+                if other == key and np.degrees(angle(ra, dec, *center)) < grid:
+                    return pattern
+        dec0 = float(np.clip(np.round(dec/grid)*grid, -90, 90))
+        raGrid = grid/max(np.cos(np.radians(dec0)), 0.01)
+        ra0 = float(np.round(ra/raGrid)*raGrid % 360)
+        # Reach out far enough from the snapped tangent point to cover the hinted region
+        reach += grid
+        starRa, starDec, mag = self.region(ra0, dec0, reach)
+        order = np.argsort(mag, kind="stable")
+        starRa, starDec = starRa[order], starDec[order]
+        xi, eta = project(starRa, starDec, ra0, dec0)
+        u, v = xi/scale, eta/scale
+        area = np.pi*reach*reach
+        patternStars = int(min(len(u), max(30, depth*area)))
+        pattern = Pattern(starRa, starDec, u, v, triangles(u[:patternStars], v[:patternStars]),
+                          patternStars, area, (ra0, dec0))
+        with self.lock:
+            self.builds += 1
+            if len(self.patterns) >= self.patternCache:
+                del self.patterns[next(iter(self.patterns))]
+            self.patterns[((ra0, dec0), key)] = pattern
+        return pattern
+
+# Angle in radians between two positions in degrees
+def angle(ra1, dec1, ra2, dec2):
+    ra1, dec1, ra2, dec2 = np.radians([ra1, dec1, ra2, dec2])
+    return np.arccos(np.clip(np.sin(dec1)*np.sin(dec2)+np.cos(dec1)*np.cos(dec2)*np.cos(ra1-ra2), -1, 1))
+
+# Write an index from arrays of ra, dec (degrees) and magnitude
+def writeIndex(path, ra, dec, mag):
+    records = np.zeros(len(ra), starRecord)
+    records["ra"], records["dec"], records["mag"] = ra, dec, mag
+    records = records[np.argsort(records["dec"], kind="stable")]
+    temp = path+".tmp"
+    with open(temp, "wb") as f:
+        f.write(indexHeader.pack(indexMagic, len(records)))
+        f.write(records.tobytes())
+    os.replace(temp, path)
+
+#######################################################################################
+#### E X T R A C T I O N   A N D   M A T C H I N G ####################################
+#######################################################################################
+# Triangles of each star with pairs of its nearest neighbours. Returns the vertex indices
+# ordered by the length of the opposite side (longest first), the shape as (longest side,
+# middle/longest, shortest/longest) and the handedness of each triangle.
+def triangles(x, y, neighbours=6, ratioGap=0.02):
+    points = np.column_stack([x, y])
+    k = min(neighbours, len(points)-1)
+    if k < 2:
+        return np.zeros((0, 3), int), np.zeros((0, 3)), np.zeros(0)
+    nearest = spatial.cKDTree(points).query(points, k+1)[1]
+    pairs = np.array(list(itertools.combinations(range(1, k+1), 2)))
+    vertices = np.column_stack([np.repeat(np.arange(len(points)), len(pairs)),
+                                nearest[:, pairs[:, 0]].ravel(), nearest[:, pairs[:, 1]].ravel()])
+    vertices = np.unique(np.sort(vertices, axis=1), axis=0)
+    p = points[vertices]
+    opposite = np.column_stack([np.hypot(*(p[:, 1]-p[:, 2]).T), np.hypot(*(p[:, 0]-p[:, 2]).T),
+                                np.hypot(*(p[:, 0]-p[:, 1]).T)])
+    order = np.argsort(-opposite, axis=1)
+    vertices = np.take_along_axis(vertices, order, 1)
+    sides = np.take_along_axis(opposite, order, 1)
+    p = points[vertices]
+    handedness = np.sign((p[:, 1, 0]-p[:, 0, 0])*(p[:, 2, 1]-p[:, 0, 1])-(p[:, 1, 1]-p[:, 0, 1])*(p[:, 2, 0]-p[:, 0, 0]))
+    shape = np.column_stack([sides[:, 0], sides[:, 1]/sides[:, 0], sides[:, 2]/sides[:, 0]])
+    # Nearly isosceles triangles have no reliable vertex order, leave them out
+    keep = (shape[:, 1] < 1-ratioGap) & (shape[:, 1]-shape[:, 2] > ratioGap) & (sides[:, 2] > 0)
+    return vertices[keep], shape[keep], handedness[keep]
+
+# Similarity transforms (complex scale/rotation s and shift t, image = s*catalog + t) that
+# map catalog triangles onto image triangles of the same shape and size
+def candidateTransforms(image, catalog, lengthTolerance=0.03, ratioTolerance=0.01):
+    imageVertices, imageShape, imageHand = image
+    catalogVertices, catalogShape, catalogHand = catalog
+    order = np.argsort(catalogShape[:, 0])
+    lengths = catalogShape[order, 0]
+    found = []
+    for i in range(len(imageShape)):
+        length, middle, short = imageShape[i]
+        lo, hi = np.searchsorted(lengths, [length*(1-lengthTolerance), length*(1+lengthTolerance)])
+        candidates = order[lo:hi]
+        candidates = candidates[(np.abs(catalogShape[candidates, 1]-middle) < ratioTolerance) &
+                                (np.abs(catalogShape[candidates, 2]-short) < ratioTolerance)]
+        for c in candidates:
+            found.append((i, c, imageHand[i] != catalogHand[c]))
+    return found
+
+def similarity(imagePoints, catalogPoints):
+    zi = imagePoints[:, 0]+1j*imagePoints[:, 1]
+    zc = catalogPoints[:, 0]+1j*catalogPoints[:, 1]
+    ci, cc = zi-zi.mean(), zc-zc.mean()
+    s = np.sum(np.conj(cc)*ci)/np.sum(np.abs(cc)**2)
+    return s, zi.mean()-s*zc.mean()
+
+# Image stars that a transform puts a catalog star on, as (image index, catalog index)
+def matchStars(transform, u, v, tree, width, height, tolerance):
+    s, t, flip = transform
+    z = s*(u+1j*(-v if flip else v))+t
+    inside = (z.real > -tolerance) & (z.real < width+tolerance) & (z.imag > -tolerance) & (z.imag < height+tolerance)
+    catalogIndex = np.flatnonzero(inside)
+    if len(catalogIndex) == 0:
+        return np.zeros(0, int), np.zeros(0, int)
+    distance, imageIndex = tree.query(np.column_stack([z.real[inside], z.imag[inside]]), distance_upper_bound=tolerance)
+    ok = np.isfinite(distance)
+    imageIndex, catalogIndex = imageIndex[ok], catalogIndex[ok]
+    # One catalog star per image star, the first (brightest) wins
+    imageIndex, first = np.unique(imageIndex, return_index=True)
+    return imageIndex, catalogIndex[first]
+
+# Fit the tangent point and CD matrix to matched stars, pixels relative to crpix
+def fitWcs(x, y, ra, dec, crpix, ra0, dec0):
+    design = np.column_stack([x-crpix[0], y-crpix[1], np.ones(len(x))])
+    for i in range(3):
+        xi, eta = project(ra, dec, ra0, dec0)
+        fitXi = np.linalg.lstsq(design, xi, rcond=None)[0]
+        fitEta = np.linalg.lstsq(design, eta, rcond=None)[0]
+        ra0, dec0 = deproject(fitXi[2], fitEta[2], ra0, dec0)
+    xi, eta = project(ra, dec, ra0, dec0)
+    residual = np.hypot(design @ fitXi-xi, design @ fitEta-eta)
+    cd = ((fitXi[0], fitXi[1]), (fitEta[0], fitEta[1]))
+    return float(ra0), float(dec0), cd, residual
+
+# CROTA1/CROTA2 in degrees from a CD matrix, with CDELT2 taken as positive
+def rotationFromCd(cd):
+    (cd11, cd12), (cd21, cd22) = cd
+    flip = -1 if cd11*cd22-cd12*cd21 < 0 else 1
+    return (float(np.degrees(np.arctan2(flip*cd21, flip*cd11))), float(np.degrees(np.arctan2(-cd12, cd22))))
+
+# Reach, scale and depth for StarIndex.pattern for a width x height image with a field
+# fov degrees high, searched radius degrees around the hint: catalog stars to the same
+# depth as the image stars used, per square degree
+def patternArgs(width, height, fov, radius, imageStars=30):
+    scale = fov/height
+    return radius+np.hypot(width, height)*scale/2, scale, imageStars/(fov*fov*width/height)
+
+# Solve an image given a hint. ra, dec and radius in degrees, fov the field height in
+# degrees. stars are the image's stars.Stars if already found. Returns a
+# wcsparse.Solution, None if no consistent match was found.
+def solveImage(image, index, ra, dec, fov, radius=1.0, imageStars=30, minMatches=8, tolerance=3.0,
+               stars=None, cancelled=lambda: False):
+    height, width = image.shape[-2:]
+    if stars is None:
+        stars = findStars(image, maxStars=100)
+    x, y = stars.x, stars.y
+    if len(x) < minMatches:
+        return None
+    scale = fov/height                                  # Degrees per pixel
+    fieldArea = fov*fov*width/height
+    catalog = index.pattern(ra, dec, *patternArgs(width, height, fov, radius, imageStars))
+    starRa, starDec, u, v = catalog.ra, catalog.dec, catalog.u, catalog.v
+    if len(starRa) < minMatches:
+        return None
+    patternStars = catalog.patternStars
+    checkStars = int(min(len(u), max(len(x), 1.5*len(x)*catalog.area/fieldArea)))
+    imagePattern = triangles(x[:imageStars], y[:imageStars])
+    catalogPattern = catalog.triangles
+    if cancelled():
+        return None
+
+    # Vote for (flip, rotation, shift) in coarse bins, then check the best supported ones
+    votes = {}
+    imagePoints = np.column_stack([x[:imageStars], y[:imageStars]])
+    catalogPoints = np.column_stack([u[:patternStars], v[:patternStars]])
+    for i, c, flip in candidateTransforms(imagePattern, catalogPattern):
+        points = catalogPoints[catalogPattern[0][c]]*([1, -1] if flip else [1, 1])
+        s, t = similarity(imagePoints[imagePattern[0][i]], points)
+        if abs(abs(s)-1) > 0.05:
+            continue
+        key = (flip, int(np.degrees(np.angle(s))//5), int(t.real//(20*tolerance)), int(t.imag//(20*tolerance)))
+        votes.setdefault(key, []).append((s, t, flip))
+    tree = spatial.cKDTree(np.column_stack([x, y]))
+    best = (np.zeros(0, int), np.zeros(0, int))
+    for key in sorted(votes, key=lambda k: -len(votes[k]))[:10]:
+        if cancelled():
+            return None
+        s, t, flip = votes[key][0]
+        matched = matchStars((s, t, flip), u[:checkStars], v[:checkStars], tree, width+1, height+1, tolerance)
+        if len(matched[0]) > len(best[0]):
+            best = matched
+    if len(best[0]) < minMatches:
+        return None
+
+    imageIndex, catalogIndex = best
+    crpix = ((width+1)/2, (height+1)/2)
+    solvedRa, solvedDec, cd, residual = fitWcs(x[imageIndex], y[imageIndex], starRa[catalogIndex],
+                                               starDec[catalogIndex], crpix, *catalog.center)
+    # Drop the odd wrong pairing and fit again
+    good = residual < max(3*np.median(residual), tolerance*scale/2)
+    if good.sum() < minMatches:
+        return None
+    solvedRa, solvedDec, cd, residual = fitWcs(x[imageIndex][good], y[imageIndex][good], starRa[catalogIndex][good],
+                                               starDec[catalogIndex][good], crpix, solvedRa, solvedDec)
+    return Solution(solved=True, crval=(solvedRa, solvedDec), crpix=crpix, cd=cd, crota=rotationFromCd(cd))
+
+#######################################################################################
+#### S O L V E R S ####################################################################
+#######################################################################################
+# LocalSolver runs solveImage on a worker thread, started and polled like SolverRunner,
+# on a FITS file or a frames.Frame (whose stars are then reused rather than found again).
+# Without a position hint, or with a search radius over maxRadius, it fails straight away
+# and leaves the blind solve to ASTAP, so the hints should start at maxRadius (see
+# searchRadii). prefetch() builds the pattern around a target before the slew to it.
+class LocalSolver:
+    def __init__(self, indexPath="stars.idx", maxRadius=2.0, timeout=10):
+        self.indexPath = indexPath
+        self.index = None
+        self.field = None                      # (width, height, fov) of the last frame solved
+        self.maxRadius = maxRadius
+        self.timeout = timeout
+        self.output = queue.Queue()
+        self.thread = None
+        self.result = None
+        self.cancelled = False
+
+    def start(self, fitsPath, args=()):
+        if self.running():
+            raise RuntimeError("A solve is already running")
+        self.result = None
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.run, args=(fitsPath, list(args)), daemon=True)
+        self.thread.start()
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def poll(self):
+        if self.running():
+            return None
+        return self.result
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+        return self.result
+
+    def cancel(self):
+        self.cancelled = True
+
+    # Build the pattern around a target (degrees) ahead of its solve, or once no frame has
+    # been solved yet just read the index there so the pages are in memory
+    def prefetch(self, ra, dec):
+        if self.index is None:
+            self.index = StarIndex(self.indexPath)
+        if self.field is not None:
+            self.index.pattern(ra, dec, *patternArgs(*self.field, self.maxRadius))
+        else:
+            self.index.region(ra, dec, self.maxRadius)
+
+    def run(self, fitsPath, args):
+        start = time.time()
+        status, solution = FAILED, None
+        try:
+            hints = dict(zip(args[::2], args[1::2]))
+            radius = float(hints.get("-r", 180))
+            if "-ra" not in hints or "-fov" not in hints or radius > self.maxRadius:
+                self.output.put("Local solver: no position hint within %g degrees, skipped" % self.maxRadius)
+            else:
+                if self.index is None:
+                    self.index = StarIndex(self.indexPath)
+                image = readImage(fitsPath)
+                self.field = (image.shape[-1], image.shape[-2], float(hints["-fov"]))
+                stars = fitsPath.stars() if hasattr(fitsPath, "stars") else None
+                solution = solveImage(image, self.index, float(hints["-ra"])*15, float(hints["-spd"])-90,
+                                      float(hints["-fov"]), radius, stars=stars,
+                                      cancelled=lambda: self.cancelled or time.time()-start > self.timeout)
+                if solution is not None:
+                    status = SOLVED
+        except Exception as e:
+            self.output.put("Local solver: "+str(e))
+        if self.cancelled:
+            status, solution = CANCELLED, None
+        elif status != SOLVED and time.time()-start > self.timeout:
+            status = TIMEOUT
+        self.output.put("Local solver: %s in %.2fs" % (status, time.time()-start))
+        self.result = SolveResult(status, solution, time.time()-start, 0)
+
+# The image data of a FITS file or a frames.Frame, the first plane of a colour image
+def readImage(source):
+    if hasattr(source, "fits"):
+        data = source.fits()[0].data
+    else:
+        with fits.open(source) as hdul:
+            data = np.array(hdul[0].data)
+    while data.ndim > 2:
+        data = data[0]
+    return data
+
+# Search radii for SolveHints with the local solver: its own maxRadius first, then for
+# local+astap the wider of the ASTAP radii. ASTAP alone keeps radii as they are.
+def searchRadii(engine, radii, localRadius):
+    if engine == "local":
+        return (localRadius,)
+    if engine == "local+astap":
+        return (localRadius,)+tuple(radius for radius in radii if radius > localRadius)
+    return tuple(radii)
+
+# SolverChain tries each solver in turn with the same file and arguments until one
+# solves, e.g. the local solver and then ASTAP. The solvers share one output queue.
+class SolverChain:
+    def __init__(self, *solvers):
+        self.solvers = solvers
+        self.output = solvers[0].output
+        for solver in solvers[1:]:
+            solver.output = self.output
+        self.current = None
+        self.elapsed = 0.0
+
+    def start(self, fitsPath, args=()):
+        self.fitsPath, self.args = fitsPath, args
+        self.current = 0
+        self.elapsed = 0.0
+        self.solvers[0].start(fitsPath, args)
+
+    def running(self):
+        return any(solver.running() for solver in self.solvers)
+
+    # Move on to the next solver when one fails, return the first solve or the last failure
+    def poll(self):
+        if self.current is None:
+            return None
+        result = self.solvers[self.current].poll()
+        if result is None:
+            return None
+        self.elapsed += result.elapsed
+        if result.status in (FAILED, TIMEOUT) and self.current+1 < len(self.solvers):
+            self.current += 1
+            self.solvers[self.current].start(self.fitsPath, self.args)
+            return None
+        return result._replace(elapsed=self.elapsed)
+
+    def wait(self):
+        while True:
+            result = self.poll()
+            if result is not None:
+                return result
+            self.solvers[self.current].wait()
+
+    def cancel(self):
+        for solver in self.solvers:
+            solver.cancel()
+
+#######################################################################################
+#### S Y N T H E T I C   F I E L D S ##################################################
+#######################################################################################
+# A random star catalog over part of the sky, roughly as dense as the real sky to mag 13
+def syntheticIndex(path, rng, raRange=(0, 90), decRange=(-10, 70), perSquareDegree=60):
+    lo, hi = np.sin(np.radians(decRange))
+    area = (raRange[1]-raRange[0])*np.degrees(hi-lo)
+    count = int(area*perSquareDegree)
+    ra = rng.uniform(raRange[0], raRange[1], count)
+    dec = np.degrees(np.arcsin(rng.uniform(lo, hi, count)))
+    mag = 13+np.log10(rng.uniform(1e-3, 1, count))/0.35  # N(<m) grows by 10^0.35 per magnitude
+    writeIndex(path, ra, dec, mag)
+
+# Render a frame of the index around (ra, dec) with the given field height, rotation and
+# mirror, Gaussian stars with catalog magnitudes jittered, a sky background and noise
+def render(index, ra, dec, fov, width, height, rotation, flip, rng, seeing=2.5, magError=0.2):
+    scale = fov/height
+    starRa, starDec, mag = index.region(ra, dec, np.hypot(width, height)*scale/2*1.1)
+    xi, eta = project(starRa, starDec, ra, dec)
+    z = (xi+1j*(-eta if flip else eta))/scale*np.exp(1j*np.radians(rotation))
+    x, y = z.real+(width+1)/2-1, z.imag+(height+1)/2-1
+    flux = 20000*10**(-0.4*(mag+rng.normal(0, magError, len(mag))-8))
+    image = rng.normal(1000, 15, (height, width))
+    sigma = seeing/2.355
+    for xs, ys, f in zip(x, y, flux):
+        x0, y0 = int(round(xs)), int(round(ys))
+        if not (-8 <= x0 < width+8 and -8 <= y0 < height+8):
+            continue
+        yy, xx = np.mgrid[max(0, y0-8):min(height, y0+9), max(0, x0-8):min(width, x0+9)]
+        image[yy, xx] += f/(2*np.pi*sigma**2)*np.exp(-((xx-xs)**2+(yy-ys)**2)/(2*sigma**2))
+    return np.clip(image, 0, 65535).astype(np.uint16)
+
+# python starsolve.py index <stars.csv> [stars.idx] builds an index from ra,dec,mag (degrees)
+# python starsolve.py [fields] solves synthetic fields rendered from a synthetic index
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "index":
+        stars = np.loadtxt(sys.argv[2], delimiter=",", usecols=(0, 1, 2), comments="#", ndmin=2)
+        writeIndex(sys.argv[3] if len(sys.argv) > 3 else "stars.idx", stars[:, 0], stars[:, 1], stars[:, 2])
+        print("Indexed %d stars" % len(stars))
+        sys.exit()
+
+    import tempfile
+    fields = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rng = np.random.default_rng(1)
+    path = os.path.join(tempfile.mkdtemp(), "stars.idx")
+    syntheticIndex(path, rng)
+    index = StarIndex(path)
+    width, height, fov = 1280, 1024, 1.0
+    times, resolveTimes, errors, failed = [], [], [], 0
+    for i in range(fields):
+        ra, dec = rng.uniform(20, 70), rng.uniform(10, 50)
+        image = render(index, ra, dec, fov, width, height, rng.uniform(0, 360), bool(rng.integers(2)), rng)
+        # The hint is up to half a degree off, as after a Goto
+        hintRa, hintDec = ra+rng.uniform(-0.5, 0.5)/np.cos(np.radians(dec)), dec+rng.uniform(-0.5, 0.5)
+        start = time.perf_counter()
+        solution = solveImage(image, index, hintRa, hintDec, fov, radius=1.0)
+        times.append(time.perf_counter()-start)
+        if solution is None:
+            failed += 1
+            continue
+        dRa = ((solution.crval[0]-ra+180) % 360-180)*np.cos(np.radians(dec))
+        errors.append(np.hypot(dRa, solution.crval[1]-dec)*3600)
+        # A re-solve while centring, the hint is the last solve and the pattern is built
+        start = time.perf_counter()
+        solveImage(image, index, solution.crval[0], solution.crval[1], fov, radius=1.0)
+        resolveTimes.append(time.perf_counter()-start)
+    print("%d stars indexed, %d fields of %.1f deg: %d solved, %d failed" % (len(index), fields, fov, fields-failed, failed))
+    print("solve time mean %.3fs, worst %.3fs" % (np.mean(times), np.max(times)))
+    print("re-solve with the pattern built mean %.3fs, worst %.3fs (%d patterns built)" %
+          (np.mean(resolveTimes), np.max(resolveTimes), index.builds))
+    if errors:
+        print("position error mean %.2f\", worst %.2f\"" % (np.mean(errors), np.max(errors)))
+
+    # The panel's default radii through LocalSolver, the first search must not be skipped
+    class Image:
+        def __init__(self, data):
+            self.data = data
+        def fits(self):
+            return [self]
+    solver = LocalSolver(path, maxRadius=2.0)
+    hints = dict(zip(["-ra", "-spd", "-fov"], ["%.5f" % (hintRa/15), "%.5f" % (hintDec+90), "%.3f" % fov]))
+    for radius in searchRadii("local+astap", (5, 15, 50), solver.maxRadius):
+        solver.start(Image(image), ["-r", "%g" % radius]+[item for pair in hints.items() for item in pair])
+        result = solver.wait()
+        print("LocalSolver radius %4g: %s" % (radius, result.status))
@@ -0,0 +1,250 @@
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError
+
+#######################################################################################
+#### S T A R T U P ####################################################################
+#######################################################################################
+# Startup brings the INDI devices up while the panel is already on screen. Each device
+# gets a sequence, a function run on its own thread that connects it and waits for the
+# properties the panel needs, calling step(name, function) for each wait so it is timed
+# and the status line can show what the device is waiting for. Sequences can wait for
+# others to be ready first (the devices wait for the server connection). The mainline
+# asks ready(device) before touching a device and shows status() while one is not up,
+# and report() is the startup timeline, so it is plain where boot time goes on the Pi.
+# When indiserver goes away restart() runs every sequence again, which connects, sets up
+# the devices and re-registers everything the panel needs on the new connection. A device
+# that fails is run again on its own, retryFirst seconds later, then twice as long and so
+# on up to retryLongest, so one driver being slow or missing does not stop the panel.
+WAITING = "waiting"
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+
+# A sequence from before a restart() is abandoned at its next step
+class Superseded(Exception):
+    pass
+
+class Startup:
+    def __init__(self, clock=time.monotonic, onDone=None, retryFirst=1.0, retryLongest=30.0):
+        self.clock = clock
+        self.onDone = onDone
+        self.retryFirst = retryFirst
+        self.retryLongest = retryLongest
+        self.began = clock()
+        self.lock = threading.Lock()
+        self.generation = 0                    # Bumped by restart()
+        self.restarts = 0
+        self.sequences = []                    # (device, sequence, after) in the order they were run
+        self.states = {}                       # Device -> state
+        self.current = {}                      # Device -> step it is waiting on
+        self.events = {}                       # Device -> Event set when it is ready or failed
+        self.timeline = []                     # (device, step, start, end, error), seconds from began
+        self.threads = []
+        self.delays = {}                       # Device -> seconds before it is run again if it fails
+        self.failures = 0                      # Failed runs of any sequence, all generations
+        self.settled = False                   # onDone has been called this generation
+
+    # Something that happened at one moment, like the window appearing
+    def mark(self, name):
+        now = self.clock()-self.began
+        with self.lock:
+            self.timeline.append(("panel", name, now, now, None))
+
+    # Start a device's sequence, after the devices in after are ready
+    def run(self, device, sequence, after=()):
+        with self.lock:
+            self.sequences.append((device, sequence, after))
+        self.launch(device, sequence, after)
+
+    def launch(self, device, sequence, after):
+        with self.lock:
+            self.states[device] = WAITING
+            self.events[device] = threading.Event()
+            generation = self.generation
+        thread = threading.Thread(target=self.sequence, args=(generation, device, sequence, after), daemon=True)
+        self.threads.append(thread)
+        thread.start()
+
+    # Run every sequence again from the start, after the server went away. Sequences still
+    # running from before are abandoned and the timeline starts again.
+    def restart(self):
+        with self.lock:
+            self.generation += 1
+            self.restarts += 1
+            self.began = self.clock()
+            self.timeline = [("panel", "restart %d" % self.restarts, 0.0, 0.0, None)]
+            self.states = {}
+            self.current = {}
+            old = self.events
+            self.events = {}
+            self.threads = []
+            self.delays = {}
+            self.settled = False
+            sequences = list(self.sequences)
+        # Wake sequences waiting on one from before so they see they are superseded
+        for event in old.values():
+            event.set()
+        for device, sequence, after in sequences:
+            self.launch(device, sequence, after)
+
+    def sequence(self, generation, device, sequence, after):
+        for other in after:
+            # restart() swaps events and states, so read them under the lock
+            with self.lock:
+                if self.generation != generation:
+                    return
+                event = self.events[other]
+            event.wait()
+            with self.lock:
+                if self.generation != generation:
+                    return
+                failed = self.states[other] != READY
+            if failed:
+                self.finish(generation, device, FAILED, "needs "+other)
+                return
+        with self.lock:
+            if self.generation != generation:
+                return
+            self.states[device] = STARTING
+        try:
+            sequence(lambda name, function: self.step(generation, device, name, function))
+        except (Superseded, CancelledError):
+            # A wait cancelled because the server went away, restart() runs it again
+            return
+        except Exception as e:
+            self.finish(generation, device, FAILED, str(e) or type(e).__name__)
+            return
+        self.finish(generation, device, READY)
+
+    def step(self, generation, device, name, function):
+        with self.lock:
+            if self.generation != generation:
+                raise Superseded()
+            self.current[device] = name
+        start = self.clock()-self.began
+        try:
+            result = function()
+        except Exception as e:
+            with self.lock:
+                if self.generation != generation:
+                    raise Superseded()
+                self.timeline.append((device, name, start, self.clock()-self.began, str(e) or type(e).__name__))
+            raise
+        with self.lock:
+            if self.generation != generation:
+                raise Superseded()
+            self.timeline.append((device, name, start, self.clock()-self.began, None))
+        return result
+
+    def finish(self, generation, device, state, error=None):
+        with self.lock:
+            if self.generation != generation:
+                return
+            self.states[device] = state
+            self.current.pop(device, None)
+            if error is not None:
+                now = self.clock()-self.began
+                self.timeline.append((device, "failed: "+error, now, now, error))
+            if state == FAILED:
+                self.failures += 1
+                delay = self.delays.get(device, self.retryFirst)
+                self.delays[device] = min(delay*2, self.retryLongest)
+            else:
+                self.delays.pop(device, None)
+            done = not self.settled and all(s in (READY, FAILED) for s in self.states.values())
+            self.settled = self.settled or done
+            event = self.events[device]
+        event.set()
+        if state == FAILED:
+            print("Startup of "+device+" failed, retrying in %.1fs -- " % delay, error)
+            timer = threading.Timer(delay, self.rerun, args=(generation, device))
+            timer.daemon = True
+            timer.start()
+        if done and self.onDone is not None:
+            self.onDone()
+
+    # Run a failed sequence again, unless a restart() has run them all since
+    def rerun(self, generation, device):
+        with self.lock:
+            if self.generation != generation or self.states.get(device) != FAILED:
+                return
+            device, sequence, after = next(entry for entry in self.sequences if entry[0] == device)
+        self.launch(device, sequence, after)
+
+    def state(self, device):
+        return self.states.get(device, WAITING)
+
+    def ready(self, device):
+        return self.states.get(device) == READY
+
+    def done(self):
+        states = self.states
+        return bool(states) and all(state == READY for state in states.values())
+
+    # One short line for the status label, the first device that is not ready yet
+    def status(self):
+        with self.lock:
+            for device, state in self.states.items():
+                if state == FAILED:
+                    return device.upper()+" FAILED"
+                if state != READY:
+                    return device+": "+self.current.get(device, state)
+        return "READY"
+
+    # The timeline, every step with when it started and how long it took
+    def report(self):
+        with self.lock:
+            lines = ["%6.2fs %6.2fs  %-20s %s" % (start, end-start, device, name)
+                     for device, name, start, end, error in sorted(self.timeline, key=lambda t: t[2])]
+            total = max([end for device, name, start, end, error in self.timeline], default=0.0)
+        return "\n".join(["Startup timeline (start, duration)"]+lines+["Startup took %.2fs" % total])
+
+    def join(self, timeout=None):
+        for thread in list(self.threads):
+            thread.join(timeout)
+
+# Call function until it returns something true, sleeping first, then twice as long and so
+# on up to longest seconds between attempts. onFailure(attempt, delay) is told of each
+# failure. Returns the number of failed attempts.
+def retry(function, first=0.5, longest=30.0, onFailure=None, sleep=time.sleep):
+    delay = first
+    attempt = 0
+    while not function():
+        attempt += 1
+        if onFailure is not None:
+            onFailure(attempt, delay)
+        sleep(delay)
+        delay = min(delay*2, longest)
+    return attempt
+
+#######################################################################################
+#### S I M U L A T I O N ##############################################################
+#######################################################################################
+# python startup.py [scale] runs the panel's startup sequences against simulated devices,
+# where each property takes a fixed time to appear, one device after the other as the
+# panels used to and concurrently through Startup
+if __name__ == "__main__":
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    # Seconds for each property to turn up, a guess at a Pi running the simulators
+    delays = {"server": [("connect", 0.2)],
+              "Telescope Simulator": [("device", 0.3), ("CONNECTION", 0.1), ("ON_COORD_SET", 0.6)],
+              "CCD Simulator": [("device", 0.4), ("CONNECTION", 0.1), ("CCD_EXPOSURE", 0.8),
+                                ("ACTIVE_DEVICES", 0.1), ("CCD1", 0.2)]}
+    sequences = {device: (lambda steps: lambda step: [step(name, lambda d=d: time.sleep(d*scale)) for name, d in steps])(steps)
+                 for device, steps in delays.items()}
+
+    start = time.monotonic()
+    for device, sequence in sequences.items():
+        sequence(lambda name, function: function())
+    serial = time.monotonic()-start
+
+    startup = Startup()
+    startup.run("server", sequences["server"])
+    for device in ("Telescope Simulator", "CCD Simulator"):
+        startup.run(device, sequences[device], after=("server",))
+    startup.mark("window shown")
+    startup.join()
+    print(startup.report())
+    print("One device after the other %.2fs" % serial)
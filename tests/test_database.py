@@ -0,0 +1,165 @@
+import threading
+import types
+
+import pytest
+
+import database
+from catalogstore import MySQLStore
+from database import Database
+
+# A connector module standing in for mysql.connector: connections answer every statement
+# with one row, count prepares and executes, and fail like a dropped connection once
+# dropped() is called until they are reconnected
+class Errors:
+    class Error(Exception):
+        pass
+    class InterfaceError(Error):
+        pass
+    class OperationalError(Error):
+        pass
+    class PoolError(Error):
+        pass
+    class ProgrammingError(Error):
+        pass
+
+class FakeServer:
+    def __init__(self):
+        self.connections = []
+        self.prepares = 0
+        self.executes = 0
+        self.pings = 0
+        self.down = False
+
+    def connect(self, **config):
+        if self.down:
+            raise Errors.InterfaceError("2003: Can't connect to MySQL server")
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def dropped(self):
+        for connection in self.connections:
+            connection.alive = False
+
+class FakeConnection:
+    def __init__(self, server):
+        self.server = server
+        self.alive = True
+
+    def is_connected(self):
+        self.server.pings += 1
+        return self.alive
+
+    def reconnect(self, attempts=1):
+        if self.server.down:
+            raise Errors.InterfaceError("2003: Can't connect to MySQL server")
+        self.alive = True
+
+    def cursor(self, prepared=False):
+        return FakeCursor(self)
+
+    def close(self):
+        self.alive = False
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.executed = None
+
+    def execute(self, sql, params):
+        if not self.connection.alive:
+            raise Errors.OperationalError("2013: Lost connection to MySQL server during query")
+        if "syntax" in sql:
+            raise Errors.ProgrammingError("1064: You have an error in your SQL syntax")
+        if sql is not self.executed:
+            self.connection.server.prepares += 1
+            self.executed = sql
+        self.connection.server.executes += 1
+        self.rows = [(sql, params)]
+
+    def fetchall(self):
+        return self.rows
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(database, "connector", types.SimpleNamespace(connect=server.connect, errors=Errors))
+    return server
+
+# Each statement is prepared once per connection and executed many times, without a ping
+def test_statements_prepared_once(server):
+    db = Database(poolSize=2, retryDelay=0)
+    for i in range(10):
+        assert db.query(MySQLStore.objectQuery, ("M %d" % i,)) == [(MySQLStore.objectQuery, ("M %d" % i,))]
+        db.query(MySQLStore.tourQuery, ("TOUR %d" % i,))
+    assert len(server.connections) == 1
+    assert server.prepares == 2
+    assert server.executes == 20
+    assert server.pings == 0
+    assert db.stats()["queries"][MySQLStore.objectQuery]["count"] == 10
+
+# A dropped connection is reconnected once, counted once, and its statements prepared again
+def test_dropped_connection_reconnects(server):
+    db = Database(poolSize=2, retryDelay=0)
+    db.query(MySQLStore.objectQuery, ("M 31",))
+    server.dropped()
+    assert db.query(MySQLStore.objectQuery, ("M 42",)) == [(MySQLStore.objectQuery, ("M 42",))]
+    assert db.stats()["reconnects"] == 1
+    assert db.stats()["failures"] == 0
+    assert server.prepares == 2
+    assert len(server.connections) == 1
+
+# A server that stays down fails the query after the retries and counts no reconnects
+def test_server_down_fails(server):
+    db = Database(poolSize=2, retries=3, retryDelay=0)
+    db.query(MySQLStore.objectQuery, ("M 31",))
+    server.down = True
+    server.dropped()
+    with pytest.raises(Errors.InterfaceError):
+        db.query(MySQLStore.objectQuery, ("M 42",))
+    assert db.stats()["reconnects"] == 0
+    assert db.stats()["failures"] == 1
+    server.down = False
+    db.query(MySQLStore.objectQuery, ("M 42",))
+    assert db.stats()["failures"] == 1
+
+# An exhausted pool is retried, not counted as a reconnect
+def test_pool_exhausted_is_not_a_reconnect(server):
+    db = Database(poolSize=1, retries=2, retryDelay=0, connection_timeout=0.05)
+    held = db.getConnection()
+    with pytest.raises(Errors.PoolError):
+        db.query(MySQLStore.objectQuery, ("M 31",))
+    assert db.stats()["reconnects"] == 0
+    assert db.stats()["failures"] == 1
+    db.putConnection(held)
+    db.query(MySQLStore.objectQuery, ("M 31",))
+
+# An error in the statement goes to the caller and the connection back to the pool
+def test_bad_statement_keeps_connection(server):
+    db = Database(poolSize=1, retryDelay=0, connection_timeout=0.05)
+    with pytest.raises(Errors.ProgrammingError):
+        db.query("select syntax error")
+    db.query(MySQLStore.objectQuery, ("M 31",))
+    assert len(server.connections) == 1
+
+# Reconnects counted from many threads at once are not lost
+def test_reconnects_counted_across_threads(server):
+    db = Database(poolSize=8, retryDelay=0)
+    def run():
+        for i in range(50):
+            db.query(MySQLStore.objectQuery, ("M 31",))
+    threads = [threading.Thread(target=run) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.dropped()
+    threads = [threading.Thread(target=run) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    reconnected = sum(connection.alive for connection in server.connections)
+    assert reconnected >= 1
+    assert db.stats()["reconnects"] == reconnected
+    assert db.stats()["failures"] == 0
@@ -0,0 +1,43 @@
+import time
+
+from executor import Executor, LoopRoot, latencyTest
+
+# Digits pressed while slow Gotos run get their feedback within 50ms through the executor,
+# and do not when the Goto runs on the Tk thread
+def test_press_to_feedback_under_50ms():
+    latencies, done, executor = latencyTest(0.3, blocking=False)
+    assert len(latencies) == 100
+    assert latencies[-1] < 0.05
+    assert done >= 1
+    blocked, done, executor = latencyTest(0.3, blocking=True, digits=20, gotos=3)
+    assert blocked[-1] > 0.05
+
+# A newer job of the same name cancels the older one, and what the older one queued for the
+# UI is dropped
+def test_replaced_job_is_dropped():
+    root = LoopRoot()
+    executor = Executor(root)
+    shown = []
+    def job(job, value):
+        time.sleep(0.1)
+        executor.ui(job, shown.append, value)
+    executor.submit("goto", job, 1)
+    executor.submit("goto", job, 2)
+    executor.submit("other", job, 3)
+    root.run(0.5)
+    assert shown == [2, 3]
+    assert executor.cancels == 1
+
+def test_cancel_drops_everything():
+    root = LoopRoot()
+    executor = Executor(root)
+    shown = []
+    def job(job):
+        time.sleep(0.1)
+        executor.ui(job, shown.append, "late")
+    executor.submit("goto", job)
+    executor.submit("prefetch", job)
+    time.sleep(0.02)
+    executor.cancel()
+    root.run(0.4)
+    assert shown == []
@@ -0,0 +1,78 @@
+import io
+import zlib
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from fakeindi import FakeIndiServer, fetchFrame
+from frames import Frame
+from stars import syntheticFrame
+
+def fitsBytes(image):
+    out = io.BytesIO()
+    fits.PrimaryHDU(image).writeto(out)
+    return out.getvalue()
+
+@pytest.fixture(scope="module")
+def blob():
+    data = fitsBytes(syntheticFrame(640, 480, 100, np.random.default_rng(2))[0])
+    return data, zlib.compress(data)
+
+def test_uncompressed_blob_is_not_copied(blob):
+    data, compressed = blob
+    assert Frame.fromBlob(data, ".fits", len(data)).data is data
+
+# The announced size right, short, long and missing, inflated a little at a time too
+@pytest.mark.parametrize("error", [0, -1000, 1000, None])
+@pytest.mark.parametrize("chunk", [1 << 20, 4096])
+def test_compressed_blob_whatever_size_is_announced(blob, error, chunk):
+    data, compressed = blob
+    size = 0 if error is None else len(data)+error
+    frame = Frame.fromBlob(compressed, ".fits.z", size, chunk)
+    assert bytes(frame.data) == data
+    assert frame.header()["NAXIS1"] == 640
+
+@pytest.mark.parametrize("cut", [10, 0.5, -4])
+def test_truncated_stream_raises(blob, cut):
+    data, compressed = blob
+    end = int(len(compressed)*cut) if isinstance(cut, float) else cut % len(compressed)
+    with pytest.raises(zlib.error):
+        Frame.fromBlob(compressed[:end], ".fits.z", len(data), 4096)
+
+# A full resolution PiCam frame through the fake INDI server, raw and compressed
+@pytest.mark.parametrize("compress", [False, True])
+def test_large_blob_from_fake_server(compress):
+    image = syntheticFrame(3280, 2464, 300, np.random.default_rng(1))[0]
+    server = FakeIndiServer(image=image, port=0).start()
+    try:
+        frame, received, transfer, decode = fetchFrame(server.port, compress)
+    finally:
+        server.stop()
+    assert np.array_equal(frame.fits()[0].data, image)
+    # Base64 on the wire makes a raw BLOB a third bigger than the FITS
+    if compress:
+        assert received < len(frame.data)
+    else:
+        assert received > len(frame.data)
+    frame.close()
+
+# A binned, cropped frame takes the full frame's stars rather than finding them again, and
+# they land on the true positions in its binned pixels
+def test_preprocessed_frame_reuses_stars(monkeypatch):
+    import stars
+    image, x, y = syntheticFrame(1280, 960, 150, np.random.default_rng(3))
+    frame = Frame(fitsBytes(image))
+    calls = []
+    findStars = stars.findStars
+    monkeypatch.setattr(stars, "findStars", lambda data: calls.append(1) or findStars(data))
+    small = frame.preprocess(2, 0.5)
+    found = small.stars()
+    assert len(calls) == 1
+    assert small.stars() is found and frame.stars().x.size >= found.x.size > 20
+    # The crop is 640x480 from (320, 240), binned to 320x240
+    height, width = small.fits()[0].data.shape
+    assert (width, height) == (320, 240)
+    assert np.all((found.x > 0.5) & (found.x < width+0.5) & (found.y > 0.5) & (found.y < height+0.5))
+    trueX, trueY = (x-320-0.5)/2+0.5, (y-240-0.5)/2+0.5
+    distance = np.hypot(found.x[:, None]-trueX[None, :], found.y[:, None]-trueY[None, :]).min(axis=1)
+    assert np.median(distance) < 0.2
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PyIndi")
+
+from fakeindi import reconnectTest
+
+# Kill the fake INDI server under IndiClient, mid exposure and mid startup, and check the
+# panels' mainline saw the disconnect, restarted startup once, resynced and got a frame
+@pytest.mark.parametrize("during", ["exposure", "startup"])
+def test_reconnect(during):
+    image = np.zeros((480, 640), np.uint16)
+    killed, events, attempts, resent, startup, client = reconnectTest(image, 0.5, during)
+    assert client.disconnects == 1
+    assert startup.restarts == 1
+    assert startup.failures == 0
+    assert killed <= events["disconnect seen"] <= events["restarted"]
+    assert events["restarted"] <= events["ready"] <= events["frame"]
+    assert "CCD1" in resent and "CCD_COMPRESSION" in resent and "CCD_EXPOSURE" in resent
@@ -0,0 +1,76 @@
+import os
+import stat
+import sys
+import time
+import pytest
+
+from solver import SolverRunner, SOLVED, FAILED, TIMEOUT, CANCELLED
+
+canned = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "solve.wcs")
+
+# A fake astap: prints a line, then runs body with fits set to the -f argument
+def fakeAstap(tmp_path, body):
+    path = tmp_path/"astap"
+    path.write_text("#!%s\nimport shutil, sys, time\nfits = sys.argv[sys.argv.index('-f')+1]\n"
+                    "print('fake astap', ' '.join(sys.argv[1:]), flush=True)\n%s\n" % (sys.executable, body))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+@pytest.fixture
+def fitsPath(tmp_path):
+    path = tmp_path/"solve.fits"
+    path.write_bytes(b"")
+    return str(path)
+
+def runner(command, tmp_path, timeout=10):
+    return SolverRunner(command, timeout=timeout, errPath=str(tmp_path/"solve.err"))
+
+def test_solved_with_canned_wcs(tmp_path, fitsPath):
+    solver = runner(fakeAstap(tmp_path, "shutil.copy(%r, fits[:-5]+'.wcs')" % canned), tmp_path)
+    solver.start(fitsPath, ["-r", "5"])
+    result = solver.wait()
+    assert result.status == SOLVED and result.returncode == 0 and result.error is None
+    assert result.solution.crval == pytest.approx((26.2677533643, 37.92824879526))
+    assert solver.output.get_nowait().startswith("fake astap -r 5 -f")
+    assert (tmp_path/"solve.err").read_text().startswith("fake astap")
+
+def test_no_wcs_is_failed(tmp_path, fitsPath):
+    solver = runner(fakeAstap(tmp_path, "sys.exit(1)"), tmp_path)
+    solver.start(fitsPath)
+    result = solver.wait()
+    assert result.status == FAILED and result.returncode == 1 and result.solution is None
+
+# A solution left from the last run must not be read as this one's
+def test_stale_wcs_is_removed(tmp_path, fitsPath):
+    (tmp_path/"solve.wcs").write_bytes(open(canned, "rb").read())
+    solver = runner(fakeAstap(tmp_path, "pass"), tmp_path)
+    solver.start(fitsPath)
+    assert solver.wait().status == FAILED
+
+def test_timeout_kills_the_solver(tmp_path, fitsPath):
+    solver = runner(fakeAstap(tmp_path, "time.sleep(30)"), tmp_path, timeout=0.5)
+    start = time.monotonic()
+    solver.start(fitsPath)
+    result = solver.wait()
+    assert result.status == TIMEOUT
+    assert time.monotonic()-start < 5
+    assert solver.process.poll() is not None
+
+def test_cancel_kills_the_solver(tmp_path, fitsPath):
+    solver = runner(fakeAstap(tmp_path, "time.sleep(30)"), tmp_path)
+    solver.start(fitsPath)
+    time.sleep(0.3)
+    assert solver.poll() is None
+    start = time.monotonic()
+    solver.cancel()
+    result = solver.wait()
+    assert result.status == CANCELLED
+    assert time.monotonic()-start < 5
+
+# ASTAP missing ends the solve with the reason rather than leaving it without a result
+def test_missing_solver_fails_with_error(tmp_path, fitsPath):
+    solver = runner(str(tmp_path/"no-astap"), tmp_path)
+    solver.start(fitsPath)
+    result = solver.wait()
+    assert result.status == FAILED and result.error
+    assert solver.poll() is result
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from solver import SOLVED, FAILED
+from starsolve import StarIndex, LocalSolver, render, syntheticIndex
+
+width, height, fov = 1280, 1024, 1.0
+
+@pytest.fixture(scope="module")
+def indexPath(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("index")/"stars.idx")
+    syntheticIndex(path, np.random.default_rng(1))
+    return path
+
+# Fields rendered from the index, written as FITS files, with where they really are and
+# the mount's position, up to half a degree off as after a Goto
+@pytest.fixture(scope="module")
+def fields(indexPath, tmp_path_factory):
+    rng = np.random.default_rng(5)
+    index = StarIndex(indexPath)
+    directory = tmp_path_factory.mktemp("fields")
+    fields = []
+    for i in range(5):
+        ra, dec = rng.uniform(20, 70), rng.uniform(10, 50)
+        image = render(index, ra, dec, fov, width, height, rng.uniform(0, 360), bool(rng.integers(2)), rng)
+        path = str(directory/("field%d.fits" % i))
+        fits.PrimaryHDU(image).writeto(path)
+        hint = (ra+rng.uniform(-0.5, 0.5)/np.cos(np.radians(dec)), dec+rng.uniform(-0.5, 0.5))
+        fields.append((path, ra, dec, hint))
+    return fields
+
+def hintArgs(ra, dec, radius):
+    return ["-r", "%g" % radius, "-ra", "%.5f" % (ra/15), "-spd", "%.5f" % (dec+90), "-fov", "%.3f" % fov]
+
+def test_solves_within_5_arcsec(indexPath, fields):
+    solver = LocalSolver(indexPath, maxRadius=2.0)
+    for path, ra, dec, hint in fields:
+        solver.start(path, hintArgs(*hint, 2.0))
+        result = solver.wait()
+        assert result.status == SOLVED, path
+        dRa = ((result.solution.crval[0]-ra+180) % 360-180)*np.cos(np.radians(dec))
+        assert np.hypot(dRa, result.solution.crval[1]-dec)*3600 < 5.0
+
+# Beyond maxRadius or without a position it leaves the solve to ASTAP
+def test_skips_without_a_close_hint(indexPath, fields):
+    path, ra, dec, hint = fields[0]
+    solver = LocalSolver(indexPath, maxRadius=2.0)
+    solver.start(path, hintArgs(*hint, 5.0))
+    assert solver.wait().status == FAILED
+    solver.start(path, ["-r", "2", "-fov", "1.0"])
+    assert solver.wait().status == FAILED
+    assert solver.index is None
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from startup import Startup, WAITING, STARTING, READY, FAILED
+
+def waitFor(condition, timeout=5.0):
+    end = time.monotonic()+timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
+
+# A device that always fails is retried and leaves the others ready
+def test_failed_device_is_retried_and_others_run():
+    runs = []
+    def broken(step):
+        runs.append(time.monotonic())
+        step("device", lambda: 1/0)
+    startup = Startup(retryFirst=0.05, retryLongest=0.1)
+    startup.run("server", lambda step: step("connect", lambda: True))
+    startup.run("telescope", lambda step: step("device", lambda: True), after=("server",))
+    startup.run("ccd", broken, after=("server",))
+    waitFor(lambda: len(runs) >= 3)
+    assert startup.ready("telescope")
+    assert startup.state("ccd") in (FAILED, WAITING, STARTING)
+    assert not startup.done()
+    assert startup.failures >= 2
+
+# A sequence that fails once comes up on the retry
+def test_retry_brings_device_up():
+    attempts = []
+    def flaky(step):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("not yet")
+    startup = Startup(retryFirst=0.05)
+    startup.run("ccd", flaky)
+    waitFor(startup.done)
+    assert startup.state("ccd") == READY and len(attempts) == 2
+
+# A restart while sequences wait on the server abandons them without failures
+def test_restart_abandons_waiting_sequences():
+    release = threading.Event()
+    startup = Startup()
+    startup.run("server", lambda step: step("connect", release.wait))
+    startup.run("ccd", lambda step: step("device", lambda: True), after=("server",))
+    startup.restart()
+    release.set()
+    waitFor(startup.done)
+    assert startup.failures == 0 and startup.restarts == 1
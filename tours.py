@@ -0,0 +1,254 @@
+import sys
+import threading
+import time
+import numpy as np
+
+#######################################################################################
+#### T O U R S ########################################################################
+#######################################################################################
+# TourEngine holds the tour being worked through. load() takes the whole tour from the
+# in-memory catalog at once and puts it in order: as listed in the tours table, "setting",
+# the ones that set first first, from the night plan, or "slew", the order route (a
+# route.RouteOptimizer) finds wastes least time from where the mount is now. Prev/Next
+# (step()) move along it, skipping entries the night plan says are below minAlt, without
+# touching the store or astropy.
+#
+# Each step also asks for the entry after it to be prefetched: its coordinates, the full
+# precision altitude check Goto makes and a warm-up of the solver's star index around it
+# (warm), so when Goto is pressed on it the slew starts straight away. prefetch() is slow
+# and runs on the executor's worker, stop() and step() only read what it left behind.
+# A prefetched altitude is trusted for maxAge seconds.
+class TourStop:
+    def __init__(self, name, ra, dec, alt, fetched):
+        self.name = name
+        self.ra = ra                           # Hours
+        self.dec = dec
+        self.alt = alt                         # None when the object is not in the catalog
+        self.fetched = fetched
+
+class TourEngine:
+    def __init__(self, catalog, altAz, lookup=None, warm=None, plan=lambda: None, route=None, minAlt=15,
+                 maxAge=120, clock=time.monotonic):
+        self.catalog = catalog
+        self.altAz = altAz                     # altAz(ra, dec) -> alt, az, full precision
+        self.lookup = lookup                   # For names not in the catalog, e.g. the store
+        self.warm = warm                       # warm(ra, dec), prepares the solve of a target
+        self.plan = plan                       # Returns the NightPlan, or None while it builds
+        self.route = route                     # route(names, ra, dec) -> names in slew order
+        self.minAlt = minAlt
+        self.maxAge = maxAge
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.name = None
+        self.names = []
+        self.index = -1
+        self.stops = {}                        # Name -> TourStop, prefetched
+        self.stepTimes = []                    # Seconds per Prev/Next
+        self.hits = 0
+        self.misses = 0
+
+    # Load a tour, returns False if there is no such tour
+    def load(self, name, order="listed"):
+        names = self.catalog.tour(name)
+        if not names:
+            return False
+        names = self.order(list(names), order)
+        with self.lock:
+            self.name = name
+            self.names = names
+            self.index = -1
+            self.stops = {}
+        return True
+
+    def order(self, names, order):
+        if order == "slew" and self.route is not None:
+            rows = [self.catalog.lookup(name) for name in names]
+            known = [name for name, row in zip(names, rows) if row is not None]
+            found = [row for row in rows if row is not None]
+            # Names the catalog does not have go last, as listed
+            return self.route(known, [row[1] for row in found], [row[2] for row in found]) + \
+                [name for name, row in zip(names, rows) if row is None]
+        plan = self.plan()
+        if order in ("listed", "slew") or plan is None:
+            return names
+        if order == "setting":
+            rise, transit, setting, peak = plan.riseTransitSet(names, self.minAlt)
+            # Never setting (or never rising) last, in transit order
+            key = np.where(np.isnan(setting), transit+1e6, setting)
+            return [names[i] for i in np.argsort(key, kind="stable")]
+        raise ValueError("Unknown tour order "+order)
+
+    def active(self):
+        return bool(self.names)
+
+    def clear(self):
+        with self.lock:
+            self.name = None
+            self.names = []
+            self.index = -1
+            self.stops = {}
+
+    # Move to the next (step 1) or previous (step -1) entry that is up, returns its name,
+    # None if there is no tour. Entries are all offered while the night plan is building.
+    def step(self, step):
+        start = self.clock()
+        with self.lock:
+            if not self.names:
+                return None
+            count = len(self.names)
+            # Before the first step, Next goes to the first entry and Prev to the last
+            index = self.index
+            if index < 0:
+                index = count-1 if step > 0 else 0
+            plan = self.plan()
+            next = plan.nextVisible(self.names, index, step, self.minAlt) if plan is not None else None
+            if next is None:
+                next = (index+step) % count
+            self.index = next
+            name = self.names[next]
+        self.stepTimes.append(self.clock()-start)
+        return name
+
+    # The first entry that is up, the one Goto on a tour slews to
+    def first(self):
+        with self.lock:
+            self.index = -1
+        return self.step(1)
+
+    # Names of the entries to prefetch after a step in this direction: the current one if
+    # it has not been, and the next one that is up
+    def upcoming(self, step):
+        with self.lock:
+            if not self.names or self.index < 0:
+                return []
+            names = [self.names[self.index]]
+            plan = self.plan()
+            next = plan.nextVisible(self.names, self.index, step, self.minAlt) if plan is not None else None
+            if next is None:
+                next = (self.index+step) % len(self.names)
+            if next != self.index:
+                names.append(self.names[next])
+        return [name for name in names if self.stop(name, count=False) is None]
+
+    # Look up, check and warm a target, on the worker thread
+    def prefetch(self, name, cancelled=lambda: False):
+        row = self.catalog.lookup(name)
+        if row is None and self.lookup is not None:
+            try:
+                row = self.lookup(name)
+            except Exception as e:
+                print("Unable to look up", name, "-- ", e)
+        if row is None:
+            stop = TourStop(name, None, None, None, self.clock())
+        else:
+            alt, az = self.altAz(row[1], row[2])
+            if self.warm is not None and not cancelled():
+                try:
+                    self.warm(row[1], row[2])
+                except Exception as e:
+                    print("Unable to prepare the solve of", name, "-- ", e)
+            stop = TourStop(row[0], row[1], row[2], float(alt), self.clock())
+        with self.lock:
+            if name in self.names:
+                self.stops[name] = stop
+        return stop
+
+    # The prefetched stop for a name if it is fresh enough, else None
+    def stop(self, name, count=True):
+        with self.lock:
+            stop = self.stops.get(name)
+        fresh = stop is not None and self.clock()-stop.fetched < self.maxAge
+        if count:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return stop if fresh else None
+
+    def report(self):
+        times = sorted(self.stepTimes)
+        steps = "none" if not times else "%d, median %.3fms, worst %.3fms" % \
+            (len(times), times[len(times)//2]*1000, times[-1]*1000)
+        return "Tour steps %s, Goto on a prefetched target %d, not prefetched %d" % (steps, self.hits, self.misses)
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# python tours.py [count] [dwell] works through a count object tour (100 by default) with
+# Next then Goto at each entry, dwell seconds apart, once looking each target up when Goto
+# is pressed as gotoEntry did and once from the prefetch, using the real astropy check and
+# a star index warm-up, and prints the Next and Goto press latencies
+if __name__ == "__main__":
+    import os
+    import tempfile
+    from catalog import CatalogIndex
+    from observer import Observer
+    from planner import Planner
+    from starsolve import StarIndex, syntheticIndex
+    from executor import Executor, LoopRoot
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    dwell = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    rng = np.random.default_rng(3)
+    catalog = CatalogIndex(None)
+    catalog.setObjects([("M %d" % i, rng.uniform(0, 6), rng.uniform(0, 60)) for i in range(1, count+1)])
+    catalog.setTours([("Tour", "M %d" % i) for i in range(1, count+1)])
+    observer = Observer(49.8951, -97.1384, 300)
+    plan = Planner(observer, planDir=None).plan(catalog)
+    path = os.path.join(tempfile.mkdtemp(), "stars.idx")
+    syntheticIndex(path, rng, raRange=(0, 90), decRange=(-10, 70))
+    index = StarIndex(path)
+    observer.altAz(0, 0)
+
+    def warm(ra, dec):
+        index.region(ra*15, dec, 2.0)
+
+    # Goto as it was: look up, check the altitude and slew, all on the press
+    def lookupGoto(name):
+        row = catalog.lookup(name)
+        alt, az = observer.altAz(row[1], row[2])
+        warm(row[1], row[2])
+        return alt > 15
+
+    for prefetching in (False, True):
+        root = LoopRoot()
+        executor = Executor(root)
+        tour = TourEngine(catalog, observer.altAz, warm=warm, plan=lambda: plan, minAlt=15)
+        tour.load("Tour")
+        nexts, gotos = [], []
+
+        def prefetchJob(job, names):
+            for name in names:
+                if job.cancelled():
+                    return
+                tour.prefetch(name, job.cancelled)
+
+        def nextPress():
+            start = time.perf_counter()
+            tour.step(1)
+            if prefetching:
+                executor.submit("prefetch", prefetchJob, tour.upcoming(1))
+            nexts.append(time.perf_counter()-start)
+
+        def gotoPress():
+            start = time.perf_counter()
+            name = tour.names[tour.index]
+            stop = tour.stop(name) if prefetching else None
+            if stop is None:
+                lookupGoto(name)
+            gotos.append(time.perf_counter()-start)
+
+        tour.first()
+        if prefetching:
+            executor.submit("prefetch", prefetchJob, tour.upcoming(1))
+        for i in range(count):
+            root.after(int(dwell*1000*(2*i+1)), gotoPress)
+            root.after(int(dwell*1000*(2*i+2)), nextPress)
+        root.run(dwell*(2*count+2))
+        nexts.sort()
+        gotos.sort()
+        print("%-11s Next median %.3fms worst %.3fms, Goto press to slew median %.2fms worst %.2fms" %
+              ("prefetch" if prefetching else "on press", nexts[len(nexts)//2]*1000, nexts[-1]*1000,
+               gotos[len(gotos)//2]*1000, gotos[-1]*1000))
+        if prefetching:
+            print(tour.report())
@@ -0,0 +1,104 @@
+import mmap
+import os
+import sys
+import time
+from collections import namedtuple
+
+#######################################################################################
+#### W C S   P A R S E R ##############################################################
+#######################################################################################
+# ASTAP writes its result twice: solve.wcs is a FITS header without data (80 byte cards,
+# newline terminated and not padded to 2880 bytes, which is why fits.open kept bombing
+# with a corrupt file error) and solve.ini is KEY=value lines. Both are read here in one
+# pass over a memory-mapped file, no shell pipelines and no astropy needed.
+Solution = namedtuple("Solution", ["solved", "crval", "crpix", "cd", "crota"])
+
+wantedKeys = (b"PLTSOLVD", b"CRVAL1", b"CRVAL2", b"CRPIX1", b"CRPIX2",
+              b"CD1_1", b"CD1_2", b"CD2_1", b"CD2_2", b"CROTA1", b"CROTA2")
+
+# Convert a FITS/ini value field to a Python value, dropping any "/ comment"
+def parseValue(field):
+    field = field.strip()
+    if field.startswith(b"'"):
+        return field[1:field.index(b"'", 1)].decode("ascii", "replace").strip()
+    field = field.split(b"/", 1)[0].strip()
+    if field in (b"T", b"F"):
+        return field == b"T"
+    try:
+        return float(field)
+    except ValueError:
+        return field.decode("ascii", "replace")
+
+# Yield the cards/lines of the mapped file, either newline separated or raw 80 byte cards
+def cards(mm):
+    if mm.find(b"\n", 0, 81) >= 0:
+        start = 0
+        while start < len(mm):
+            end = mm.find(b"\n", start)
+            if end < 0:
+                end = len(mm)
+            yield mm[start:end]
+            start = end+1
+    else:
+        for start in range(0, len(mm), 80):
+            yield mm[start:start+80]
+
+# Read a .wcs or .ini file written by ASTAP and return a Solution, None if the file is empty
+def readWcs(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            values = {}
+            for card in cards(mm):
+                if card.startswith(b"END") and card[3:].strip() == b"":
+                    break
+                key, sep, field = card.partition(b"=")
+                key = key.strip()
+                if sep and key in wantedKeys:
+                    values[key.decode()] = parseValue(field)
+
+    def get(key):
+        return values.get(key)
+    return Solution(solved=bool(values.get("PLTSOLVD", False)),
+                    crval=(get("CRVAL1"), get("CRVAL2")),
+                    crpix=(get("CRPIX1"), get("CRPIX2")),
+                    cd=((get("CD1_1"), get("CD1_2")), (get("CD2_1"), get("CD2_2"))),
+                    crota=(get("CROTA1"), get("CROTA2")))
+
+#######################################################################################
+#### B E N C H M A R K ################################################################
+#######################################################################################
+# python wcsparse.py [solve.wcs] [iterations] compares readWcs with the old grep|cut kludge
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    source = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else "solve.wcs")
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    workdir = tempfile.mkdtemp()
+    shutil.copy(source, os.path.join(workdir, "solve.wcs"))
+    os.chdir(workdir)
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        os.system("cat solve.wcs | grep CRVAL1 | cut -b12-30 > solve.kludge")
+        os.system("cat solve.wcs | grep CRVAL2 | cut -b12-30 >> solve.kludge")
+        kludgefile = open("solve.kludge", "r")
+        rastr = kludgefile.read(19)
+        kludgefile.read(1)
+        decstr = kludgefile.read(19)
+        kludgefile.close()
+        kludge = (float(rastr), float(decstr))
+    kludgeTime = (time.perf_counter()-start)/iterations
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        solution = readWcs("solve.wcs")
+    parseTime = (time.perf_counter()-start)/iterations
+
+    shutil.rmtree(workdir)
+    print("kludge  CRVAL", kludge, "%.3f ms per solve" % (kludgeTime*1000))
+    print("readWcs CRVAL", solution.crval, "%.3f ms per solve" % (parseTime*1000))
+    print(solution)
+    print("speedup %.0fx" % (kludgeTime/parseTime))